@@ -82,11 +82,18 @@ KH_VECTORSTORE = {
     "__type__": "kotaemon.storages.ChromaVectorStore",
     # "__type__": "kotaemon.storages.MilvusVectorStore",
     # "__type__": "kotaemon.storages.QdrantVectorStore",
+    # "__type__": "kotaemon.storages.HNSWVectorStore",
+    # "ef": 64,  # HNSWVectorStore recall/latency trade-off
     "path": str(KH_USER_DATA_DIR / "vectorstore"),
 }
 KH_LLMS = {}
 KH_EMBEDDINGS = {}
 
+# connection pool shared by the OpenAI chat and embedding clients
+KH_OPENAI_MAX_CONNECTIONS = config("KH_OPENAI_MAX_CONNECTIONS", default=100, cast=int)
+KH_OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+KH_OPENAI_KEEPALIVE_EXPIRY = 30.0
+
 # populate options from config
 if config("AZURE_OPENAI_API_KEY", default="") and config(
     "AZURE_OPENAI_ENDPOINT", default=""
@@ -228,6 +235,22 @@ KH_REASONINGS = [
     "ktem.reasoning.rewoo.RewooAgentPipeline",
 ]
 KH_REASONINGS_USE_MULTIMODAL = False
+# coalesce the streamed answer: seconds between UI updates, and the number of
+# characters that triggers an update earlier
+KH_CHAT_STREAM_INTERVAL = 0.05
+KH_CHAT_STREAM_MAX_CHARS = 256
+# seconds to wait for the retrievers running concurrently, the slower ones are
+# left out of the answer
+KH_RETRIEVER_TIMEOUT = 60
+# answer the sub-questions of the decomposed questions concurrently
+KH_DECOMPOSE_CONCURRENT = True
+# cache the answers of the reasoning pipelines in memory: max number of answers,
+# seconds an answer is valid, and min cosine similarity of the question embeddings
+# to reuse an answer (None to only reuse the answers of the same question)
+KH_ANSWER_CACHE = False
+KH_ANSWER_CACHE_SIZE = 1000
+KH_ANSWER_CACHE_TTL = 24 * 3600
+KH_ANSWER_CACHE_SIMILARITY = None
 KH_VLM_ENDPOINT = "{0}/openai/deployments/{1}/chat/completions?api-version={2}".format(
     config("AZURE_OPENAI_ENDPOINT", default=""),
     config("OPENAI_VISION_DEPLOYMENT_NAME", default="gpt-4o"),
@@ -259,6 +282,35 @@ SETTINGS_REASONING = {
 }
 
 
+# LLM relevance scoring: max concurrent LLM calls of the process, chunks scored
+# per LLM call, and number of relevant chunks after which the scoring stops (0 to
+# score all the retrieved chunks)
+KH_RERANKING_MAX_WORKERS = 8
+KH_RERANKING_BATCH_SIZE = 1
+KH_RERANKING_EARLY_STOP = 0
+
+# number of processes used to parse the pages of an OCR-ed PDF (1 parses them in
+# the indexing process)
+KH_OCR_MAX_WORKERS = 1
+
+# number of processes used to render the page thumbnails of a PDF (1 renders them
+# in the indexing process)
+KH_PDF_THUMBNAIL_MAX_WORKERS = 1
+
+# background embedding jobs of the quick index mode: number of worker threads,
+# running jobs per index, embedded batches per minute per index (0 for no limit),
+# attempts before a job is failed, and seconds after which a running job that is
+# not updated anymore (e.g. interrupted by a restart) is run again
+KH_INDEXING_JOB_WORKERS = 2
+KH_INDEXING_JOB_INDEX_CONCURRENCY = 1
+KH_INDEXING_JOB_BATCHES_PER_MINUTE = 0
+KH_INDEXING_JOB_MAX_ATTEMPTS = 3
+KH_INDEXING_JOB_STALE_AFTER = 600
+
+# number of documents of the streaming loaders (Excel, HTML, text, PDF thumbnails)
+# split and stored at once when indexing a file
+FILE_INDEX_PIPELINE_DOCS_WINDOW = 32
+
 KH_INDEX_TYPES = [
     "ktem.index.file.FileIndex",
     "ktem.index.file.graph.GraphRAGIndex",
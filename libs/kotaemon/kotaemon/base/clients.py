@@ -0,0 +1,173 @@
+"""Process-wide registry of OpenAI API clients
+
+Constructing an `OpenAI`/`AzureOpenAI` client for every request opens a new
+connection pool, so every call pays the connection setup and the TLS handshake.
+The registry keeps one client per client class, endpoint and credentials, backed by
+a keep-alive HTTP connection pool (HTTP/2 when the `h2` package is installed),
+shared by all the chat and embedding components of the process.
+
+The pool can be configured in the flowsettings:
+    - KH_OPENAI_MAX_CONNECTIONS: maximum number of connections per client
+    - KH_OPENAI_MAX_KEEPALIVE_CONNECTIONS: maximum number of idle connections kept
+    - KH_OPENAI_KEEPALIVE_EXPIRY: seconds before an idle connection is closed
+    - KH_OPENAI_HTTP2: whether to use HTTP/2 when available
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Any, Optional
+
+from theflow.settings import settings as flowsettings
+
+# params that identify the endpoint, used to label the metrics
+_ENDPOINT_PARAMS = ("base_url", "azure_endpoint")
+
+
+def _freeze(value: Any) -> Any:
+    """Make a client param hashable to be part of the registry key"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class OpenAIClientRegistry:
+    """Share the OpenAI API clients created with the same params
+
+    Async clients are also keyed by the running event loop, as their connections
+    cannot be used from another loop.
+
+    Args:
+        max_connections: maximum number of connections per client
+        max_keepalive_connections: maximum number of idle connections per client
+        keepalive_expiry: seconds before an idle connection is closed
+        http2: whether to use HTTP/2, if the `h2` package is installed
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+    ):
+        self.max_connections = max_connections or getattr(
+            flowsettings, "KH_OPENAI_MAX_CONNECTIONS", 100
+        )
+        self.max_keepalive_connections = max_keepalive_connections or getattr(
+            flowsettings, "KH_OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20
+        )
+        self.keepalive_expiry = keepalive_expiry or getattr(
+            flowsettings, "KH_OPENAI_KEEPALIVE_EXPIRY", 30.0
+        )
+        if http2 is None:
+            http2 = getattr(flowsettings, "KH_OPENAI_HTTP2", True)
+        self.http2 = bool(http2) and importlib.util.find_spec("h2") is not None
+
+        self._lock = threading.Lock()
+        self._clients: dict[tuple, Any] = {}
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._labels: dict[int, str] = {}
+        self._requests: dict[int, int] = {}
+
+    def _http_client(self, async_version: bool, counter_key: int):
+        import httpx
+        import openai
+
+        def count_request(request):
+            self._requests[counter_key] = self._requests.get(counter_key, 0) + 1
+
+        async def acount_request(request):
+            count_request(request)
+
+        params = {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": self.http2,
+            "event_hooks": {
+                "request": [acount_request if async_version else count_request]
+            },
+        }
+        if async_version:
+            return openai.DefaultAsyncHttpxClient(**params)
+        return openai.DefaultHttpxClient(**params)
+
+    def get(self, client_cls: type, **params):
+        """Get the shared client of `client_cls` initialized with `params`
+
+        Args:
+            client_cls: the client class, e.g. `openai.OpenAI`,
+                `openai.AsyncAzureOpenAI`
+            params: the params to initialize the client
+        """
+        key = (client_cls.__module__, client_cls.__qualname__, _freeze(params))
+        async_version = client_cls.__name__.startswith("Async")
+
+        with self._lock:
+            if async_version:
+                loop = asyncio.get_running_loop()
+                clients = self._async_clients.setdefault(loop, {})
+            else:
+                clients = self._clients
+
+            if key not in clients:
+                counter_key = len(self._labels)
+                endpoint = next(
+                    (params[name] for name in _ENDPOINT_PARAMS if params.get(name)),
+                    "default",
+                )
+                self._labels[counter_key] = f"{client_cls.__name__}({endpoint})"
+                clients[key] = client_cls(
+                    **params,
+                    http_client=self._http_client(async_version, counter_key),
+                )
+                clients[key]._kh_counter_key = counter_key
+
+            return clients[key]
+
+    def stats(self) -> list[dict]:
+        """Get the utilization of the connection pool of each client"""
+        with self._lock:
+            clients = list(self._clients.values())
+            for loop_clients in list(self._async_clients.values()):
+                clients.extend(loop_clients.values())
+
+        result = []
+        for client in clients:
+            counter_key = client._kh_counter_key
+            pool = getattr(getattr(client._client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            result.append(
+                {
+                    "client": self._labels[counter_key],
+                    "requests": self._requests.get(counter_key, 0),
+                    "connections": len(connections),
+                    "idle_connections": sum(
+                        1 for conn in connections if conn.is_idle()
+                    ),
+                    "max_connections": self.max_connections,
+                    "http2": self.http2,
+                }
+            )
+        return result
+
+    def clear(self):
+        """Close and forget all the sync clients"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+openai_clients = OpenAIClientRegistry()
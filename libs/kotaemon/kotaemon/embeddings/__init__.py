@@ -1,4 +1,5 @@
 from .base import BaseEmbeddings
+from .cache import CachedEmbeddings
 from .endpoint_based import EndpointEmbeddings
 from .fastembed import FastEmbedEmbeddings
 from .langchain_based import (
@@ -11,6 +12,7 @@ from .openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
 
 __all__ = [
     "BaseEmbeddings",
+    "CachedEmbeddings",
     "EndpointEmbeddings",
     "LCOpenAIEmbeddings",
     "LCAzureOpenAIEmbeddings",
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document, DocumentWithEmbedding, Param
+
+from .base import BaseEmbeddings
+
+# params that do not change the output vectors
+_NON_IDENTITY_PARAMS = re.compile(
+    r"(api_key|token|secret|password|timeout|retries|batch_size|parallel)"
+)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize the text before hashing, so that trivially different texts
+    (unicode forms, surrounding or repeated whitespaces) share the same cache entry
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SQLiteEmbeddingStore:
+    """Size-bounded key -> vector store in a SQLite file, with LRU eviction
+
+    Args:
+        path: the path to the SQLite file
+        max_size: the maximum number of vectors to keep
+    """
+
+    def __init__(self, path: str | Path, max_size: int):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB, last_access REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Get the cached vectors of the keys, missing keys are omitted"""
+        result: dict[str, list[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # stay below the SQLite limit of host parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    result[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+            if result:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in result],
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in result)
+            self.misses += sum(1 for key in keys if key not in result)
+
+        return result
+
+    def set_many(self, items: dict[str, list[float]]):
+        """Add the vectors to the store, evicting the least recently used ones"""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            n_before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            self._size += self._conn.total_changes - n_before
+
+            if self._size > self._max_size:
+                n_evicted = self._size - self._max_size
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                    "ORDER BY last_access LIMIT ?)",
+                    (n_evicted,),
+                )
+                self._size -= n_evicted
+            self._conn.commit()
+
+    def clear(self):
+        """Remove all the vectors and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """Cache the vectors of any embedding model in a local SQLite file
+
+    The cache key is the hash of the embedding model identity (its type and the
+    params that affect the vectors, e.g. model name, endpoint and dimensions) and
+    the normalized text. Secrets (API keys, tokens) are not part of the identity.
+
+    Example:
+        ```python
+        embedding = CachedEmbeddings(
+            embedding=OpenAIEmbeddings(model="text-embedding-3-small", api_key="..."),
+        )
+        embedding("Hello world")  # call the API
+        embedding("Hello world")  # served from cache
+        embedding.stats()  # {"hits": 1, "misses": 1, "size": 1, "hit_rate": 0.5}
+        ```
+    """
+
+    embedding: BaseEmbeddings
+    cache_path: Optional[str] = Param(
+        None,
+        help=(
+            "Path to the SQLite file storing the vectors. Default to "
+            "`embedding_cache.db` in the app data directory."
+        ),
+    )
+    max_size: int = Param(
+        1_000_000, help="Maximum number of vectors kept in the cache (LRU eviction)"
+    )
+
+    @Param.auto(depends_on=["cache_path", "max_size"])
+    def store_(self) -> SQLiteEmbeddingStore:
+        cache_path = self.cache_path
+        if cache_path is None:
+            cache_path = str(
+                Path(getattr(flowsettings, "KH_APP_DATA_DIR", "."))
+                / "embedding_cache.db"
+            )
+        return SQLiteEmbeddingStore(cache_path, max_size=self.max_size)
+
+    def model_identity(self) -> str:
+        """Get the identity of the wrapped embedding model, used in the cache key"""
+        spec = self.get_from_path("embedding").dump(strict=False)
+        params = {
+            key: value
+            for key, value in spec.get("params", {}).items()
+            if not _NON_IDENTITY_PARAMS.search(key)
+        }
+        return json.dumps(
+            {"function": spec.get("function"), "params": params},
+            sort_keys=True,
+            default=str,
+        )
+
+    def cache_key(self, text: str, model_identity: Optional[str] = None) -> str:
+        """Get the cache key of a text for the wrapped embedding model"""
+        if model_identity is None:
+            model_identity = self.model_identity()
+        content = f"{model_identity}\0{normalize_text(text)}"
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    def stats(self) -> dict:
+        """Get the cache hit/miss counters"""
+        hits, misses = self.store_.hits, self.store_.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": len(self.store_),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    def _lookup(
+        self, input_: list[Document]
+    ) -> tuple[list[str], dict[str, list[float]], list[Document]]:
+        """Get the cached vectors and the unique documents that need embedding"""
+        model_identity = self.model_identity()
+        keys = [self.cache_key(doc.text or "", model_identity) for doc in input_]
+        cached = self.store_.get_many(keys)
+
+        to_embed: dict[str, Document] = {}
+        for key, doc in zip(keys, input_):
+            if key not in cached and key not in to_embed:
+                to_embed[key] = doc
+
+        return keys, cached, list(to_embed.values())
+
+    def _merge(
+        self,
+        input_: list[Document],
+        keys: list[str],
+        cached: dict[str, list[float]],
+        embedded: list[DocumentWithEmbedding],
+    ) -> list[DocumentWithEmbedding]:
+        new_vectors = {}
+        embedded_keys = [key for key in dict.fromkeys(keys) if key not in cached]
+        for key, doc in zip(embedded_keys, embedded):
+            new_vectors[key] = doc.embedding
+        self.store_.set_many(new_vectors)
+
+        vectors = {**cached, **new_vectors}
+        return [
+            DocumentWithEmbedding(embedding=vectors[key], content=doc)
+            for key, doc in zip(keys, input_)
+        ]
+
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_ = self.prepare_input(text)
+        keys, cached, to_embed = self._lookup(input_)
+        embedded = self.embedding(to_embed, *args, **kwargs) if to_embed else []
+        return self._merge(input_, keys, cached, embedded)
+
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_ = self.prepare_input(text)
+        keys, cached, to_embed = self._lookup(input_)
+        embedded = (
+            await self.get_from_path("embedding").ainvoke(to_embed, *args, **kwargs)
+            if to_embed
+            else []
+        )
+        return self._merge(input_, keys, cached, embedded)
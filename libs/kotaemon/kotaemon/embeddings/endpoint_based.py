@@ -1,6 +1,11 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 import requests
+from requests.adapters import HTTPAdapter
 
-from kotaemon.base import Document, DocumentWithEmbedding
+from kotaemon.base import Document, DocumentWithEmbedding, Param
 
 from .base import BaseEmbeddings
 
@@ -9,14 +14,86 @@ class EndpointEmbeddings(BaseEmbeddings):
     """
     An Embeddings component that uses an OpenAI API compatible endpoint.
 
+    The texts are sent in batches (OpenAI-style list `input`) over a keep-alive
+    connection pool, with up to `max_concurrency` requests in flight. The sync and
+    async pools are created on first use and released together with `close` (or
+    `aclose` from a running event loop).
+
     Attributes:
         endpoint_url (str): The url of an OpenAI API compatible endpoint.
     """
 
-    endpoint_url: str
+    endpoint_url: str = Param(
+        help="URL of the OpenAI API compatible endpoint", required=True
+    )
+    batch_size: int = Param(32, help="The number of texts sent in one request")
+    max_concurrency: int = Param(
+        4, help="The maximum number of requests sent concurrently"
+    )
+    timeout: Optional[float] = Param(None, help="Timeout for each request")
+
+    @Param.auto(depends_on=["max_concurrency"])
+    def session_(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get_async_client(self):
+        """Get the pooled async client of the running event loop"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = getattr(self, "_async_client", None)
+        if client is None or client.is_closed or self._async_client_loop is not loop:
+            # the connections of a client are bound to the loop that opened them
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                timeout=self.timeout,
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    def close(self):
+        """Close the connection pools of the sync and async clients"""
+        self.session_.close()
+        client = getattr(self, "_async_client", None)
+        self._async_client = None
+        # a client whose loop has finished has no live connection left to release
+        if client is not None and not self._async_client_loop.is_closed():
+            self._async_client_loop.run_until_complete(client.aclose())
+
+    async def aclose(self):
+        """Close the connection pools of the sync and async clients"""
+        self.session_.close()
+        client = getattr(self, "_async_client", None)
+        self._async_client = None
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+    def _batches(self, input_: list[Document]) -> list[list[str]]:
+        texts = [doc.text or " " for doc in input_]
+        return [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
 
-    def run(
-        self, text: str | list[str] | Document | list[Document]
+    @staticmethod
+    def _parse_response(response: dict) -> list[list[float]]:
+        """Get the embeddings of a response, ordered as the request input"""
+        data = sorted(response["data"], key=lambda x: x.get("index", 0))
+        return [item["embedding"] for item in data]
+
+    def _embed_batch(self, batch: list[str]) -> list[list[float]]:
+        response = self.session_.post(
+            self.endpoint_url, json={"input": batch}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return self._parse_response(response.json())
+
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
     ) -> list[DocumentWithEmbedding]:
         """
         Generate embeddings from text Args:
@@ -25,22 +102,41 @@ class EndpointEmbeddings(BaseEmbeddings):
         Returns:
             list[DocumentWithEmbedding]: embeddings
         """
-        if not isinstance(text, list):
-            text = [text]
-
-        outputs = []
-
-        for item in text:
-            response = requests.post(
-                self.endpoint_url, json={"input": str(item)}
-            ).json()
-            outputs.append(
-                DocumentWithEmbedding(
-                    text=str(item),
-                    embedding=response["data"][0]["embedding"],
-                    total_tokens=response["usage"]["total_tokens"],
-                    prompt_tokens=response["usage"]["prompt_tokens"],
-                )
-            )
+        input_ = self.prepare_input(text)
+        batches = self._batches(input_)
+
+        if len(batches) <= 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(batches))
+            ) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+
+        embeddings = [emb for result in results for emb in result]
+        return [
+            DocumentWithEmbedding(content=doc, embedding=embedding)
+            for doc, embedding in zip(input_, embeddings)
+        ]
+
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_ = self.prepare_input(text)
+        batches = self._batches(input_)
+        client = self._get_async_client()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch: list[str]) -> list[list[float]]:
+            async with semaphore:
+                response = await client.post(self.endpoint_url, json={"input": batch})
+            response.raise_for_status()
+            return self._parse_response(response.json())
+
+        results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
 
-        return outputs
+        embeddings = [emb for result in results for emb in result]
+        return [
+            DocumentWithEmbedding(content=doc, embedding=embedding)
+            for doc, embedding in zip(input_, embeddings)
+        ]
@@ -1,3 +1,6 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from itertools import islice
 from typing import Optional
 
@@ -13,10 +16,17 @@ from tenacity import (
 from theflow.utils.modules import import_dotted_string
 
 from kotaemon.base import Param
+from kotaemon.base.clients import openai_clients
 
 from .base import BaseEmbeddings, Document, DocumentWithEmbedding
 
 
+@lru_cache
+def get_encoding(name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Get the (cached) tiktoken encoding"""
+    return tiktoken.get_encoding(name)
+
+
 def split_text_by_chunk_size(text: str, chunk_size: int) -> list[list[int]]:
     """Split the text into chunks of a given size
 
@@ -27,7 +37,7 @@ def split_text_by_chunk_size(text: str, chunk_size: int) -> list[list[int]]:
     Returns:
         list of chunks (as tokens)
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_encoding()
     tokens = iter(encoding.encode(text))
     result = []
     while chunk := list(islice(tokens, chunk_size)):
@@ -63,6 +73,20 @@ class BaseOpenAIEmbeddings(BaseEmbeddings):
     context_length: Optional[int] = Param(
         None, help="The maximum context length of the embedding model"
     )
+    max_batch_size: int = Param(
+        2048, help="The maximum number of inputs sent in one API request"
+    )
+    max_batch_tokens: int = Param(
+        300_000,
+        help=(
+            "The maximum number of tokens sent in one API request. The inputs are "
+            "counted in tokens if `context_length` is set, otherwise in UTF-8 bytes "
+            "(an upper bound of the number of tokens)."
+        ),
+    )
+    max_concurrency: int = Param(
+        4, help="The maximum number of API requests sent concurrently"
+    )
 
     @Param.auto(depends_on=["max_retries"])
     def max_retries_(self):
@@ -84,59 +108,116 @@ class BaseOpenAIEmbeddings(BaseEmbeddings):
         """Get the openai response"""
         raise NotImplementedError
 
-    def invoke(
-        self, text: str | list[str] | Document | list[Document], *args, **kwargs
-    ) -> list[DocumentWithEmbedding]:
-        input_doc = self.prepare_input(text)
-        client = self.prepare_client(async_version=False)
+    def prepare_batches(
+        self, input_doc: list[Document]
+    ) -> tuple[list[str | list[int]], list[tuple[int, int]], list[tuple[int, int]]]:
+        """Prepare the API inputs and pack them into batches
 
+        Returns:
+            - the API inputs (texts, or tokens if `context_length` is set)
+            - for each document, the (start, end) range of its API inputs
+            - the (start, end) ranges of API inputs of each batch, in order
+        """
         input_: list[str | list[int]] = []
-        splitted_indices = {}
-        for idx, text in enumerate(input_doc):
+        input_sizes: list[int] = []
+        splitted_indices = []
+        for doc in input_doc:
+            text = doc.text or " "
             if self.context_length:
-                chunks = split_text_by_chunk_size(text.text or " ", self.context_length)
-                splitted_indices[idx] = (len(input_), len(input_) + len(chunks))
+                chunks = split_text_by_chunk_size(text, self.context_length)
+                splitted_indices.append((len(input_), len(input_) + len(chunks)))
                 input_.extend(chunks)
+                input_sizes.extend(len(chunk) for chunk in chunks)
             else:
-                splitted_indices[idx] = (len(input_), len(input_) + 1)
-                input_.append(text.text)
-
-        resp = self.openai_response(client, input=input_, **kwargs).dict()
-        output_ = list(sorted(resp["data"], key=lambda x: x["index"]))
-
+                splitted_indices.append((len(input_), len(input_) + 1))
+                input_.append(text)
+                input_sizes.append(len(text.encode("utf-8")))
+
+        batches = []
+        start, batch_tokens = 0, 0
+        for idx, size in enumerate(input_sizes):
+            if idx > start and (
+                idx - start >= self.max_batch_size
+                or batch_tokens + size > self.max_batch_tokens
+            ):
+                batches.append((start, idx))
+                start, batch_tokens = idx, 0
+            batch_tokens += size
+        if start < len(input_):
+            batches.append((start, len(input_)))
+
+        return input_, splitted_indices, batches
+
+    def merge_embeddings(
+        self,
+        input_doc: list[Document],
+        input_: list[str | list[int]],
+        splitted_indices: list[tuple[int, int]],
+        embeddings: list[list[float]],
+    ) -> list[DocumentWithEmbedding]:
+        """Build the output documents, averaging the embeddings of split inputs"""
         output = []
         for idx, doc in enumerate(input_doc):
-            embs = output_[splitted_indices[idx][0] : splitted_indices[idx][1]]
+            start, end = splitted_indices[idx]
+            embs = embeddings[start:end]
             if len(embs) == 1:
-                output.append(
-                    DocumentWithEmbedding(embedding=embs[0]["embedding"], content=doc)
-                )
+                output.append(DocumentWithEmbedding(embedding=embs[0], content=doc))
                 continue
 
-            chunk_lens = [
-                len(_)
-                for _ in input_[splitted_indices[idx][0] : splitted_indices[idx][1]]
-            ]
-            vs: list[list[float]] = [_["embedding"] for _ in embs]
-            emb = np.average(vs, axis=0, weights=chunk_lens)
+            chunk_lens = [len(_) for _ in input_[start:end]]
+            emb = np.average(embs, axis=0, weights=chunk_lens)
             emb = emb / np.linalg.norm(emb)
             output.append(DocumentWithEmbedding(embedding=emb.tolist(), content=doc))
 
         return output
 
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_doc = self.prepare_input(text)
+        client = self.prepare_client(async_version=False)
+        input_, splitted_indices, batches = self.prepare_batches(input_doc)
+
+        def embed_batch(batch: tuple[int, int]) -> list[list[float]]:
+            resp = self.openai_response(
+                client, input=input_[batch[0] : batch[1]], **kwargs
+            ).dict()
+            return [
+                _["embedding"] for _ in sorted(resp["data"], key=lambda x: x["index"])
+            ]
+
+        if len(batches) <= 1:
+            results = [embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(batches))
+            ) as executor:
+                results = list(executor.map(embed_batch, batches))
+
+        embeddings = [emb for result in results for emb in result]
+        return self.merge_embeddings(input_doc, input_, splitted_indices, embeddings)
+
     async def ainvoke(
         self, text: str | list[str] | Document | list[Document], *args, **kwargs
     ) -> list[DocumentWithEmbedding]:
-        input_ = self.prepare_input(text)
+        input_doc = self.prepare_input(text)
         client = self.prepare_client(async_version=True)
-        resp = await self.openai_response(
-            client, input=[_.text if _.text else " " for _ in input_], **kwargs
-        ).dict()
-        output_ = sorted(resp["data"], key=lambda x: x["index"])
-        return [
-            DocumentWithEmbedding(embedding=o["embedding"], content=i)
-            for i, o in zip(input_, output_)
-        ]
+        input_, splitted_indices, batches = self.prepare_batches(input_doc)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch: tuple[int, int]) -> list[list[float]]:
+            async with semaphore:
+                resp = await self.openai_response(
+                    client, input=input_[batch[0] : batch[1]], **kwargs
+                )
+            return [
+                _["embedding"]
+                for _ in sorted(resp.dict()["data"], key=lambda x: x["index"])
+            ]
+
+        results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+        embeddings = [emb for result in results for emb in result]
+        return self.merge_embeddings(input_doc, input_, splitted_indices, embeddings)
 
 
 class OpenAIEmbeddings(BaseOpenAIEmbeddings):
@@ -169,11 +250,11 @@ class OpenAIEmbeddings(BaseOpenAIEmbeddings):
         if async_version:
             from openai import AsyncOpenAI
 
-            return AsyncOpenAI(**params)
+            return openai_clients.get(AsyncOpenAI, **params)
 
         from openai import OpenAI
 
-        return OpenAI(**params)
+        return openai_clients.get(OpenAI, **params)
 
     @retry(
         retry=retry_if_not_exception_type(
@@ -232,11 +313,11 @@ class AzureOpenAIEmbeddings(BaseOpenAIEmbeddings):
         if async_version:
             from openai import AsyncAzureOpenAI
 
-            return AsyncAzureOpenAI(**params)
+            return openai_clients.get(AsyncAzureOpenAI, **params)
 
         from openai import AzureOpenAI
 
-        return AzureOpenAI(**params)
+        return openai_clients.get(AzureOpenAI, **params)
 
     @retry(
         retry=retry_if_not_exception_type(
@@ -6,6 +6,8 @@ from kotaemon.base import BaseComponent
 from kotaemon.base.schema import HumanMessage, SystemMessage
 from kotaemon.llms import BaseLLM
 
+from .span_search import find_span
+
 
 class FactWithEvidence(BaseModel):
     """Class representing a single statement.
@@ -24,22 +26,14 @@ class FactWithEvidence(BaseModel):
         ),
     )
 
-    def _get_span(self, quote: str, context: str, errs: int = 100) -> Iterator[str]:
-        import regex
-
-        minor = quote
-        major = context
-
-        errs_ = 0
-        s = regex.search(f"({minor}){{e<={errs_}}}", major)
-        while s is None and errs_ <= errs:
-            errs_ += 1
-            s = regex.search(f"({minor}){{e<={errs_}}}", major)
-
-        if s is not None:
-            yield from s.spans()
+    def _get_span(
+        self, quote: str, context: str, errs: int = 100
+    ) -> Iterator[tuple[int, int]]:
+        span = find_span(quote, context, max_errors=errs)
+        if span is not None:
+            yield span
 
-    def get_spans(self, context: str) -> Iterator[str]:
+    def get_spans(self, context: str) -> Iterator[tuple[int, int]]:
         for quote in self.substring_quote:
             yield from self._get_span(quote, context)
 
@@ -0,0 +1,175 @@
+"""Locate the quotes of a context, tolerating the errors made when quoting it
+
+A quote is first searched verbatim. Otherwise, the candidate windows of the
+context are the diagonals (context offset - quote offset) sharing the most
+character n-grams with the quote. The quote is aligned to each window with an
+edit distance, the window bounding the band of the alignment, until the time
+budget is spent.
+
+The quote is never interpreted as a pattern, so it can contain any character.
+"""
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+NGRAM_SIZE = 3
+# the n-grams occurring more often than this are too common to locate a quote
+MAX_NGRAM_OCCURRENCES = 1000
+# the diagonals are grouped in buckets of this size to vote for the windows
+DIAGONAL_BUCKET = 16
+MAX_WINDOWS = 8
+# the contexts this short are aligned whole when no window is found
+SMALL_CONTEXT = 2000
+
+
+class NGramIndex:
+    """Positions of the character n-grams of a text
+
+    Args:
+        text: the text to index
+        n: the size of the n-grams
+    """
+
+    def __init__(self, text: str, n: int = NGRAM_SIZE):
+        self.text = text
+        self.n = n
+
+        positions: dict[str, list[int]] = defaultdict(list)
+        for pos in range(len(text) - n + 1):
+            positions[text[pos : pos + n]].append(pos)
+        self.positions = dict(positions)
+
+    def candidate_offsets(self, quote: str, max_candidates: int) -> list[int]:
+        """Get the likely offsets of the quote in the text, the most likely first"""
+        n = self.n
+        votes: Counter = Counter()
+        for quote_pos in range(len(quote) - n + 1):
+            positions = self.positions.get(quote[quote_pos : quote_pos + n], ())
+            if len(positions) > MAX_NGRAM_OCCURRENCES:
+                continue
+            for pos in positions:
+                votes[(pos - quote_pos) // DIAGONAL_BUCKET] += 1
+
+        # the insertions and deletions shift the diagonal to the next buckets
+        scores = Counter(
+            {
+                bucket: votes[bucket - 1] + count + votes[bucket + 1]
+                for bucket, count in votes.items()
+            }
+        )
+
+        buckets: list[int] = []
+        for bucket, _ in scores.most_common():
+            if len(buckets) >= max_candidates:
+                break
+            if any(abs(bucket - chosen) <= 1 for chosen in buckets):
+                continue
+            buckets.append(bucket)
+
+        return [bucket * DIAGONAL_BUCKET for bucket in buckets]
+
+
+@lru_cache(maxsize=64)
+def get_ngram_index(text: str) -> NGramIndex:
+    """Get the n-gram index of a text, built once for the texts searched
+    repeatedly
+    """
+    return NGramIndex(text)
+
+
+def _codes(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def _last_row(quote: np.ndarray, text: np.ndarray, free_start: bool) -> np.ndarray:
+    """Get the edit distances between the quote and the prefixes of the text,
+    or the substrings of the text ending at each position with `free_start`
+    """
+    columns = np.arange(len(text) + 1)
+    row = np.zeros(len(text) + 1, dtype=np.int64) if free_start else columns.copy()
+    for idx, char in enumerate(quote, start=1):
+        new_row = np.empty_like(row)
+        new_row[0] = idx
+        # skip the character of the quote, or substitute it
+        new_row[1:] = np.minimum(row[1:] + 1, row[:-1] + (text != char))
+        # skip the characters of the text
+        row = np.minimum.accumulate(new_row - columns) + columns
+    return row
+
+
+def align(quote: str, text: str) -> tuple[int, int, int]:
+    """Find the substring of the text with the smallest edit distance to the quote
+
+    Returns:
+        the edit distance, the start and the end of the substring
+    """
+    quote_codes, text_codes = _codes(quote), _codes(text)
+    row = _last_row(quote_codes, text_codes, free_start=True)
+    end = int(np.argmin(row))
+
+    # the start is the end of the alignment of the reversed strings
+    reversed_row = _last_row(
+        quote_codes[::-1], text_codes[:end][::-1], free_start=False
+    )
+    # the longest substring among the equally distant ones
+    start = end - (len(reversed_row) - 1 - int(np.argmin(reversed_row[::-1])))
+
+    return int(row[end]), start, end
+
+
+def find_span(
+    quote: str,
+    context: str,
+    max_errors: int = 100,
+    time_budget: Optional[float] = 0.2,
+) -> Optional[tuple[int, int]]:
+    """Locate the quote in the context
+
+    Args:
+        quote: the quote, possibly with errors
+        context: the context the quote comes from
+        max_errors: the maximum edit distance between the quote and its span
+        time_budget: the number of seconds after which no more window is aligned,
+            None for no limit
+
+    Returns:
+        the start and end of the span of the context, None if the quote is not
+            found
+    """
+    if not quote:
+        return None
+
+    start = context.find(quote)
+    if start != -1:
+        return start, start + len(quote)
+
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+    slack = min(max_errors, len(quote))
+    offsets = get_ngram_index(context).candidate_offsets(quote, MAX_WINDOWS)
+    if offsets:
+        windows = [
+            (
+                max(0, offset - DIAGONAL_BUCKET - slack),
+                min(len(context), offset + 2 * DIAGONAL_BUCKET + len(quote) + slack),
+            )
+            for offset in offsets
+        ]
+    elif len(context) <= SMALL_CONTEXT:
+        windows = [(0, len(context))]
+    else:
+        return None
+
+    best: Optional[tuple[int, int, int]] = None
+    for window_start, window_end in windows:
+        distance, start, end = align(quote, context[window_start:window_end])
+        if best is None or distance < best[0]:
+            best = (distance, window_start + start, window_start + end)
+        if best[0] == 0 or (deadline is not None and time.perf_counter() > deadline):
+            break
+
+    if best is None or best[0] > max_errors or best[0] >= len(quote):
+        return None
+    return best[1], best[2]
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+from kotaemon.base import BaseComponent
+
+# params that do not change the LLM output
+_NON_IDENTITY_PARAMS = re.compile(
+    r"(api_key|token|secret|password|timeout|retries|max_connections|keepalive)"
+)
+
+_stores: dict[str, "SQLiteScoreStore"] = {}
+_stores_lock = threading.Lock()
+
+
+def component_identity(component: BaseComponent) -> str:
+    """Get the identity of a component (its type and the params that affect its
+    output), without the secrets
+    """
+    spec = component.dump(strict=False)
+    params = {
+        key: value
+        for key, value in spec.get("params", {}).items()
+        if not _NON_IDENTITY_PARAMS.search(key)
+    }
+    return json.dumps(
+        {"function": spec.get("function"), "params": params},
+        sort_keys=True,
+        default=str,
+    )
+
+
+def text_hash(text: str) -> str:
+    return sha256(text.encode("utf-8")).hexdigest()
+
+
+class SQLiteScoreStore:
+    """Size-bounded key -> relevance score store in a SQLite file, the scores
+    expire after a time-to-live
+
+    Args:
+        path: the path to the SQLite file, or ":memory:" for an in-memory store
+        max_size: the maximum number of scores to keep, the oldest are evicted
+    """
+
+    def __init__(self, path: str | Path, max_size: int = 1_000_000):
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        if str(path) != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores "
+            "(key TEXT PRIMARY KEY, score REAL, created REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS scores_created ON scores (created)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get_many(self, keys: list[str], ttl: Optional[float]) -> dict[str, float]:
+        """Get the scores of the keys stored less than `ttl` seconds ago, missing
+        or expired keys are omitted
+        """
+        result: dict[str, float] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        min_created = time.time() - ttl if ttl else float("-inf")
+        with self._lock:
+            # stay below the SQLite limit of host parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, score, created FROM scores WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, score, created in rows:
+                    if created >= min_created:
+                        result[key] = score
+
+            self.hits += sum(1 for key in keys if key in result)
+            self.misses += sum(1 for key in keys if key not in result)
+
+        return result
+
+    def set_many(self, items: dict[str, float]):
+        """Store the scores, evicting the oldest ones"""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            keys = list(items)
+            n_existing = 0
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                n_existing += self._conn.execute(
+                    "SELECT COUNT(*) FROM scores WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (key, score, created) VALUES (?, ?, ?)",
+                [(key, float(score), now) for key, score in items.items()],
+            )
+            self._size += len(keys) - n_existing
+
+            if self._size > self._max_size:
+                n_evicted = self._size - self._max_size
+                self._conn.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores "
+                    "ORDER BY created LIMIT ?)",
+                    (n_evicted,),
+                )
+                self._size -= n_evicted
+            self._conn.commit()
+
+    def clear(self):
+        """Remove all the scores and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM scores")
+            self._conn.commit()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def get_score_store(path: str, max_size: int = 1_000_000) -> SQLiteScoreStore:
+    """Get the score store of the path, shared by the components of the process"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SQLiteScoreStore(path, max_size=max_size)
+        return _stores[path]
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
-from concurrent.futures import ThreadPoolExecutor
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
 from langchain.output_parsers.boolean import BooleanOutputParser
+from theflow.settings import settings as flowsettings
 
-from kotaemon.base import Document
+from kotaemon.base import Document, Param
 from kotaemon.llms import BaseLLM, PromptTemplate
 
 from .base import BaseReranking
+from .cache import component_identity, get_score_store, text_hash
 
 RERANK_PROMPT_TEMPLATE = """Given the following question and context,
 return YES if the context is relevant to the question and NO if it isn't.
@@ -19,12 +25,231 @@ return YES if the context is relevant to the question and NO if it isn't.
 >>>
 > Relevant (YES / NO):"""
 
+BATCH_RERANK_PROMPT_TEMPLATE = """Given the following question and numbered contexts,
+decide for each context if it is relevant to the question.
+
+> Question: {question}
+{contexts}
+
+Respond only with a JSON object mapping each context number to YES if the context
+is relevant to the question and NO if it isn't, e.g. {{"1": "YES", "2": "NO"}}:"""
+
+CONTEXT_TEMPLATE = """> Context {index}:
+>>>
+{context}
+>>>"""
+
+PATTERN_JSON_OBJECT: re.Pattern = re.compile(r"\{.*\}", re.DOTALL)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_scoring_executor() -> ThreadPoolExecutor:
+    """Get the thread pool shared by the LLM scorers of the process, bounded by the
+    `KH_RERANKING_MAX_WORKERS` setting
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(flowsettings, "KH_RERANKING_MAX_WORKERS", 8),
+                thread_name_prefix="llm-scoring",
+            )
+        return _executor
+
 
 class LLMReranking(BaseReranking):
+    """Filter down the documents with an LLM judging their relevance to the query
+
+    The documents are scored in a thread pool shared by the process, `batch_size`
+    documents per LLM call. The scores are cached by LLM, prompt version, query
+    and document for `cache_ttl` seconds. With `early_stop`, the scoring stops
+    once this number of documents reached `early_stop_score`, and the documents
+    not scored yet are left out.
+    """
+
     llm: BaseLLM
     prompt_template: PromptTemplate = PromptTemplate(template=RERANK_PROMPT_TEMPLATE)
+    batch_prompt_template: PromptTemplate = PromptTemplate(
+        template=BATCH_RERANK_PROMPT_TEMPLATE
+    )
     top_k: int = 3
     concurrent: bool = True
+    batch_size: int = Param(
+        1, help="Number of documents scored in one LLM call, with a JSON output"
+    )
+    early_stop: int = Param(
+        0,
+        help=(
+            "Stop scoring once this number of documents reached `early_stop_score`, "
+            "0 to score all the documents"
+        ),
+    )
+    early_stop_score: float = Param(
+        0.8, help="Score from which a document counts towards `early_stop`"
+    )
+    use_cache: bool = Param(True, help="Cache the scores")
+    cache_path: Optional[str] = Param(
+        None,
+        help=(
+            "Path to the SQLite file storing the scores. Default to an in-memory "
+            "cache shared by the process."
+        ),
+    )
+    cache_ttl: Optional[float] = Param(
+        7 * 24 * 3600, help="Number of seconds a cached score is valid, None to keep"
+    )
+
+    def prompt_version(self) -> str:
+        """Get the version of the prompts, used in the cache key"""
+        return text_hash(
+            "\0".join(
+                [self.prompt_template.template, self.batch_prompt_template.template]
+            )
+        )
+
+    def prepare_context(self, text: str) -> str:
+        """Prepare the document content to put in the prompt"""
+        return text
+
+    def populate_prompt(self, query: str, context: str) -> str:
+        return self.prompt_template.populate(question=query, context=context)
+
+    def populate_batch_prompt(self, query: str, contexts: list[str]) -> str:
+        return self.batch_prompt_template.populate(
+            question=query,
+            contexts="\n".join(
+                CONTEXT_TEMPLATE.format(index=idx + 1, context=context)
+                for idx, context in enumerate(contexts)
+            ),
+        )
+
+    def call_llm(self, prompt: str) -> str:
+        return self.llm(prompt).text
+
+    def parse_score(self, output: str) -> float:
+        """Parse the relevance score of a document from the LLM output"""
+        return float(BooleanOutputParser().parse(output))
+
+    def score_texts(self, query: str, texts: list[str]) -> list[float]:
+        """Score the texts, in one LLM call if there are several of them
+
+        The texts missing from the output of a batch LLM call are scored one by
+        one.
+        """
+        contexts = [self.prepare_context(text) for text in texts]
+        if len(contexts) == 1:
+            prompt = self.populate_prompt(query, contexts[0])
+            return [self.parse_score(self.call_llm(prompt))]
+
+        scores: list[Optional[float]] = [None] * len(contexts)
+        output = self.call_llm(self.populate_batch_prompt(query, contexts))
+        match = PATTERN_JSON_OBJECT.search(output)
+        try:
+            parsed = json.loads(match.group()) if match else {}
+        except json.JSONDecodeError:
+            parsed = {}
+        if isinstance(parsed, dict):
+            for idx in range(len(contexts)):
+                try:
+                    scores[idx] = self.parse_score(str(parsed[str(idx + 1)]))
+                except (KeyError, ValueError, AssertionError):
+                    pass
+
+        return [
+            (
+                score
+                if score is not None
+                else self.parse_score(
+                    self.call_llm(self.populate_prompt(query, contexts[idx]))
+                )
+            )
+            for idx, score in enumerate(scores)
+        ]
+
+    def score(self, documents: list[Document], query: str) -> list[Optional[float]]:
+        """Score the relevance of the documents to the query
+
+        Returns:
+            the score of each document, None for the documents not scored because
+            of `early_stop`
+        """
+        texts = [doc.get_content() for doc in documents]
+        scores: list[Optional[float]] = [None] * len(texts)
+
+        keys: dict[str, str] = {}
+        if self.use_cache:
+            store = get_score_store(self.cache_path or ":memory:")
+            prefix = text_hash(
+                "\0".join(
+                    [
+                        component_identity(self.get_from_path("llm")),
+                        self.prompt_version(),
+                        text_hash(query),
+                    ]
+                )
+            )
+            keys = {text: text_hash(prefix + text_hash(text)) for text in texts}
+            cached = store.get_many(list(keys.values()), self.cache_ttl)
+            for idx, text in enumerate(texts):
+                scores[idx] = cached.get(keys[text])
+
+        def n_relevant() -> int:
+            return sum(
+                1
+                for score in scores
+                if score is not None and score >= self.early_stop_score
+            )
+
+        # the texts to score, with the indices of their documents
+        pending: dict[str, list[int]] = {}
+        for idx, text in enumerate(texts):
+            if scores[idx] is None:
+                pending.setdefault(text, []).append(idx)
+        if not pending or (self.early_stop and n_relevant() >= self.early_stop):
+            return scores
+
+        new_scores: dict[str, float] = {}
+
+        def collect(batch: list[str], batch_scores: list[float]) -> bool:
+            """Record the scores of a batch, return whether to stop scoring"""
+            for text, score in zip(batch, batch_scores):
+                for idx in pending[text]:
+                    scores[idx] = score
+                if keys:
+                    new_scores[keys[text]] = score
+            return bool(self.early_stop) and n_relevant() >= self.early_stop
+
+        unique_texts = list(pending)
+        batch_size = max(1, self.batch_size)
+        batches = [
+            unique_texts[start : start + batch_size]
+            for start in range(0, len(unique_texts), batch_size)
+        ]
+        try:
+            if self.concurrent and len(batches) > 1:
+                executor = get_scoring_executor()
+                futures = {
+                    executor.submit(self.score_texts, query, batch): batch
+                    for batch in batches
+                }
+                try:
+                    for future in as_completed(futures):
+                        if collect(futures[future], future.result()):
+                            break
+                finally:
+                    for future in futures:
+                        future.cancel()
+            else:
+                for batch in batches:
+                    if collect(batch, self.score_texts(query, batch)):
+                        break
+        finally:
+            if keys:
+                store.set_many(new_scores)
+
+        return scores
 
     def run(
         self,
@@ -32,32 +257,12 @@ class LLMReranking(BaseReranking):
         query: str,
     ) -> list[Document]:
         """Filter down documents based on their relevance to the query."""
-        filtered_docs = []
-        output_parser = BooleanOutputParser()
-
-        if self.concurrent:
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    _prompt = self.prompt_template.populate(
-                        question=query, context=doc.get_content()
-                    )
-                    futures.append(executor.submit(lambda: self.llm(_prompt).text))
-
-                results = [future.result() for future in futures]
-        else:
-            results = []
-            for doc in documents:
-                _prompt = self.prompt_template.populate(
-                    question=query, context=doc.get_content()
-                )
-                results.append(self.llm(_prompt).text)
-
-        # use Boolean parser to extract relevancy output from LLM
-        results = [output_parser.parse(result) for result in results]
-        for include_doc, doc in zip(results, documents):
-            if include_doc:
-                filtered_docs.append(doc)
+        scores = self.score(documents, query)
+        filtered_docs = [
+            doc
+            for doc, score in zip(documents, scores)
+            if score is not None and score >= 0.5
+        ]
 
         # prevent returning empty result
         if len(filtered_docs) == 0:
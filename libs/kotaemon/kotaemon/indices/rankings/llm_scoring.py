@@ -1,13 +1,11 @@
 from __future__ import annotations
 
-from concurrent.futures import ThreadPoolExecutor
-
 import numpy as np
 from langchain.output_parsers.boolean import BooleanOutputParser
 
 from kotaemon.base import Document
 
-from .llm import LLMReranking
+from .llm import LLMReranking, get_scoring_executor
 
 
 class LLMScoring(LLMReranking):
@@ -21,15 +19,15 @@ class LLMScoring(LLMReranking):
         output_parser = BooleanOutputParser()
 
         if self.concurrent:
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    _prompt = self.prompt_template.populate(
-                        question=query, context=doc.get_content()
-                    )
-                    futures.append(executor.submit(lambda: self.llm(_prompt)))
-
-                results = [future.result() for future in futures]
+            executor = get_scoring_executor()
+            futures = []
+            for doc in documents:
+                _prompt = self.prompt_template.populate(
+                    question=query, context=doc.get_content()
+                )
+                futures.append(executor.submit(self.llm, _prompt))
+
+            results = [future.result() for future in futures]
         else:
             results = []
             for doc in documents:
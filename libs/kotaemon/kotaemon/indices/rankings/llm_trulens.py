@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import re
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import tiktoken
@@ -10,6 +9,7 @@ from kotaemon.base import Document, HumanMessage, SystemMessage
 from kotaemon.indices.splitters import TokenSplitter
 from kotaemon.llms import BaseLLM, PromptTemplate
 
+from .cache import text_hash
 from .llm import LLMReranking
 
 SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
@@ -43,6 +43,16 @@ USER_PROMPT_TEMPLATE = PromptTemplate(
         RELEVANCE: """
 )  # noqa
 
+BATCH_USER_PROMPT_TEMPLATE = PromptTemplate(
+    """QUESTION: {question}
+
+        {contexts}
+
+        Respond only with a JSON object mapping each CONTEXT number to its RELEVANCE, e.g. {{"1": 7, "2": 0}}.
+
+        RELEVANCE: """  # noqa: E501
+)
+
 PATTERN_INTEGER: re.Pattern = re.compile(r"([+-]?[1-9][0-9]*|0)")
 """Regex that matches integers."""
 
@@ -94,9 +104,17 @@ def re_0_10_rating(s: str) -> int:
 
 
 class LLMTrulensScoring(LLMReranking):
+    """Score the documents from 0 to 1 with an LLM grading their relevance to the
+    query, and sort them by score
+
+    The documents not scored because of `early_stop` are kept after the scored
+    ones, without `llm_trulens_score`.
+    """
+
     llm: BaseLLM
     system_prompt_template: PromptTemplate = SYSTEM_PROMPT_TEMPLATE
     user_prompt_template: PromptTemplate = USER_PROMPT_TEMPLATE
+    batch_user_prompt_template: PromptTemplate = BATCH_USER_PROMPT_TEMPLATE
     concurrent: bool = True
     normalize: float = 10
     trim_func: TokenSplitter = TokenSplitter.withx(
@@ -110,67 +128,62 @@ class LLMTrulensScoring(LLMReranking):
         ),
     )
 
+    def prompt_version(self) -> str:
+        return text_hash(
+            "\0".join(
+                [
+                    self.system_prompt_template.template,
+                    self.user_prompt_template.template,
+                    self.batch_user_prompt_template.template,
+                    str(self.normalize),
+                ]
+            )
+        )
+
+    def prepare_context(self, text: str) -> str:
+        # a token is at least one byte, shorter texts need no trimming
+        if len(text.encode("utf-8")) <= MAX_CONTEXT_LEN:
+            return text
+        # skip metadata which cause troubles
+        return self.trim_func([Document(content=text)])[0].text
+
+    def populate_prompt(self, query: str, context: str) -> str:
+        return self.user_prompt_template.populate(question=query, context=context)
+
+    def populate_batch_prompt(self, query: str, contexts: list[str]) -> str:
+        return self.batch_user_prompt_template.populate(
+            question=query,
+            contexts="\n\n".join(
+                f"CONTEXT {idx + 1}: {context}" for idx, context in enumerate(contexts)
+            ),
+        )
+
+    def call_llm(self, prompt: str) -> str:
+        messages = [
+            SystemMessage(self.system_prompt_template.populate()),
+            HumanMessage(prompt),
+        ]
+        return self.llm(messages).text
+
+    def parse_score(self, output: str) -> float:
+        return float(re_0_10_rating(output)) / self.normalize
+
     def run(
         self,
         documents: list[Document],
         query: str,
     ) -> list[Document]:
-        """Filter down documents based on their relevance to the query."""
-        filtered_docs = []
-
+        """Sort the documents by their relevance to the query."""
         documents = sorted(documents, key=lambda doc: doc.get_content())
-        if self.concurrent:
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    chunked_doc_content = self.trim_func(
-                        [
-                            Document(content=doc.get_content())
-                            # skip metadata which cause troubles
-                        ]
-                    )[0].text
-
-                    messages = []
-                    messages.append(
-                        SystemMessage(self.system_prompt_template.populate())
-                    )
-                    messages.append(
-                        HumanMessage(
-                            self.user_prompt_template.populate(
-                                question=query, context=chunked_doc_content
-                            )
-                        )
-                    )
-
-                    def llm_call():
-                        return self.llm(messages).text
-
-                    futures.append(executor.submit(llm_call))
-
-                results = [future.result() for future in futures]
-        else:
-            results = []
-            for doc in documents:
-                messages = []
-                messages.append(SystemMessage(self.system_prompt_template.populate()))
-                messages.append(
-                    SystemMessage(
-                        self.user_prompt_template.populate(
-                            question=query, context=doc.get_content()
-                        )
-                    )
-                )
-                results.append(self.llm(messages).text)
-
-        # use Boolean parser to extract relevancy output from LLM
-        results = [
-            (r_idx, float(re_0_10_rating(result)) / self.normalize)
-            for r_idx, result in enumerate(results)
+        scores = self.score(documents, query)
+
+        scored = [
+            (doc, score) for doc, score in zip(documents, scores) if score is not None
         ]
-        results.sort(key=lambda x: x[1], reverse=True)
+        scored.sort(key=lambda x: x[1], reverse=True)
 
-        for r_idx, score in results:
-            doc = documents[r_idx]
+        filtered_docs = []
+        for doc, score in scored:
             doc.metadata["llm_trulens_score"] = score
             filtered_docs.append(doc)
 
@@ -179,4 +192,9 @@ class LLMTrulensScoring(LLMReranking):
             [doc.metadata["llm_trulens_score"] for doc in filtered_docs],
         )
 
+        # the documents left out by the early stop
+        filtered_docs.extend(
+            doc for doc, score in zip(documents, scores) if score is None
+        )
+
         return filtered_docs
@@ -9,6 +9,7 @@ from theflow.settings import settings as flowsettings
 
 from kotaemon.base import BaseComponent, Document, RetrievedDocument
 from kotaemon.embeddings import BaseEmbeddings
+from kotaemon.loaders.pdf_loader import resolve_thumbnail
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseIndexing, BaseRetrieval
@@ -127,6 +128,10 @@ class VectorRetrieval(BaseRetrieval):
     top_k: int = 5
     first_round_top_k_mult: int = 10
     retrieval_mode: str = "hybrid"  # vector, text, hybrid
+    hybrid_fusion: str = "rrf"  # rrf, weighted
+    rrf_k: int = 60
+    vector_weight: float = 0.5
+    rerank_top_k_mult: int = 3
 
     def _filter_docs(
         self, documents: list[RetrievedDocument], top_k: int | None = None
@@ -135,6 +140,58 @@ class VectorRetrieval(BaseRetrieval):
             documents = documents[:top_k]
         return documents
 
+    def _fuse(
+        self,
+        vs_docs: list[RetrievedDocument],
+        ds_docs: list[RetrievedDocument],
+    ) -> list[RetrievedDocument]:
+        """Fuse the vector and full-text search results, deduplicated by id
+
+        With "rrf", a document scores `sum(1 / (rrf_k + rank))` over the lists it
+        appears in. With "weighted", the vector similarities are min-max normalized,
+        the full-text ranks are normalized to (0, 1], and the scores are combined
+        with `vector_weight`. The fused score is kept in
+        `retrieval_metadata["fusion_score"]`, while `score` stays the vector
+        similarity (-1.0 for full-text only hits).
+        """
+        if self.hybrid_fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Invalid hybrid fusion: {self.hybrid_fusion}")
+
+        docs: dict[str, RetrievedDocument] = {}
+        fused: dict[str, float] = {}
+
+        if self.hybrid_fusion == "rrf":
+            vs_weights = [1 / (self.rrf_k + rank + 1) for rank in range(len(vs_docs))]
+            ds_weights = [1 / (self.rrf_k + rank + 1) for rank in range(len(ds_docs))]
+        else:
+            scores = [doc.score for doc in vs_docs]
+            low, high = min(scores, default=0.0), max(scores, default=0.0)
+            vs_weights = [
+                self.vector_weight * ((score - low) / (high - low) if high > low else 1)
+                for score in scores
+            ]
+            ds_weights = [
+                (1 - self.vector_weight) * (1 - rank / len(ds_docs))
+                for rank in range(len(ds_docs))
+            ]
+
+        for doc_list, weights in [(vs_docs, vs_weights), (ds_docs, ds_weights)]:
+            seen: set[str] = set()
+            for doc, weight in zip(doc_list, weights):
+                if doc.doc_id in seen:
+                    continue
+                seen.add(doc.doc_id)
+                docs.setdefault(doc.doc_id, doc)
+                fused[doc.doc_id] = fused.get(doc.doc_id, 0.0) + weight
+
+        result = sorted(docs.values(), key=lambda doc: -fused[doc.doc_id])
+        for doc in result:
+            doc.retrieval_metadata = {
+                **doc.retrieval_metadata,
+                "fusion_score": fused[doc.doc_id],
+            }
+        return result
+
     def run(
         self, text: str | Document, top_k: Optional[int] = None, **kwargs
     ) -> list[RetrievedDocument]:
@@ -223,20 +280,20 @@ class VectorRetrieval(BaseRetrieval):
             vs_query_thread.join()
             ds_query_thread.join()
 
-            result = [
-                RetrievedDocument(**doc.to_dict(), score=-1.0)
-                for doc in ds_docs
-                if doc not in vs_ids
-            ]
-            result += [
-                RetrievedDocument(**doc.to_dict(), score=score)
-                for doc, score in zip(vs_docs, vs_scores)
-            ]
+            result = self._fuse(
+                [
+                    RetrievedDocument(**doc.to_dict(), score=score)
+                    for doc, score in zip(vs_docs, vs_scores)
+                ],
+                [RetrievedDocument(**doc.to_dict(), score=-1.0) for doc in ds_docs],
+            )
             print(f"Got {len(vs_docs)} from vectorstore")
             print(f"Got {len(ds_docs)} from docstore")
 
         # use additional reranker to re-order the document list
         if self.rerankers and text:
+            # only the best fused candidates are worth the reranking cost
+            result = self._filter_docs(result, top_k=top_k * self.rerank_top_k_mult)
             for reranker in self.rerankers:
                 # if reranker is LLMReranking, limit the document with top_k items only
                 if isinstance(reranker, LLMReranking):
@@ -257,6 +314,7 @@ class VectorRetrieval(BaseRetrieval):
         for doc in result:
             if doc.metadata.get("type") == "thumbnail":
                 # change type to image to display on UI
+                doc.metadata = resolve_thumbnail(doc.metadata)
                 doc.metadata["type"] = "image"
                 raw_thumbnail_docs.append(doc)
                 continue
@@ -284,6 +342,7 @@ class VectorRetrieval(BaseRetrieval):
         for thumbnail_doc in linked_thumbnail_docs:
             text_doc = text_thumbnail_docs[thumbnail_doc.doc_id]
             doc_dict = thumbnail_doc.to_dict()
+            doc_dict["metadata"] = resolve_thumbnail(doc_dict["metadata"])
             doc_dict["_id"] = text_doc.doc_id
             doc_dict["content"] = text_doc.content
             doc_dict["metadata"]["type"] = "image"
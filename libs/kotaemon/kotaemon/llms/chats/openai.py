@@ -3,6 +3,7 @@ from typing import TYPE_CHECKING, AsyncGenerator, Iterator, Optional
 from theflow.utils.modules import import_dotted_string
 
 from kotaemon.base import AIMessage, BaseMessage, HumanMessage, LLMInterface, Param
+from kotaemon.base.clients import openai_clients
 
 from .base import ChatLLM
 
@@ -284,11 +285,11 @@ class ChatOpenAI(BaseChatOpenAI):
         if async_version:
             from openai import AsyncOpenAI
 
-            return AsyncOpenAI(**params)
+            return openai_clients.get(AsyncOpenAI, **params)
 
         from openai import OpenAI
 
-        return OpenAI(**params)
+        return openai_clients.get(OpenAI, **params)
 
     def openai_response(self, client, **kwargs):
         """Get the openai response"""
@@ -352,11 +353,11 @@ class AzureChatOpenAI(BaseChatOpenAI):
         if async_version:
             from openai import AsyncAzureOpenAI
 
-            return AsyncAzureOpenAI(**params)
+            return openai_clients.get(AsyncAzureOpenAI, **params)
 
         from openai import AzureOpenAI
 
-        return AzureOpenAI(**params)
+        return openai_clients.get(AzureOpenAI, **params)
 
     def openai_response(self, client, **kwargs):
         """Get the openai response"""
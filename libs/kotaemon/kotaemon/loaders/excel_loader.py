@@ -4,12 +4,55 @@ Pandas parser for .xlsx files.
 
 """
 from pathlib import Path
-from typing import Any, List, Optional, Union
+from typing import Any, Iterator, List, Optional, Union
 
 from llama_index.core.readers.base import BaseReader
 
 from kotaemon.base import Document
 
+# the number of rows of the documents of `lazy_load_data`
+ROWS_PER_DOCUMENT = 1000
+
+# the options of `pandas.ExcelFile`, the others go to `pandas.ExcelFile.parse`
+EXCEL_FILE_OPTIONS = ("engine", "storage_options", "engine_kwargs")
+
+
+def _iter_sheets(
+    file: Path, sheet_name: Optional[Union[str, int, list]], pandas_config: dict
+) -> Iterator[tuple[Union[str, int], Any]]:
+    """Parse the sheets of the file one at a time
+
+    Returns:
+        Iterator[tuple]: the name (or index if given as such) and the dataframe of
+            each sheet
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError(
+            "install pandas using `pip3 install pandas` to use this loader"
+        )
+
+    file_options = {
+        key: value for key, value in pandas_config.items() if key in EXCEL_FILE_OPTIONS
+    }
+    parse_options = {
+        key: value
+        for key, value in pandas_config.items()
+        if key not in EXCEL_FILE_OPTIONS
+    }
+
+    with pd.ExcelFile(file, **file_options) as excel_file:
+        if sheet_name is None:
+            sheet_names = excel_file.sheet_names
+        elif isinstance(sheet_name, list):
+            sheet_names = sheet_name
+        else:
+            sheet_names = [sheet_name]
+
+        for key in sheet_names:
+            yield key, excel_file.parse(key, **parse_options)
+
 
 class PandasExcelReader(BaseReader):
     r"""Pandas-based CSV parser.
@@ -40,6 +83,50 @@ class PandasExcelReader(BaseReader):
         self._row_joiner = row_joiner if row_joiner else "\n"
         self._col_joiner = col_joiner if col_joiner else " "
 
+    def lazy_load_data(
+        self,
+        file: Path,
+        include_sheetname: bool = False,
+        sheet_name: Optional[Union[str, int, list]] = None,
+        extra_info: Optional[dict] = None,
+        rows_per_document: Optional[int] = ROWS_PER_DOCUMENT,
+        **kwargs,
+    ) -> Iterator[Document]:
+        """Parse the file sheet by sheet, as documents of `rows_per_document` rows
+
+        Args:
+            file (Path): The path to the Excel file to read.
+            include_sheetname (bool): Whether to include the sheet name in the output.
+            sheet_name (Union[str, int, None]): The specific sheet to read from,
+                default is None which reads all sheets.
+            rows_per_document (Optional[int]): The number of rows of each document,
+                None for one document per sheet.
+
+        Returns:
+            Iterator[Document]: The documents of the rows of the sheets, their
+                texts joined with the row joiner make the text of `load_data`.
+        """
+        for key, df in _iter_sheets(file, sheet_name, self._pandas_config):
+            df = df.dropna(axis=0, how="all")
+            df.fillna("", inplace=True)
+
+            header = [[str(key)]] if include_sheetname else []
+            step = rows_per_document or max(len(df), 1)
+            for start in range(0, len(df), step):
+                rows = (
+                    header + df.iloc[start : start + step].values.astype(str).tolist()
+                )
+                header = []
+                yield Document(
+                    text=self._row_joiner.join(
+                        self._col_joiner.join(row) for row in rows
+                    ),
+                    metadata=dict(extra_info or {}),
+                )
+            if header:
+                # the name of an empty sheet
+                yield Document(text=str(key), metadata=dict(extra_info or {}))
+
     def load_data(
         self,
         file: Path,
@@ -60,43 +147,16 @@ class PandasExcelReader(BaseReader):
             List[Document]: A list of`Document objects containing the
                 values from the specified column in the Excel file.
         """
-        import itertools
-
-        try:
-            import pandas as pd
-        except ImportError:
-            raise ImportError(
-                "install pandas using `pip3 install pandas` to use this loader"
-            )
-
-        if sheet_name is not None:
-            sheet_name = (
-                [sheet_name] if not isinstance(sheet_name, list) else sheet_name
-            )
-
-        dfs = pd.read_excel(file, sheet_name=sheet_name, **self._pandas_config)
-        sheet_names = dfs.keys()
-        df_sheets = []
-
-        for key in sheet_names:
-            sheet = []
-            if include_sheetname:
-                sheet.append([key])
-            dfs[key] = dfs[key].dropna(axis=0, how="all")
-            dfs[key] = dfs[key].dropna(axis=0, how="all")
-            dfs[key].fillna("", inplace=True)
-            sheet.extend(dfs[key].values.astype(str).tolist())
-            df_sheets.append(sheet)
-
-        text_list = list(
-            itertools.chain.from_iterable(df_sheets)
-        )  # flatten list of lists
+        documents = self.lazy_load_data(
+            file,
+            include_sheetname=include_sheetname,
+            sheet_name=sheet_name,
+            rows_per_document=None,
+        )
 
         output = [
             Document(
-                text=self._row_joiner.join(
-                    self._col_joiner.join(sublist) for sublist in text_list
-                ),
+                text=self._row_joiner.join(doc.text for doc in documents),
                 metadata=extra_info or {},
             )
         ]
@@ -133,6 +193,50 @@ class ExcelReader(BaseReader):
         self._row_joiner = row_joiner if row_joiner else "\n"
         self._col_joiner = col_joiner if col_joiner else " "
 
+    def lazy_load_data(
+        self,
+        file: Path,
+        include_sheetname: bool = True,
+        sheet_name: Optional[Union[str, int, list]] = None,
+        extra_info: Optional[dict] = None,
+        rows_per_document: Optional[int] = ROWS_PER_DOCUMENT,
+        **kwargs,
+    ) -> Iterator[Document]:
+        """Parse the file sheet by sheet, as documents of `rows_per_document` rows
+
+        Args:
+            file (Path): The path to the Excel file to read.
+            include_sheetname (bool): Whether to include the sheet name in the output.
+            sheet_name (Union[str, int, None]): The specific sheet to read from,
+                default is None which reads all sheets.
+            rows_per_document (Optional[int]): The number of rows of each document,
+                None for one document per sheet.
+
+        Returns:
+            Iterator[Document]: The documents of the rows of the sheets, with the
+                sheet as page label.
+        """
+        # clean up input
+        file = Path(file)
+        extra_info = extra_info or {}
+
+        sheets = _iter_sheets(file, sheet_name, self._pandas_config)
+        for idx, (key, df) in enumerate(sheets):
+            df = df.dropna(axis=0, how="all")
+            df = df.astype("object")
+            df.fillna("", inplace=True)
+
+            step = rows_per_document or max(len(df), 1)
+            for start in range(0, max(len(df), 1), step):
+                rows = df.iloc[start : start + step].values.astype(str).tolist()
+                content = self._row_joiner.join(
+                    self._col_joiner.join(row).strip() for row in rows
+                ).strip()
+                if include_sheetname:
+                    content = f"(Sheet {key} of file {file.name})\n{content}"
+                metadata = {"page_label": idx + 1, "sheet_name": key, **extra_info}
+                yield Document(text=content, metadata=metadata)
+
     def load_data(
         self,
         file: Path,
@@ -153,40 +257,12 @@ class ExcelReader(BaseReader):
             List[Document]: A list of`Document objects containing the
                 values from the specified column in the Excel file.
         """
-
-        try:
-            import pandas as pd
-        except ImportError:
-            raise ImportError(
-                "install pandas using `pip3 install pandas` to use this loader"
-            )
-
-        if sheet_name is not None:
-            sheet_name = (
-                [sheet_name] if not isinstance(sheet_name, list) else sheet_name
+        return list(
+            self.lazy_load_data(
+                file,
+                include_sheetname=include_sheetname,
+                sheet_name=sheet_name,
+                extra_info=extra_info,
+                rows_per_document=None,
             )
-
-        # clean up input
-        file = Path(file)
-        extra_info = extra_info or {}
-
-        dfs = pd.read_excel(file, sheet_name=sheet_name, **self._pandas_config)
-        sheet_names = dfs.keys()
-        output = []
-
-        for idx, key in enumerate(sheet_names):
-            dfs[key] = dfs[key].dropna(axis=0, how="all")
-            dfs[key] = dfs[key].dropna(axis=0, how="all")
-            dfs[key] = dfs[key].astype("object")
-            dfs[key].fillna("", inplace=True)
-
-            rows = dfs[key].values.astype(str).tolist()
-            content = self._row_joiner.join(
-                self._col_joiner.join(row).strip() for row in rows
-            ).strip()
-            if include_sheetname:
-                content = f"(Sheet {key} of file {file.name})\n{content}"
-            metadata = {"page_label": idx + 1, "sheet_name": key, **extra_info}
-            output.append(Document(text=content, metadata=metadata))
-
-        return output
+        )
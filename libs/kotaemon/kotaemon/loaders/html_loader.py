@@ -1,6 +1,7 @@
 import email
+import html
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 from llama_index.core.readers.base import BaseReader
 from theflow.settings import settings as flowsettings
@@ -33,45 +34,78 @@ class HtmlReader(BaseReader):
         self._page_break_pattern: Optional[str] = page_break_pattern
         super().__init__()
 
-    def load_data(
+    def lazy_load_data(
         self, file_path: Path | str, extra_info: Optional[dict] = None, **kwargs
-    ) -> list[Document]:
-        """Load data using Html reader
+    ) -> Iterator[Document]:
+        """Load data using Html reader, streaming the pages
+
+        The HTML is converted as it is read, and each page is yielded once its page
+        break is reached, so neither the whole HTML nor the whole text are kept in
+        memory.
 
         Args:
             file_path: path to HTML file
             extra_info: extra information passed to this reader during extracting data
 
         Returns:
-            list[Document]: list of documents extracted from the HTML file
+            Iterator[Document]: the documents of the pages of the HTML file
         """
         import html2text
 
         file_path = Path(file_path).resolve()
+        extra_info = extra_info or {}
+        converter = html2text.HTML2Text(bodywidth=html2text.config.BODY_WIDTH)
+        converter.start = True
+
+        def page_document(page_id: int, page: str) -> Document:
+            if converter.unicode_snob:
+                nbsp = html.entities.html5["nbsp;"]
+            else:
+                nbsp = " "
+            page = converter.optwrap(page.replace("&nbsp_place_holder;", nbsp))
+            return Document(
+                text=page.strip(),
+                metadata={"page_label": page_id + 1, **extra_info},
+            )
 
+        page_id = 0
+        text = ""
         with file_path.open("r") as f:
-            html_text = "".join([line[:-1] for line in f.readlines()])
-
-        # read HTML
-        all_text = html2text.html2text(html_text)
+            for line in f:
+                converter.feed(line.rstrip("\n"))
+                if not self._page_break_pattern:
+                    continue
+
+                # the pages before the last page break are complete
+                text += "".join(converter.outtextlist)
+                converter.outtextlist = []
+                *pages, text = text.split(self._page_break_pattern)
+                for page in pages:
+                    yield page_document(page_id, page)
+                    page_id += 1
+
+        converter.feed("")
+        text += converter.finish()
         pages = (
-            all_text.split(self._page_break_pattern)
-            if self._page_break_pattern
-            else [all_text]
+            text.split(self._page_break_pattern) if self._page_break_pattern else [text]
         )
+        for page in pages:
+            yield page_document(page_id, page)
+            page_id += 1
 
-        extra_info = extra_info or {}
+    def load_data(
+        self, file_path: Path | str, extra_info: Optional[dict] = None, **kwargs
+    ) -> list[Document]:
+        """Load data using Html reader
 
-        # create Document from non-table text
-        documents = [
-            Document(
-                text=page.strip(),
-                metadata={"page_label": page_id + 1, **extra_info},
-            )
-            for page_id, page in enumerate(pages)
-        ]
+        Args:
+            file_path: path to HTML file
+            extra_info: extra information passed to this reader during extracting data
 
-        return documents
+        Returns:
+            list[Document]: list of documents extracted from the HTML file
+        """
+        return list(self.lazy_load_data(file_path, extra_info=extra_info, **kwargs))
 
 
 class MhtmlReader(BaseReader):
@@ -7,6 +7,7 @@ from uuid import uuid4
 import requests
 from llama_index.core.readers.base import BaseReader
 from tenacity import after_log, retry, stop_after_attempt, wait_exponential
+from theflow.settings import settings as flowsettings
 
 from kotaemon.base import Document
 
@@ -68,6 +69,8 @@ class OCRReader(BaseReader):
             file_path (Path): Path to PDF file
             debug_path (Path): Path to store debug image output
             artifact_path (Path): Path to OCR endpoints artifacts directory
+            max_workers (int): Number of processes to parse the pages in parallel,
+                default to `KH_OCR_MAX_WORKERS` of the flowsettings (1)
 
         Returns:
             List[Document]: list of documents extracted from the PDF file
@@ -87,6 +90,9 @@ class OCRReader(BaseReader):
 
         debug_path = kwargs.pop("debug_path", None)
         artifact_path = kwargs.pop("artifact_path", None)
+        max_workers = kwargs.pop(
+            "max_workers", getattr(flowsettings, "KH_OCR_MAX_WORKERS", 1)
+        )
 
         # read PDF through normal reader (unstructured)
         pdf_page_items = read_pdf_unstructured(file_path)
@@ -96,6 +102,7 @@ class OCRReader(BaseReader):
             pdf_page_items,
             debug_path=debug_path,
             artifact_path=artifact_path,
+            max_workers=max_workers,
         )
         extra_info = extra_info or {}
 
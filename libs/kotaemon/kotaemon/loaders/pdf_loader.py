@@ -1,66 +1,246 @@
 import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from hashlib import sha256
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 
 from fsspec import AbstractFileSystem
+from llama_index.core.readers.file.base import get_default_fs, is_default_fs
 from llama_index.readers.file import PDFReader
 from PIL import Image
+from theflow.settings import settings as flowsettings
 
 from kotaemon.base import Document
 
+# number of pages rendered by a worker process at once
+PAGES_PER_WORKER = 16
+
+
+def _render_pages(file_path: str, pages: list[int], dpi: int) -> list[bytes]:
+    """Render the pages of the PDF file as PNG images"""
+    try:
+        import fitz
+    except ImportError:
+        raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
+
+    output = []
+    with fitz.open(file_path) as doc:
+        for page_number in pages:
+            page = doc.load_page(page_number)
+            pm = page.get_pixmap(dpi=dpi)
+            img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+            img_bytes = BytesIO()
+            img.save(img_bytes, format="PNG")
+            output.append(img_bytes.getvalue())
+    return output
+
+
+def render_page_thumbnails(
+    file_path: Path, pages: list[int], dpi: int = 80, max_workers: int = 1
+) -> list[bytes]:
+    """Render the pages of the PDF file as PNG images, in parallel processes
+
+    Args:
+        file_path (Path): path to the PDF file
+        pages (list[int]): list of page numbers to render
+        dpi (int): resolution of the thumbnails
+        max_workers (int): number of processes. The pages are rendered in the
+            current process when set to 1 (default)
+
+    Returns:
+        list[bytes]: the PNG images of the pages
+    """
+    assert file_path.suffix.lower() == ".pdf", "This function only supports PDF files."
+
+    batches = [
+        pages[start : start + PAGES_PER_WORKER]
+        for start in range(0, len(pages), PAGES_PER_WORKER)
+    ]
+    max_workers = min(max_workers, len(batches))
+
+    if max_workers <= 1:
+        return _render_pages(str(file_path), pages, dpi)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            _render_pages,
+            [str(file_path)] * len(batches),
+            batches,
+            [dpi] * len(batches),
+        )
+        return [image for result in results for image in result]
+
 
 def get_page_thumbnails(
-    file_path: Path, pages: list[int], dpi: int = 80
-) -> List[Image.Image]:
+    file_path: Path, pages: list[int], dpi: int = 80, max_workers: int = 1
+) -> List[str]:
     """Get image thumbnails of the pages in the PDF file.
 
     Args:
         file_path (Path): path to the image file
         page_number (list[int]): list of page numbers to extract
+        max_workers (int): number of processes to render the pages
 
     Returns:
-        list[Image.Image]: list of page thumbnails
+        list[str]: list of page thumbnails, as base64 data URI
     """
+    return [
+        png_to_base64(image)
+        for image in render_page_thumbnails(file_path, pages, dpi, max_workers)
+    ]
 
-    img: Image.Image
-    suffix = file_path.suffix.lower()
-    assert suffix == ".pdf", "This function only supports PDF files."
-    try:
-        import fitz
-    except ImportError:
-        raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
 
-    doc = fitz.open(file_path)
-
-    output_imgs = []
-    for page_number in pages:
-        page = doc.load_page(page_number)
-        pm = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
-        output_imgs.append(convert_image_to_base64(img))
-
-    return output_imgs
+def png_to_base64(image: bytes) -> str:
+    img_base64 = base64.b64encode(image).decode("utf-8")
+    return f"data:image/png;base64,{img_base64}"
 
 
 def convert_image_to_base64(img: Image.Image) -> str:
     # convert the image into base64
     img_bytes = BytesIO()
     img.save(img_bytes, format="PNG")
-    img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
-    img_base64 = f"data:image/png;base64,{img_base64}"
+    return png_to_base64(img_bytes.getvalue())
+
 
-    return img_base64
+@lru_cache(maxsize=256)
+def load_thumbnail(thumbnail_path: str) -> str:
+    """Load a thumbnail file stored by `PDFThumbnailReader` as base64 data URI
+
+    The thumbnail files are named after their content hash, so they never change
+    and can be cached.
+    """
+    return png_to_base64(Path(thumbnail_path).read_bytes())
+
+
+def resolve_thumbnail(metadata: dict) -> dict:
+    """Get the metadata of a thumbnail document with the image loaded from its
+    `thumbnail_path` file reference, if any
+    """
+    if "image_origin" in metadata or "thumbnail_path" not in metadata:
+        return metadata
+    try:
+        return {**metadata, "image_origin": load_thumbnail(metadata["thumbnail_path"])}
+    except FileNotFoundError:
+        return metadata
 
 
 class PDFThumbnailReader(PDFReader):
-    """PDF parser with thumbnail for each page."""
+    """PDF parser with thumbnail for each page.
+
+    The pages are rendered in `max_workers` parallel processes. If `thumbnail_dir`
+    is set, the thumbnails are stored as PNG files in that directory and the
+    thumbnail documents only keep the file path as `thumbnail_path` metadata, to be
+    loaded with `resolve_thumbnail` when retrieved. Otherwise, the thumbnails are
+    kept in the documents as base64 `image_origin` metadata.
 
-    def __init__(self) -> None:
+    Args:
+        thumbnail_dir: the directory to store the thumbnail files
+        dpi: the resolution of the thumbnails
+        max_workers: the number of processes to render the pages, default to
+            `KH_PDF_THUMBNAIL_MAX_WORKERS` of the flowsettings (1, in the reading
+            process)
+    """
+
+    def __init__(
+        self,
+        thumbnail_dir: Optional[str] = None,
+        dpi: int = 80,
+        max_workers: int = getattr(flowsettings, "KH_PDF_THUMBNAIL_MAX_WORKERS", 1),
+    ) -> None:
         """
         Initialize PDFReader.
         """
         super().__init__(return_full_document=False)
+        self.thumbnail_dir = thumbnail_dir
+        self.dpi = dpi
+        self.max_workers = max_workers
+
+    def _store_thumbnail(self, image: bytes) -> str:
+        assert self.thumbnail_dir is not None
+        path = Path(self.thumbnail_dir) / f"{sha256(image).hexdigest()}.png"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(image)
+            os.replace(tmp_path, path)
+        return str(path)
+
+    def lazy_load_data(
+        self,
+        file: Path,
+        extra_info: Optional[Dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> Iterator[Document]:
+        """Parse the file by windows of `PAGES_PER_WORKER` pages per rendering
+        process, yielding the text of each page followed by its thumbnail
+        """
+        try:
+            import pypdf
+        except ImportError:
+            raise ImportError(
+                "pypdf is required to read PDF files: `pip install pypdf`"
+            )
+
+        file = Path(file)
+        extra_info = extra_info or {}
+        max_workers = max(self.max_workers, 1)
+        window_size = PAGES_PER_WORKER * max_workers
+
+        fs = fs or get_default_fs()
+        with fs.open(str(file), "rb") as fp:
+            # Load the file in memory if the filesystem is not the default one to avoid
+            # issues with pypdf
+            stream = fp if is_default_fs(fs) else BytesIO(fp.read())
+            pdf = pypdf.PdfReader(stream)
+            page_labels = pdf.page_labels
+
+            for window_start in range(0, len(pdf.pages), window_size):
+                page_numbers, page_docs = [], []
+                for page_idx in range(
+                    window_start, min(window_start + window_size, len(pdf.pages))
+                ):
+                    # only the pages with an integer label are kept
+                    try:
+                        int(page_labels[page_idx])
+                    except ValueError:
+                        continue
+                    page_numbers.append(page_idx)
+                    page_docs.append(
+                        Document(
+                            text=pdf.pages[page_idx].extract_text(),
+                            metadata={
+                                "page_label": page_labels[page_idx],
+                                "file_name": file.name,
+                                **extra_info,
+                            },
+                        )
+                    )
+
+                page_images = render_page_thumbnails(
+                    file, page_numbers, dpi=self.dpi, max_workers=max_workers
+                )
+                for page_doc, page_image, page_idx in zip(
+                    page_docs, page_images, page_numbers
+                ):
+                    if self.thumbnail_dir:
+                        image_metadata = {
+                            "thumbnail_path": self._store_thumbnail(page_image)
+                        }
+                    else:
+                        image_metadata = {"image_origin": png_to_base64(page_image)}
+                    yield page_doc
+                    yield Document(
+                        text="Page thumbnail",
+                        metadata={
+                            **image_metadata,
+                            "type": "thumbnail",
+                            "page_label": page_labels[page_idx],
+                            **extra_info,
+                        },
+                    )
 
     def load_data(
         self,
@@ -69,46 +249,9 @@ class PDFThumbnailReader(PDFReader):
         fs: Optional[AbstractFileSystem] = None,
     ) -> List[Document]:
         """Parse file."""
-        documents = super().load_data(file, extra_info, fs)
-
-        page_numbers_str = []
-        filtered_docs = []
-        is_int_page_number: dict[str, bool] = {}
-
-        for doc in documents:
-            if "page_label" in doc.metadata:
-                page_num_str = doc.metadata["page_label"]
-                page_numbers_str.append(page_num_str)
-                try:
-                    _ = int(page_num_str)
-                    is_int_page_number[page_num_str] = True
-                    filtered_docs.append(doc)
-                except ValueError:
-                    is_int_page_number[page_num_str] = False
-                    continue
-
-        documents = filtered_docs
-        page_numbers = list(range(len(page_numbers_str)))
-
-        print("Page numbers:", len(page_numbers))
-        page_thumbnails = get_page_thumbnails(file, page_numbers)
-
-        documents.extend(
-            [
-                Document(
-                    text="Page thumbnail",
-                    metadata={
-                        "image_origin": page_thumbnail,
-                        "type": "thumbnail",
-                        "page_label": page_number,
-                        **(extra_info if extra_info is not None else {}),
-                    },
-                )
-                for (page_thumbnail, page_number) in zip(
-                    page_thumbnails, page_numbers_str
-                )
-                if is_int_page_number[page_number]
-            ]
-        )
+        documents = list(self.lazy_load_data(file, extra_info, fs))
 
-        return documents
+        # the texts of the pages, then their thumbnails
+        return [doc for doc in documents if doc.metadata.get("type") != "thumbnail"] + [
+            doc for doc in documents if doc.metadata.get("type") == "thumbnail"
+        ]
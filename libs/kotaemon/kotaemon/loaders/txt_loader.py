@@ -1,10 +1,13 @@
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 from kotaemon.base import Document
 
 from .base import BaseReader
 
+# the number of characters of the documents of `lazy_load_data`
+TXT_BLOCK_SIZE = 1 << 20
+
 
 class TxtReader(BaseReader):
     def run(
@@ -12,6 +15,35 @@ class TxtReader(BaseReader):
     ) -> list[Document]:
         return self.load_data(Path(file_path), extra_info=extra_info, **kwargs)
 
+    def lazy_load_data(
+        self,
+        file_path: Path,
+        extra_info: Optional[dict] = None,
+        block_size: int = TXT_BLOCK_SIZE,
+        **kwargs,
+    ) -> Iterator[Document]:
+        """Read the file by blocks of about `block_size` characters, cut after a
+        paragraph (or line) break when possible. The texts of the blocks make the
+        text of the file.
+        """
+        text = ""
+        with open(file_path, "r") as f:
+            while data := f.read(block_size):
+                text += data
+                if len(text) < block_size:
+                    continue
+
+                cut = text.rfind("\n\n") + 2
+                if cut < 2:
+                    cut = text.rfind("\n") + 1
+                if cut < 1:
+                    cut = len(text)
+                yield Document(text=text[:cut], metadata=dict(extra_info or {}))
+                text = text[cut:]
+
+        if text:
+            yield Document(text=text, metadata=dict(extra_info or {}))
+
     def load_data(
         self, file_path: Path, extra_info: Optional[dict] = None, **kwargs
     ) -> list[Document]:
@@ -1,4 +1,7 @@
-from typing import List, Tuple
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+import numpy as np
 
 
 def bbox_to_points(box: List[int]):
@@ -103,6 +106,86 @@ def get_rect_iou(gt_box: List[tuple], pd_box: List[tuple], iou_type=0) -> int:
     return iou
 
 
+def locations_to_array(locations: List[List[tuple]]) -> np.ndarray:
+    """Convert list of locations (4 points) to a (n, 4) array of [x1, y1, x2, y2]
+    using the top-left and bottom-right points, as in `get_rect_iou`
+    """
+    if not locations:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array(
+        [[loc[0][0], loc[0][1], loc[2][0], loc[2][1]] for loc in locations],
+        dtype=np.float64,
+    )
+
+
+def get_rect_iou_many(box: np.ndarray, boxes: np.ndarray, iou_type=0) -> np.ndarray:
+    """Vectorized `get_rect_iou` between one box and an array of boxes
+
+    Args:
+        box: array [x1, y1, x2, y2]
+        boxes: (n, 4) array of [x1, y1, x2, y2]
+        iou_type: 0: intersection / union, 1: intersection / min(areas)
+
+    Returns:
+        (n,) array of intersection over union values
+    """
+    assert iou_type in [0, 1], "Only support 0: origin iou, 1: intersection / min(area)"
+
+    inter_w = np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+    inter_h = np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+    inter_area = np.maximum(0, inter_w) * np.maximum(0, inter_h)
+
+    box_area_ = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if iou_type == 0:
+        return inter_area / (box_area_ + areas - inter_area)
+    return inter_area / np.maximum(np.minimum(box_area_, areas), 1)
+
+
+class BoxIndex:
+    """Uniform grid spatial index to find the boxes overlapping a query box
+
+    Args:
+        boxes: (n, 4) array of [x1, y1, x2, y2]
+        cell_size: size of the grid cells, default to the median box size
+    """
+
+    def __init__(self, boxes: np.ndarray, cell_size: Optional[float] = None):
+        self.boxes = boxes
+        if cell_size is None:
+            sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            cell_size = float(np.median(sizes)) if len(sizes) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        # the grid extent, queries never look outside of it
+        self._bounds = (
+            (boxes.min(axis=0), boxes.max(axis=0)) if len(boxes) else (None, None)
+        )
+        self._grid: dict = defaultdict(list)
+        for box_id, box in enumerate(boxes):
+            for cell in self._cells(box):
+                self._grid[cell].append(box_id)
+
+    def _cells(self, box: np.ndarray):
+        low, high = self._bounds
+        if low is None:
+            return
+        x1, x2 = sorted((box[0], box[2]))
+        y1, y2 = sorted((box[1], box[3]))
+        x1, y1 = max(x1, min(low[0], low[2])), max(y1, min(low[1], low[3]))
+        x2, y2 = min(x2, max(high[0], high[2])), min(y2, max(high[1], high[3]))
+        for i in range(int(x1 // self.cell_size), int(x2 // self.cell_size) + 1):
+            for j in range(int(y1 // self.cell_size), int(y2 // self.cell_size) + 1):
+                yield i, j
+
+    def query(self, box: np.ndarray) -> np.ndarray:
+        """Return the sorted ids of the boxes that may overlap the query box"""
+        candidates: set = set()
+        for cell in self._cells(box):
+            candidates.update(self._grid.get(cell, ()))
+        return np.array(sorted(candidates), dtype=np.int64)
+
+
 def sort_funsd_reading_order(lines: List[dict], box_key_name: str = "box"):
     """Sort cell list to create the right reading order using their locations
 
@@ -1,13 +1,16 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 
 from .box import (
+    BoxIndex,
     bbox_to_points,
     box_area,
     box_h,
     box_w,
-    get_rect_iou,
+    get_rect_iou_many,
+    locations_to_array,
     points_to_bbox,
     scale_box,
     scale_points,
@@ -74,15 +77,19 @@ def merge_ocr_and_pdf_texts(
     if debug_info is not None:
         cv2, debug_im = debug_info
 
+    pdf_boxes = locations_to_array([item["location"] for item in pdf_text_list])
+    pdf_index = BoxIndex(pdf_boxes)
+
     for ocr_item in ocr_list:
-        matched = False
-        for pdf_item in pdf_text_list:
-            if (
-                get_rect_iou(ocr_item["location"], pdf_item["location"], iou_type=1)
+        ocr_box = locations_to_array([ocr_item["location"]])[0]
+        candidates = pdf_index.query(ocr_box)
+        matched = bool(
+            len(candidates)
+            and (
+                get_rect_iou_many(ocr_box, pdf_boxes[candidates], iou_type=1)
                 > IOU_THRES
-            ):
-                matched = True
-                break
+            ).any()
+        )
 
         color = (255, 0, 0)
         if not matched:
@@ -138,8 +145,18 @@ def merge_table_cell_and_ocr(
     table_list = sorted(table_list, key=lambda item: box_area(item["bbox"]))
 
     all_tables = []
-    matched_pdf_ids = []
-    matched_cell_ids = []
+    matched_pdf_ids: set = set()
+    matched_cell_ids: set = set()
+
+    cell_boxes = locations_to_array([cell["location"] for cell in cell_list])
+    cell_index = BoxIndex(cell_boxes)
+    item_boxes = {
+        "pdf": locations_to_array([item["location"] for item in pdf_list]),
+        "ocr": locations_to_array([item["location"] for item in ocr_list]),
+    }
+    item_indices = {
+        item_type: BoxIndex(boxes) for item_type, boxes in item_boxes.items()
+    }
 
     for table in table_list:
         if debug_info is not None:
@@ -151,28 +168,39 @@ def merge_table_cell_and_ocr(
                 thickness=5,
             )
 
-        cur_table_cells = []
-        for cell_id, cell in enumerate(cell_list):
-            if cell_id in matched_cell_ids:
-                continue
+        table_box = locations_to_array([table["location"]])[0]
+        table_area = box_area(table["bbox"])
+        candidates = [
+            cell_id
+            for cell_id in cell_index.query(table_box).tolist()
+            if cell_id not in matched_cell_ids
+        ]
+        ious = get_rect_iou_many(table_box, cell_boxes[candidates], iou_type=1)
 
-            if get_rect_iou(
-                table["location"], cell["location"], iou_type=1
-            ) > IOU_THRES and box_area(table["bbox"]) > box_area(cell["bbox"]):
+        cur_table_cells = []
+        for cell_id, iou in zip(candidates, ious):
+            cell = cell_list[cell_id]
+            if iou > IOU_THRES and table_area > box_area(cell["bbox"]):
                 color = [128, 0, 128]
+                cell_box = cell_boxes[cell_id]
                 # cell matched to table
                 for item_list, item_type in [(pdf_list, "pdf"), (ocr_list, "ocr")]:
                     cell["ocr"] = []
-                    for item_id, item in enumerate(item_list):
-                        if item_type == "pdf" and item_id in matched_pdf_ids:
-                            continue
-                        if (
-                            get_rect_iou(item["location"], cell["location"], iou_type=1)
-                            > IOU_THRES
-                        ):
-                            cell["ocr"].append(item)
+                    item_ids = item_indices[item_type].query(cell_box).tolist()
+                    if item_type == "pdf":
+                        item_ids = [
+                            item_id
+                            for item_id in item_ids
+                            if item_id not in matched_pdf_ids
+                        ]
+                    item_ious = get_rect_iou_many(
+                        cell_box, item_boxes[item_type][item_ids], iou_type=1
+                    )
+                    for item_id, item_iou in zip(item_ids, item_ious):
+                        if item_iou > IOU_THRES:
+                            cell["ocr"].append(item_list[item_id])
                             if item_type == "pdf":
-                                matched_pdf_ids.append(item_id)
+                                matched_pdf_ids.add(item_id)
 
                     if len(cell["ocr"]) > 0:
                         # check if union of matched ocr does
@@ -203,7 +231,7 @@ def merge_table_cell_and_ocr(
                         thickness=3,
                     )
 
-                matched_cell_ids.append(cell_id)
+                matched_cell_ids.add(cell_id)
                 cur_table_cells.append(cell)
 
         all_tables.append(cur_table_cells)
@@ -224,11 +252,80 @@ def merge_table_cell_and_ocr(
     return all_tables, not_matched_items
 
 
+def parse_ocr_page(
+    page_id: int,
+    page: dict,
+    pdf_item_list: List[dict],
+    artifact_path: Optional[str] = None,
+    debug_path: Optional[str] = None,
+):
+    """Combine OCR output and PDF text of a page to form list of table / non-table
+    regions
+
+    Args:
+        page_id: the page number (0-based)
+        page: OCR output of the page
+        pdf_item_list: PDF texts of the page
+        debug_path: If specified, use OpenCV to plot debug image and save to debug_path
+
+    Returns:
+        List of (page_id, table markdown) and (page_id, non-table text)
+    """
+    ocr_list = page["json"]["ocr"]
+    table_list = page["json"]["table"]
+    page_shape = page["image_shape"]
+
+    # create bbox additional information
+    for item in ocr_list:
+        item["box"] = points_to_bbox(item["location"])
+
+    # re-scale pdf items according to new image size
+    for item in pdf_item_list:
+        scale_factor = page_shape[0] / item["page_shape"][0]
+        item["box"] = scale_box(item["box"], scale_factor=scale_factor)
+        item["location"] = scale_points(item["location"], scale_factor=scale_factor)
+
+    # if using debug mode, openCV must be installed
+    if debug_path and artifact_path is not None:
+        try:
+            import cv2
+        except ImportError:
+            raise ImportError("Please install openCV first to use OCRReader debug mode")
+        image_path = Path(artifact_path) / page["image"]
+        image = cv2.imread(str(image_path))
+        debug_info = (cv2, image)
+    else:
+        debug_info = None
+
+    new_pdf_list = merge_ocr_and_pdf_texts(
+        ocr_list, pdf_item_list, debug_info=debug_info
+    )
+
+    # sort by reading order
+    ocr_list = sort_funsd_reading_order(ocr_list)
+    new_pdf_list = sort_funsd_reading_order(new_pdf_list)
+
+    all_table_cells, non_table_text_list = merge_table_cell_and_ocr(
+        table_list, ocr_list, new_pdf_list, debug_info=debug_info
+    )
+
+    table_texts = [table_cells_to_markdown(cells) for cells in all_table_cells]
+    tables = [(page_id, text) for text in table_texts]
+    text = (page_id, " ".join(item["text"] for item in non_table_text_list))
+
+    # export debug image to debug_path
+    if debug_path:
+        cv2.imwrite(str(Path(debug_path) / "page_{}.png".format(page_id)), image)
+
+    return tables, text
+
+
 def parse_ocr_output(
     ocr_page_items: List[dict],
     pdf_page_items: Dict[int, List[dict]],
     artifact_path: Optional[str] = None,
     debug_path: Optional[str] = None,
+    max_workers: int = 1,
 ):
     """Main function to combine OCR output and PDF text to
     form list of table / non-table regions
@@ -236,60 +333,27 @@ def parse_ocr_output(
         ocr_page_items: List of OCR items by page
         pdf_page_items: Dict of PDF texts (page number as key)
         debug_path: If specified, use OpenCV to plot debug image and save to debug_path
+        max_workers: number of processes to parse the pages in parallel. The pages
+            are parsed in the current process when set to 1 (default) or in debug
+            mode
     """
     all_tables = []
     all_texts = []
 
-    for page_id, page in enumerate(ocr_page_items):
-        ocr_list = page["json"]["ocr"]
-        table_list = page["json"]["table"]
-        page_shape = page["image_shape"]
-        pdf_item_list = pdf_page_items[page_id]
-
-        # create bbox additional information
-        for item in ocr_list:
-            item["box"] = points_to_bbox(item["location"])
-
-        # re-scale pdf items according to new image size
-        for item in pdf_item_list:
-            scale_factor = page_shape[0] / item["page_shape"][0]
-            item["box"] = scale_box(item["box"], scale_factor=scale_factor)
-            item["location"] = scale_points(item["location"], scale_factor=scale_factor)
-
-        # if using debug mode, openCV must be installed
-        if debug_path and artifact_path is not None:
-            try:
-                import cv2
-            except ImportError:
-                raise ImportError(
-                    "Please install openCV first to use OCRReader debug mode"
-                )
-            image_path = Path(artifact_path) / page["image"]
-            image = cv2.imread(str(image_path))
-            debug_info = (cv2, image)
-        else:
-            debug_info = None
-
-        new_pdf_list = merge_ocr_and_pdf_texts(
-            ocr_list, pdf_item_list, debug_info=debug_info
-        )
-
-        # sort by reading order
-        ocr_list = sort_funsd_reading_order(ocr_list)
-        new_pdf_list = sort_funsd_reading_order(new_pdf_list)
-
-        all_table_cells, non_table_text_list = merge_table_cell_and_ocr(
-            table_list, ocr_list, new_pdf_list, debug_info=debug_info
-        )
+    pages = [
+        (page_id, page, pdf_page_items[page_id], artifact_path, debug_path)
+        for page_id, page in enumerate(ocr_page_items)
+    ]
+    max_workers = min(max_workers, len(pages))
 
-        table_texts = [table_cells_to_markdown(cells) for cells in all_table_cells]
-        all_tables.extend([(page_id, text) for text in table_texts])
-        all_texts.append(
-            (page_id, " ".join(item["text"] for item in non_table_text_list))
-        )
+    if max_workers > 1 and not debug_path:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(parse_ocr_page, *zip(*pages)))
+    else:
+        results = [parse_ocr_page(*args) for args in pages]
 
-        # export debug image to debug_path
-        if debug_path:
-            cv2.imwrite(str(Path(debug_path) / "page_{}.png".format(page_id)), image)
+    for tables, text in results:
+        all_tables.extend(tables)
+        all_texts.append(text)
 
     return all_tables, all_texts
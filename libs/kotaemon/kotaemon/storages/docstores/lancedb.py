@@ -1,5 +1,7 @@
 import json
-from typing import List, Optional, Union
+import time
+from datetime import timedelta
+from typing import Any, List, Optional, Union
 
 from kotaemon.base import Document
 
@@ -8,10 +10,42 @@ from .base import BaseDocumentStore
 MAX_DOCS_TO_GET = 10**4
 
 
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
 class LanceDBDocumentStore(BaseDocumentStore):
-    """LancdDB document store which support full-text search query"""
+    """LancdDB document store which support full-text search query
+
+    The full-text index is not rebuilt on every write. With the native LanceDB
+    full-text index, the rows written since the last refresh are still searched
+    (without the index) and a refresh merges them into the index incrementally.
+    With a legacy (tantivy) index, the index is rebuilt before the next query. In
+    both cases, the refreshes are coalesced: they happen when `fts_refresh_rows`
+    rows were written, when `fts_refresh_interval` seconds passed since the last
+    refresh, or when `refresh_fts_index` is called (e.g. after indexing a file).
 
-    def __init__(self, path: str = "lancedb", collection_name: str = "docstore"):
+    Args:
+        path: the LanceDB database uri
+        collection_name: the name of the table
+        fts_refresh_rows: the number of written rows that triggers a refresh
+        fts_refresh_interval: the number of seconds after which the written rows
+            are refreshed on the next write
+        max_filter_ids: the maximum number of ids put in a SQL filter, larger
+            query scopes are filtered on the search results
+        read_consistency_interval: the number of seconds after which the table
+            checks for the changes made by other processes
+    """
+
+    def __init__(
+        self,
+        path: str = "lancedb",
+        collection_name: str = "docstore",
+        fts_refresh_rows: int = 20000,
+        fts_refresh_interval: float = 60,
+        max_filter_ids: int = 1000,
+        read_consistency_interval: Optional[float] = 5,
+    ):
         try:
             import lancedb
         except ImportError:
@@ -21,7 +55,77 @@ class LanceDBDocumentStore(BaseDocumentStore):
 
         self.db_uri = path
         self.collection_name = collection_name
-        self.db_connection = lancedb.connect(self.db_uri)  # type: ignore
+        self.fts_refresh_rows = fts_refresh_rows
+        self.fts_refresh_interval = fts_refresh_interval
+        self.max_filter_ids = max_filter_ids
+        self.read_consistency_interval = read_consistency_interval
+        self.db_connection = lancedb.connect(
+            self.db_uri,
+            read_consistency_interval=(
+                timedelta(seconds=read_consistency_interval)
+                if read_consistency_interval is not None
+                else None
+            ),
+        )  # type: ignore
+
+        self._table: Any = None
+        self._native_fts = False
+        # rows written since the last refresh of the full-text index
+        self._pending_rows = 0
+        self._last_refresh = time.monotonic()
+
+    def _open_table(self):
+        """Get the cached table handle, None if the table does not exist"""
+        if self._table is None and (
+            self.collection_name in self.db_connection.table_names()
+        ):
+            self._table = self.db_connection.open_table(self.collection_name)
+            self._native_fts = self._has_native_fts()
+        return self._table
+
+    def _has_native_fts(self) -> bool:
+        """Whether the full-text index is a native LanceDB index, which searches
+        the rows written after the index was built and can be updated in place
+        """
+        try:
+            return any(
+                index.index_type == "FTS" for index in self._table.list_indices()
+            )
+        except Exception:
+            return False
+
+    def _create_indices(self):
+        self._table.create_fts_index("text", tokenizer_name="en_stem", replace=True)
+        try:
+            self._table.create_scalar_index("id", replace=True)
+        except Exception:
+            # not supported by this version of lancedb, lookups scan the table
+            pass
+        self._native_fts = self._has_native_fts()
+        self._pending_rows = 0
+        self._last_refresh = time.monotonic()
+
+    def refresh_fts_index(self, force: bool = True):
+        """Bring the full-text index up to date with the written rows
+
+        Args:
+            force: refresh even if the refresh thresholds are not reached
+        """
+        if self._open_table() is None or not self._pending_rows:
+            return
+        if not force and (
+            self._pending_rows < self.fts_refresh_rows
+            and time.monotonic() - self._last_refresh < self.fts_refresh_interval
+        ):
+            return
+
+        if self._native_fts:
+            # merge the new rows into the existing index
+            self._table.optimize()
+            self._pending_rows = 0
+            self._last_refresh = time.monotonic()
+        else:
+            self._create_indices()
 
     def add(
         self,
@@ -30,9 +134,20 @@ class LanceDBDocumentStore(BaseDocumentStore):
         refresh_indices: bool = True,
         **kwargs,
     ):
-        """Load documents into lancedb storage."""
+        """Load documents into lancedb storage.
+
+        Args:
+            docs: list of documents to add
+            ids: specify the ids of documents to add or use existing doc.doc_id
+            refresh_indices: allow refreshing the full-text index if the refresh
+                thresholds are reached
+        """
+        if ids and not isinstance(ids, list):
+            ids = [ids]
+        if not isinstance(docs, list):
+            docs = [docs]
         doc_ids = ids if ids else [doc.doc_id for doc in docs]
-        data: list[dict[str, str]] | None = [
+        data: list[dict[str, str]] = [
             {
                 "id": doc_id,
                 "text": doc.text,
@@ -40,48 +155,67 @@ class LanceDBDocumentStore(BaseDocumentStore):
             }
             for doc_id, doc in zip(doc_ids, docs)
         ]
+        if not data:
+            return
 
-        if self.collection_name not in self.db_connection.table_names():
-            if data:
-                document_collection = self.db_connection.create_table(
-                    self.collection_name, data=data, mode="overwrite"
-                )
-        else:
-            # add data to existing table
-            document_collection = self.db_connection.open_table(self.collection_name)
-            if data:
-                document_collection.add(data)
+        document_collection = self._open_table()
+        if document_collection is None:
+            self._table = self.db_connection.create_table(
+                self.collection_name, data=data, mode="overwrite"
+            )
+            self._create_indices()
+            return
 
+        document_collection.add(data)
+        self._pending_rows += len(data)
         if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                tokenizer_name="en_stem",
-                replace=True,
+            self.refresh_fts_index(force=False)
+
+    def _search(self, query: str, top_k: int, doc_ids: Optional[list]) -> list[dict]:
+        document_collection = self._open_table()
+        if document_collection is None:
+            return []
+        if self._pending_rows and not self._native_fts:
+            # the rows written since the last refresh are not searchable yet
+            self.refresh_fts_index()
+
+        if not doc_ids:
+            return (
+                document_collection.search(query, query_type="fts")
+                .limit(top_k)
+                .to_list()
+            )
+
+        if len(doc_ids) <= self.max_filter_ids:
+            query_filter = f"id in ({', '.join(_quote(_id) for _id in doc_ids)})"
+            return (
+                document_collection.search(query, query_type="fts")
+                .where(query_filter, prefilter=True)
+                .limit(top_k)
+                .to_list()
+            )
+
+        # large scope: filter the search results, fetching more results until
+        # enough of them are in scope or all the matches were fetched
+        scope = set(doc_ids)
+        limit = top_k * 4
+        n_rows = document_collection.count_rows()
+        while True:
+            docs = (
+                document_collection.search(query, query_type="fts")
+                .limit(limit)
+                .to_list()
             )
+            in_scope = [doc for doc in docs if doc["id"] in scope]
+            if len(in_scope) >= top_k or len(docs) < limit or limit >= n_rows:
+                return in_scope[:top_k]
+            limit *= 4
 
     def query(
         self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
     ) -> List[Document]:
-        if doc_ids:
-            id_filter = ", ".join([f"'{_id}'" for _id in doc_ids])
-            query_filter = f"id in ({id_filter})"
-        else:
-            query_filter = None
         try:
-            document_collection = self.db_connection.open_table(self.collection_name)
-            if query_filter:
-                docs = (
-                    document_collection.search(query, query_type="fts")
-                    .where(query_filter, prefilter=True)
-                    .limit(top_k)
-                    .to_list()
-                )
-            else:
-                docs = (
-                    document_collection.search(query, query_type="fts")
-                    .limit(top_k)
-                    .to_list()
-                )
+            docs = self._search(query, top_k, doc_ids)
         except (ValueError, FileNotFoundError):
             docs = []
         return [
@@ -98,25 +232,32 @@ class LanceDBDocumentStore(BaseDocumentStore):
         if not isinstance(ids, list):
             ids = [ids]
 
-        id_filter = ", ".join([f"'{_id}'" for _id in ids])
+        docs = []
         try:
-            document_collection = self.db_connection.open_table(self.collection_name)
-            query_filter = f"id in ({id_filter})"
-            docs = (
-                document_collection.search()
-                .where(query_filter)
-                .limit(MAX_DOCS_TO_GET)
-                .to_list()
-            )
+            document_collection = self._open_table()
+            if document_collection is None:
+                return []
+            unique_ids = list(dict.fromkeys(ids))
+            for start in range(0, len(unique_ids), self.max_filter_ids):
+                batch = unique_ids[start : start + self.max_filter_ids]
+                query_filter = f"id in ({', '.join(_quote(_id) for _id in batch)})"
+                docs.extend(
+                    document_collection.search()
+                    .where(query_filter)
+                    .limit(MAX_DOCS_TO_GET)
+                    .to_list()
+                )
         except (ValueError, FileNotFoundError):
             docs = []
+
+        docs_by_id = {doc["id"]: doc for doc in docs}
         return [
             Document(
                 id_=doc["id"],
                 text=doc["text"] if doc["text"] else "<empty>",
                 metadata=json.loads(doc["attributes"]),
             )
-            for doc in docs
+            for doc in (docs_by_id[_id] for _id in ids if _id in docs_by_id)
         ]
 
     def delete(self, ids: Union[List[str], str], refresh_indices: bool = True):
@@ -124,21 +265,28 @@ class LanceDBDocumentStore(BaseDocumentStore):
         if not isinstance(ids, list):
             ids = [ids]
 
-        document_collection = self.db_connection.open_table(self.collection_name)
-        id_filter = ", ".join([f"'{_id}'" for _id in ids])
-        query_filter = f"id in ({id_filter})"
-        document_collection.delete(query_filter)
+        document_collection = self._open_table()
+        if document_collection is None:
+            return
 
-        if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                tokenizer_name="en_stem",
-                replace=True,
+        for start in range(0, len(ids), self.max_filter_ids):
+            batch = ids[start : start + self.max_filter_ids]
+            document_collection.delete(
+                f"id in ({', '.join(_quote(_id) for _id in batch)})"
             )
 
+        if not self._native_fts:
+            # the legacy index still returns the deleted rows until rebuilt
+            self._pending_rows += len(ids)
+        if refresh_indices:
+            self.refresh_fts_index(force=False)
+
     def drop(self):
         """Drop the document store"""
         self.db_connection.drop_table(self.collection_name)
+        self._table = None
+        self._native_fts = False
+        self._pending_rows = 0
 
     def count(self) -> int:
         raise NotImplementedError
@@ -148,6 +296,10 @@ class LanceDBDocumentStore(BaseDocumentStore):
 
     def __persist_flow__(self):
         return {
-            "db_uri": self.db_uri,
+            "path": self.db_uri,
             "collection_name": self.collection_name,
+            "fts_refresh_rows": self.fts_refresh_rows,
+            "fts_refresh_interval": self.fts_refresh_interval,
+            "max_filter_ids": self.max_filter_ids,
+            "read_consistency_interval": self.read_consistency_interval,
         }
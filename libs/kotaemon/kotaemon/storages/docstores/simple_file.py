@@ -1,35 +1,277 @@
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Optional, Union
 
 from kotaemon.base import Document
 
-from .in_memory import InMemoryDocumentStore
+from .base import BaseDocumentStore
 
+# record header: flag, id length, payload length
+_HEADER = struct.Struct("<BHI")
+_PUT = 1
+_DELETE = 2
 
-class SimpleFileDocumentStore(InMemoryDocumentStore):
-    """Improve InMemoryDocumentStore by auto saving whenever the corpus is changed"""
 
-    def __init__(self, path: str | Path, collection_name: str = "default"):
-        super().__init__()
+class SimpleFileDocumentStore(BaseDocumentStore):
+    """Document store persisted as append-only log segments on the local disk
+
+    Each change is appended to the active segment file as a binary record
+    (header, document id, JSON payload) and deletions are tombstone records, so a
+    write only costs the size of the batch. The store keeps an in-memory index of
+    `id -> (segment, offset, length)`, built at startup by scanning the record
+    headers without parsing the documents. Documents are read from disk on demand
+    and a bounded number of them is kept in an LRU cache.
+
+    When the dead records (overwritten or deleted documents) take more than
+    `compact_ratio` of the segments, the live records are rewritten into new
+    segments and the old ones are removed.
+
+    A legacy `{collection_name}.json` file is migrated on the first start.
+
+    Args:
+        path: the directory to store the segments
+        collection_name: the name of the collection, used as segment file prefix
+        max_segment_size: the size in bytes at which a new segment is started
+        compact_ratio: the ratio of dead bytes that triggers a compaction
+        cache_size: the maximum number of documents kept in memory
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        collection_name: str = "default",
+        max_segment_size: int = 64 * 1024 * 1024,
+        compact_ratio: float = 0.5,
+        cache_size: int = 1024,
+    ):
         self._path = path
         self._collection_name = collection_name
+        self._max_segment_size = max_segment_size
+        self._compact_ratio = compact_ratio
+        self._cache_size = cache_size
+
+        self._lock = threading.RLock()
+        self._index: dict[str, tuple[int, int, int]] = {}
+        self._cache: OrderedDict[str, Document] = OrderedDict()
+        # the scanned size of each segment
+        self._segments: dict[int, int] = {}
+        self._total_bytes = 0
+        self._live_bytes = 0
 
         Path(path).mkdir(parents=True, exist_ok=True)
-        self._save_path = Path(path) / f"{collection_name}.json"
-        if self._save_path.is_file():
-            self.load(self._save_path)
+        self._legacy_path = Path(path) / f"{collection_name}.json"
+        self._refresh()
+        if not self._segments and self._legacy_path.is_file():
+            self._migrate_legacy()
 
-    def get(self, ids: Union[List[str], str]) -> List[Document]:
-        """Get document by id"""
-        if not isinstance(ids, list):
-            ids = [ids]
+    def _segment_path(self, segment: int) -> Path:
+        return Path(self._path) / f"{self._collection_name}.{segment:06d}.seg"
+
+    def _list_segments(self) -> list[int]:
+        prefix = f"{self._collection_name}."
+        segments = []
+        for file in Path(self._path).glob(f"{self._collection_name}.*.seg"):
+            number = file.name[len(prefix) : -len(".seg")]
+            if number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def _scan(self, segment: int, start: int):
+        """Index the records of a segment from the `start` offset"""
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(start)
+            offset = start
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                flag, id_len, payload_len = _HEADER.unpack(header)
+                raw_id = f.read(id_len)
+                if len(raw_id) < id_len:
+                    break
+                record_len = _HEADER.size + id_len + payload_len
+                if payload_len and len(f.read(payload_len)) < payload_len:
+                    # partially written record, ignore it
+                    break
+
+                doc_id = raw_id.decode("utf-8")
+                self._discard(doc_id)
+                if flag == _PUT:
+                    self._index[doc_id] = (segment, offset, record_len)
+                    self._live_bytes += record_len
+                self._total_bytes += record_len
+                offset += record_len
+
+        self._segments[segment] = offset
+
+    def _refresh(self):
+        """Index the records written since the last scan, e.g. by another store
+        instance of the same collection
+        """
+        segments = self._list_segments()
+        if not set(self._segments).issubset(segments):
+            # the segments were compacted, re-index from scratch
+            self._index, self._segments = {}, {}
+            self._total_bytes = self._live_bytes = 0
+            self._cache.clear()
+
+        for segment in segments:
+            self._scan(segment, self._segments.get(segment, 0))
+
+    def _discard(self, doc_id: str):
+        """Mark the current record of a document as dead"""
+        if doc_id in self._index:
+            self._live_bytes -= self._index.pop(doc_id)[2]
+        self._cache.pop(doc_id, None)
+
+    def _encode(self, flag: int, doc_id: str, doc: Optional[Document] = None) -> bytes:
+        raw_id = doc_id.encode("utf-8")
+        payload = json.dumps(doc.to_dict()).encode("utf-8") if doc is not None else b""
+        return _HEADER.pack(flag, len(raw_id), len(payload)) + raw_id + payload
+
+    def _remember(self, doc_id: str, doc: Document):
+        """Keep the document in the LRU cache"""
+        self._cache[doc_id] = doc
+        self._cache.move_to_end(doc_id)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _append(self, records: list[tuple[int, str, Optional[Document]]]):
+        """Append the records to the last segment, rolling over when it is full"""
+        segment = max(self._segments, default=0)
+        self._segments.setdefault(segment, 0)
+
+        f = None
+        try:
+            for flag, doc_id, doc in records:
+                data = self._encode(flag, doc_id, doc)
+                if f is None:
+                    f = open(self._segment_path(segment), "ab")
+                if f.tell() != self._segments[segment] or (
+                    f.tell() and f.tell() + len(data) > self._max_segment_size
+                ):
+                    # the segment is full or ends with a partially written record
+                    f.close()
+                    segment += 1
+                    self._segments[segment] = 0
+                    f = open(self._segment_path(segment), "ab")
+
+                offset = self._segments[segment]
+                f.write(data)
+                self._segments[segment] = offset + len(data)
+                self._total_bytes += len(data)
+
+                self._discard(doc_id)
+                if flag == _PUT:
+                    self._index[doc_id] = (segment, offset, len(data))
+                    self._live_bytes += len(data)
+                    self._remember(doc_id, doc)
+
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+
+    def _read(self, doc_ids: list[str]) -> dict[str, Document]:
+        """Read the documents from the segments, in file order"""
+        result = {}
+        locations = sorted((self._index[doc_id], doc_id) for doc_id in doc_ids)
+        f, opened = None, None
+        try:
+            for (segment, offset, length), doc_id in locations:
+                if opened != segment:
+                    if f is not None:
+                        f.close()
+                    f, opened = open(self._segment_path(segment), "rb"), segment
+                f.seek(offset)
+                record = f.read(length)
+                _, id_len, _ = _HEADER.unpack_from(record)
+                result[doc_id] = Document.from_dict(
+                    json.loads(record[_HEADER.size + id_len :])
+                )
+        finally:
+            if f is not None:
+                f.close()
+        return result
 
-        for doc_id in ids:
-            if doc_id not in self._store:
-                self.load(self._save_path)
-                break
+    def _migrate_legacy(self):
+        """Move the documents of the legacy JSON file into the segments"""
+        with open(self._legacy_path) as f:
+            store = json.load(f)
+        self._append(
+            [
+                (_PUT, doc_id, Document.from_dict(value))
+                for doc_id, value in store.items()
+            ]
+        )
+        self._legacy_path.rename(self._legacy_path.with_suffix(".json.bak"))
 
-        return [self._store[doc_id] for doc_id in ids]
+    def _maybe_compact(self):
+        dead_bytes = self._total_bytes - self._live_bytes
+        if dead_bytes and dead_bytes >= self._compact_ratio * self._total_bytes:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the live documents into new segments and remove the old ones
+
+        The new segments are numbered after the old ones, so if the process stops
+        before the old segments are removed, the new records still take precedence
+        when the segments are scanned.
+        """
+        with self._lock:
+            self._refresh()
+            old_segments = sorted(self._segments)
+            locations = sorted(
+                (location, doc_id) for doc_id, location in self._index.items()
+            )
+
+            segment = max(old_segments, default=-1) + 1
+            index: dict[str, tuple[int, int, int]] = {}
+            segments = {segment: 0}
+            src, opened = None, None
+            dst = open(self._segment_path(segment), "wb")
+            try:
+                for (old_segment, offset, length), doc_id in locations:
+                    if opened != old_segment:
+                        if src is not None:
+                            src.close()
+                        src = open(self._segment_path(old_segment), "rb")
+                        opened = old_segment
+                    src.seek(offset)
+                    data = src.read(length)
+
+                    if segments[segment] + length > self._max_segment_size and (
+                        segments[segment]
+                    ):
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                        dst.close()
+                        segment += 1
+                        segments[segment] = 0
+                        dst = open(self._segment_path(segment), "wb")
+
+                    index[doc_id] = (segment, segments[segment], length)
+                    dst.write(data)
+                    segments[segment] += length
+                dst.flush()
+                os.fsync(dst.fileno())
+            finally:
+                dst.close()
+                if src is not None:
+                    src.close()
+
+            for old_segment in old_segments:
+                self._segment_path(old_segment).unlink(missing_ok=True)
+
+            self._index = index
+            self._segments = segments
+            self._total_bytes = self._live_bytes = sum(segments.values())
 
     def add(
         self,
@@ -46,18 +288,95 @@ class SimpleFileDocumentStore(InMemoryDocumentStore):
             exist_ok: raise error when duplicate doc-id
                 found in the docstore (default to False)
         """
-        super().add(docs=docs, ids=ids, **kwargs)
-        self.save(self._save_path)
+        exist_ok: bool = kwargs.pop("exist_ok", False)
+
+        if ids and not isinstance(ids, list):
+            ids = [ids]
+        if not isinstance(docs, list):
+            docs = [docs]
+        doc_ids = ids if ids else [doc.doc_id for doc in docs]
+
+        with self._lock:
+            self._refresh()
+            if not exist_ok:
+                for doc_id in doc_ids:
+                    if doc_id in self._index:
+                        raise ValueError(f"Document with id {doc_id} already exist")
+
+            self._append([(_PUT, doc_id, doc) for doc_id, doc in zip(doc_ids, docs)])
+            self._maybe_compact()
+
+    def get(self, ids: Union[List[str], str]) -> List[Document]:
+        """Get document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._lock:
+            if any(doc_id not in self._index for doc_id in ids):
+                self._refresh()
+
+            docs = {
+                doc_id: self._cache[doc_id] for doc_id in ids if doc_id in self._cache
+            }
+            to_read = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in docs]
+            try:
+                docs.update(self._read(to_read))
+            except FileNotFoundError:
+                # the segments were compacted by another instance
+                self._refresh()
+                docs.update(self._read(to_read))
+
+            for doc_id in ids:
+                if doc_id in self._cache:
+                    self._cache.move_to_end(doc_id)
+                else:
+                    self._remember(doc_id, docs[doc_id])
+
+        return [docs[doc_id] for doc_id in ids]
+
+    def get_all(self) -> List[Document]:
+        """Get all documents"""
+        with self._lock:
+            self._refresh()
+            ids = list(self._index)
+            docs = self._read(ids)
+        return [docs[doc_id] for doc_id in ids]
+
+    def count(self) -> int:
+        """Count number of documents"""
+        with self._lock:
+            self._refresh()
+            return len(self._index)
 
     def delete(self, ids: Union[List[str], str]):
         """Delete document by id"""
-        super().delete(ids=ids)
-        self.save(self._save_path)
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._lock:
+            self._refresh()
+            for doc_id in ids:
+                if doc_id not in self._index:
+                    raise KeyError(doc_id)
+
+            self._append([(_DELETE, doc_id, None) for doc_id in ids])
+            self._maybe_compact()
+
+    def query(
+        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+    ) -> List[Document]:
+        """Perform full-text search on document store"""
+        return []
 
     def drop(self):
         """Drop the document store"""
-        super().drop()
-        self._save_path.unlink(missing_ok=True)
+        with self._lock:
+            for segment in self._list_segments():
+                self._segment_path(segment).unlink(missing_ok=True)
+            self._legacy_path.unlink(missing_ok=True)
+            self._index, self._segments = {}, {}
+            self._total_bytes = self._live_bytes = 0
+            self._cache.clear()
 
     def __persist_flow__(self):
         from theflow.utils.modules import serialize
@@ -65,4 +384,7 @@ class SimpleFileDocumentStore(InMemoryDocumentStore):
         return {
             "path": serialize(self._path),
             "collection_name": self._collection_name,
+            "max_segment_size": self._max_segment_size,
+            "compact_ratio": self._compact_ratio,
+            "cache_size": self._cache_size,
         }
@@ -1,5 +1,6 @@
 from .base import BaseVectorStore
 from .chroma import ChromaVectorStore
+from .hnsw import HNSWVectorStore
 from .in_memory import InMemoryVectorStore
 from .lancedb import LanceDBVectorStore
 from .milvus import MilvusVectorStore
@@ -9,6 +10,7 @@ from .simple_file import SimpleFileVectorStore
 __all__ = [
     "BaseVectorStore",
     "ChromaVectorStore",
+    "HNSWVectorStore",
     "InMemoryVectorStore",
     "SimpleFileVectorStore",
     "LanceDBVectorStore",
@@ -0,0 +1,433 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+)
+
+from kotaemon.base import DocumentWithEmbedding
+
+from .base import BaseVectorStore
+
+
+class HNSWVectorStore(BaseVectorStore):
+    """In-process approximate nearest neighbour vector store, using `hnswlib`
+
+    The HNSW graph is kept in memory and persisted in the `path` directory as a
+    snapshot (`{collection_name}.{generation}.hnsw` and `{collection_name}.json`)
+    plus a write-ahead log of the changes made since the snapshot. The snapshot is
+    only rewritten when the log grows past `snapshot_ratio` of the index, so the
+    cost of a write stays proportional to its batch.
+
+    `ef` trades recall for latency at query time (the larger, the more accurate
+    and slower) and can be set in the `KH_VECTORSTORE` setting, or per query with
+    the `ef` keyword. Queries scoped to ids (`ids`/`scope`) or to metadata values
+    (`filters`, e.g. the `file_id` filter of the file index) are searched on the
+    graph with a label filter, or exhaustively when the scope is small.
+
+    Args:
+        path: the directory to store the index
+        collection_name: the name of the collection, used as file prefix
+        space: the distance of the index: "cosine", "ip" or "l2"
+        M: the number of links of each node in the graph
+        ef_construction: the size of the candidate list when inserting
+        ef: the size of the candidate list when querying
+        exact_search_threshold: scopes of at most this size are searched
+            exhaustively
+        snapshot_ratio: the size of the log, relative to the index, that triggers
+            a new snapshot
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        collection_name: str = "default",
+        space: str = "cosine",
+        M: int = 16,
+        ef_construction: int = 200,
+        ef: int = 64,
+        exact_search_threshold: int = 2000,
+        snapshot_ratio: float = 0.2,
+        **kwargs: Any,
+    ):
+        try:
+            import hnswlib  # noqa: F401
+        except ImportError:
+            raise ImportError("Please install hnswlib: 'pip install hnswlib'")
+
+        self._path = path
+        self._collection_name = collection_name
+        self._space = space
+        self._M = M
+        self._ef_construction = ef_construction
+        self._ef = ef
+        self._exact_search_threshold = exact_search_threshold
+        self._snapshot_ratio = snapshot_ratio
+
+        self._lock = threading.RLock()
+        self._meta_path = Path(path) / f"{collection_name}.json"
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        self._index = None
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._next_label = 0
+        self._label_of: dict[str, int] = {}
+        self._id_of: dict[int, str] = {}
+        self._metadata: dict[int, dict] = {}
+        # key -> value -> labels, built lazily to filter by metadata
+        self._value_index: dict[str, Optional[dict[Any, set[int]]]] = {}
+        self._n_logged = 0
+        self._load()
+
+    def _index_path(self, generation: int) -> Path:
+        return Path(self._path) / f"{self._collection_name}.{generation}.hnsw"
+
+    def _log_path(self, generation: int) -> Path:
+        return Path(self._path) / f"{self._collection_name}.{generation}.log.jsonl"
+
+    def _new_index(self, dim: int, max_elements: int):
+        import hnswlib
+
+        index = hnswlib.Index(space=self._space, dim=dim)
+        index.init_index(
+            max_elements=max_elements,
+            ef_construction=self._ef_construction,
+            M=self._M,
+            allow_replace_deleted=True,
+        )
+        index.set_ef(self._ef)
+        return index
+
+    def _load(self):
+        """Load the last snapshot and replay the changes logged after it"""
+        import hnswlib
+
+        if self._meta_path.is_file():
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self._dim = meta["dim"]
+            self._generation = meta["generation"]
+            self._next_label = meta["next_label"]
+            for id_, label, metadata in meta["items"]:
+                self._register(id_, label, metadata)
+
+            self._index = hnswlib.Index(space=self._space, dim=self._dim)
+            self._index.load_index(
+                str(self._index_path(self._generation)), allow_replace_deleted=True
+            )
+            self._index.set_ef(self._ef)
+
+        log_path = self._log_path(self._generation)
+        if not log_path.is_file():
+            return
+        valid_size = 0
+        with open(log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                valid_size += len(line)
+                record = json.loads(line)
+                if "delete" in record:
+                    self._delete_labels(record["delete"])
+                else:
+                    self._insert(
+                        record["ids"],
+                        np.asarray(record["vectors"], dtype=np.float32),
+                        record["metadatas"],
+                    )
+                self._n_logged += len(record.get("ids", record.get("delete", [])))
+
+        if valid_size < log_path.stat().st_size:
+            # drop the partially written record so that new records can follow
+            os.truncate(log_path, valid_size)
+
+    def _register(self, id_: str, label: int, metadata: dict):
+        self._label_of[id_] = label
+        self._id_of[label] = id_
+        self._metadata[label] = metadata
+        for key, index in self._value_index.items():
+            if index is not None and key in metadata:
+                self._index_value(key, index, label)
+
+    def _index_value(self, key: str, index: dict, label: int):
+        try:
+            index.setdefault(self._metadata[label][key], set()).add(label)
+        except TypeError:
+            # unhashable values (e.g. lists) are filtered label by label
+            self._value_index[key] = None
+
+    def _delete_labels(self, ids: list[str]):
+        assert self._index is not None
+        for id_ in ids:
+            label = self._label_of.pop(id_, None)
+            if label is None:
+                continue
+            self._index.mark_deleted(label)
+            del self._id_of[label]
+            metadata = self._metadata.pop(label)
+            for key, index in self._value_index.items():
+                if index is not None and key in metadata:
+                    index.get(metadata[key], set()).discard(label)
+
+    def _insert(self, ids: list[str], vectors: np.ndarray, metadatas: list[dict]):
+        """Insert the vectors in the graph, replacing the vectors of the same id"""
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        if self._index is None:
+            self._index = self._new_index(self._dim, max(1024, 2 * len(ids)))
+
+        self._delete_labels([id_ for id_ in ids if id_ in self._label_of])
+        needed = self._index.element_count + len(ids)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+
+        labels = list(range(self._next_label, self._next_label + len(ids)))
+        self._next_label += len(ids)
+        self._index.add_items(vectors, labels, replace_deleted=True)
+        for id_, label, metadata in zip(ids, labels, metadatas):
+            self._register(id_, label, metadata)
+
+    def _log(self, record: dict, n_items: int):
+        with open(self._log_path(self._generation), "ab") as f:
+            f.write((json.dumps(record) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._n_logged += n_items
+        if self._n_logged > self._snapshot_ratio * max(len(self._label_of), 1000):
+            self.snapshot()
+
+    def snapshot(self):
+        """Persist the whole index and start a new log"""
+        with self._lock:
+            if self._index is None:
+                return
+
+            generation = self._generation + 1
+            self._index.save_index(str(self._index_path(generation)))
+            meta = {
+                "dim": self._dim,
+                "generation": generation,
+                "next_label": self._next_label,
+                "items": [
+                    [id_, label, self._metadata[label]]
+                    for id_, label in self._label_of.items()
+                ],
+            }
+            tmp_meta_path = self._meta_path.with_suffix(".tmp")
+            with open(tmp_meta_path, "w") as f:
+                json.dump(meta, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # the metadata switches to the new snapshot atomically
+            os.replace(tmp_meta_path, self._meta_path)
+
+            self._index_path(self._generation).unlink(missing_ok=True)
+            self._log_path(self._generation).unlink(missing_ok=True)
+            self._generation = generation
+            self._n_logged = 0
+
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[str]:
+        if not embeddings:
+            return []
+
+        if isinstance(embeddings[0], DocumentWithEmbedding):
+            docs: list[DocumentWithEmbedding] = embeddings  # type: ignore
+            vectors = [doc.embedding for doc in docs]
+            if metadatas is None:
+                metadatas = [doc.metadata for doc in docs]
+            if ids is None:
+                ids = [doc.doc_id for doc in docs]
+        else:
+            vectors = embeddings  # type: ignore
+        if ids is None:
+            import uuid
+
+            ids = [str(uuid.uuid4()) for _ in vectors]
+        if metadatas is None:
+            metadatas = [{} for _ in vectors]
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or (self._dim and matrix.shape[1] != self._dim):
+            raise ValueError(
+                f"Expected embeddings of dimension {self._dim or 'the same size'}"
+            )
+
+        with self._lock:
+            self._insert(list(ids), matrix, list(metadatas))
+            self._log(
+                {"ids": ids, "vectors": matrix.tolist(), "metadatas": metadatas},
+                len(ids),
+            )
+        return list(ids)
+
+    def delete(self, ids: list[str], **kwargs):
+        with self._lock:
+            ids = [id_ for id_ in ids if id_ in self._label_of]
+            if ids:
+                self._delete_labels(ids)
+                self._log({"delete": ids}, len(ids))
+
+    def _match_labels(self, filters: MetadataFilters) -> set[int]:
+        """Get the labels matching the metadata filters"""
+        from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+
+        matches = []
+        for filter_ in filters.filters:
+            if isinstance(filter_, MetadataFilters):
+                matches.append(self._match_labels(filter_))
+                continue
+
+            index = None
+            if filter_.operator in (FilterOperator.EQ, FilterOperator.IN):
+                if filter_.key not in self._value_index:
+                    index = {}
+                    self._value_index[filter_.key] = index
+                    for label, metadata in self._metadata.items():
+                        if filter_.key in metadata:
+                            self._index_value(filter_.key, index, label)
+                index = self._value_index[filter_.key]
+
+            if index is not None:
+                values = filter_.value
+                if filter_.operator == FilterOperator.EQ:
+                    values = [values]
+                matches.append(
+                    set().union(*[index.get(value, set()) for value in values])
+                )
+            else:
+                match = _build_metadata_filter_fn(
+                    lambda label: self._metadata[label],
+                    MetadataFilters(filters=[filter_]),
+                )
+                matches.append({label for label in self._metadata if match(label)})
+
+        if not matches:
+            return set(self._metadata)
+        if filters.condition == FilterCondition.OR:
+            return set().union(*matches)
+        return set.intersection(*matches)
+
+    def _exact_search(
+        self, query: np.ndarray, labels: list[int], top_k: int
+    ) -> tuple[list[int], list[float]]:
+        assert self._index is not None
+        vectors = np.asarray(self._index.get_items(labels), dtype=np.float32)
+        if self._space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+            norms[norms == 0] = 1.0
+            scores = vectors @ query / norms
+        elif self._space == "ip":
+            scores = vectors @ query
+        else:
+            scores = -np.sum((vectors - query) ** 2, axis=1)
+
+        top = np.argsort(-scores, kind="stable")[:top_k]
+        return [labels[i] for i in top], scores[top].tolist()
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Return the top k most similar vector embeddings
+
+        Args:
+            embedding: List of embeddings
+            top_k: Number of most similar embeddings to return
+            ids: List of ids of the embeddings to be queried
+            kwargs: `scope` (alias of `ids`), `filters` (llama-index
+                MetadataFilters) and `ef` (override the `ef` of the store)
+
+        Returns:
+            the matched embeddings, the similarity scores, and the ids
+        """
+        if ids is None:
+            ids = kwargs.get("scope")
+        query = np.asarray(embedding, dtype=np.float32)
+
+        with self._lock:
+            if self._index is None or not self._label_of or top_k <= 0:
+                return [], [], []
+
+            allowed: Optional[set[int]] = None
+            if ids is not None:
+                allowed = {self._label_of[id_] for id_ in ids if id_ in self._label_of}
+            if kwargs.get("filters") is not None:
+                matched = self._match_labels(kwargs["filters"])
+                allowed = matched if allowed is None else allowed & matched
+
+            n_candidates = len(self._label_of) if allowed is None else len(allowed)
+            top_k = min(top_k, n_candidates)
+            if not top_k:
+                return [], [], []
+
+            if allowed is not None and len(allowed) <= self._exact_search_threshold:
+                labels, scores = self._exact_search(query, sorted(allowed), top_k)
+            else:
+                self._index.set_ef(max(kwargs.get("ef", self._ef), top_k))
+                try:
+                    found, distances = self._index.knn_query(
+                        query,
+                        k=top_k,
+                        filter=None if allowed is None else allowed.__contains__,
+                    )
+                    labels = found[0].tolist()
+                    if self._space == "l2":
+                        scores = (-distances[0]).tolist()
+                    else:
+                        scores = (1 - distances[0]).tolist()
+                except RuntimeError:
+                    # the graph search could not find enough neighbours
+                    candidates = (
+                        sorted(allowed) if allowed is not None else list(self._id_of)
+                    )
+                    labels, scores = self._exact_search(query, candidates, top_k)
+                finally:
+                    self._index.set_ef(self._ef)
+
+            vectors = np.asarray(self._index.get_items(labels)).tolist()
+            out_ids = [self._id_of[label] for label in labels]
+
+        return vectors, scores, out_ids
+
+    def count(self) -> int:
+        return len(self._label_of)
+
+    def drop(self):
+        with self._lock:
+            self._index_path(self._generation).unlink(missing_ok=True)
+            self._log_path(self._generation).unlink(missing_ok=True)
+            self._meta_path.unlink(missing_ok=True)
+            self._index = None
+            self._dim = None
+            self._generation = 0
+            self._next_label = 0
+            self._label_of, self._id_of, self._metadata = {}, {}, {}
+            self._value_index = {}
+            self._n_logged = 0
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self._path),
+            "collection_name": self._collection_name,
+            "space": self._space,
+            "M": self._M,
+            "ef_construction": self._ef_construction,
+            "ef": self._ef,
+            "exact_search_threshold": self._exact_search_threshold,
+            "snapshot_ratio": self._snapshot_ratio,
+        }
@@ -1,73 +1,514 @@
 """Simple file vector store index."""
+import json
+import os
+import threading
+import uuid
 from pathlib import Path
-from typing import Any, Optional, Type
+from typing import Any, Optional
 
-import fsspec
-from llama_index.core.vector_stores import SimpleVectorStore as LISimpleVectorStore
-from llama_index.core.vector_stores.simple import SimpleVectorStoreData
+import numpy as np
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQueryMode,
+)
 
 from kotaemon.base import DocumentWithEmbedding
 
-from .base import LlamaIndexVectorStore
+from .base import BaseVectorStore
 
+_INDEXED_OPERATORS = (
+    FilterOperator.EQ,
+    FilterOperator.NE,
+    FilterOperator.IN,
+    FilterOperator.NIN,
+)
 
-class SimpleFileVectorStore(LlamaIndexVectorStore):
-    """Similar to InMemoryVectorStore but is backed by file by default"""
 
-    _li_class: Type[LISimpleVectorStore] = LISimpleVectorStore
-    store_text: bool = False
+class SimpleFileVectorStore(BaseVectorStore):
+    """Vector store backed by memory-mapped float32 files on the local disk
+
+    The vectors are rows of a contiguous float32 matrix, appended to
+    `{collection_name}.{generation}.f32` together with their norms, while
+    `{collection_name}.rows.jsonl` logs the id and metadata of each row and the
+    deletions. Adding vectors only appends to these files and deleting only marks
+    the rows as dead; the dead rows are dropped by a compaction (new generation of
+    the files) once they take more than `compact_ratio` of the matrix.
+
+    Queries compute the cosine similarities with a blocked matrix-vector product
+    over the memory-mapped matrix and select the top k with `argpartition`. The
+    `ids`/`scope` and the metadata `filters` restrict the search with a row mask.
+
+    A legacy JSON file persisted by the LlamaIndex `SimpleVectorStore` is migrated
+    on the first start.
+
+    Args:
+        path: the directory to store the files
+        collection_name: the name of the collection, used as file prefix
+        compact_ratio: the ratio of dead rows that triggers a compaction
+        block_size: the number of rows scored at once in a query
+    """
 
     def __init__(
         self,
         path: str | Path,
         collection_name: str = "default",
-        data: Optional[SimpleVectorStoreData] = None,
-        fs: Optional[fsspec.AbstractFileSystem] = None,
+        compact_ratio: float = 0.5,
+        block_size: int = 65536,
         **kwargs: Any,
     ) -> None:
-        """Initialize params."""
-        self._data = data or SimpleVectorStoreData()
-        self._fs = fs or fsspec.filesystem("file")
-        self._collection_name = collection_name
         self._path = path
-        self._save_path = Path(path) / collection_name
+        self._collection_name = collection_name
+        self._compact_ratio = compact_ratio
+        self._block_size = block_size
+
+        self._lock = threading.RLock()
+        self._log_path = Path(path) / f"{collection_name}.rows.jsonl"
+        self._legacy_path = Path(path) / collection_name
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        self._reset()
+        self._refresh()
+        if not self._n_rows and self._legacy_path.is_file():
+            self._migrate_legacy()
+
+    def _reset(self):
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._n_rows = 0
+        self._n_dead = 0
+        self._ids: list[str] = []
+        self._metadata: list[dict] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_of: dict[str, int] = {}
+        # key -> value -> rows, built lazily to filter by metadata
+        self._value_index: dict[str, Optional[dict[Any, list[int]]]] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+
+    def _data_paths(self, generation: int) -> tuple[Path, Path]:
+        prefix = f"{self._collection_name}.{generation}"
+        return (
+            Path(self._path) / f"{prefix}.f32",
+            Path(self._path) / f"{prefix}.norm.f32",
+        )
+
+    def _refresh(self):
+        """Read the rows logged since the last read, e.g. by another instance"""
+        if not self._log_path.is_file():
+            if self._log_inode is not None:
+                self._reset()
+            return
+
+        stat = self._log_path.stat()
+        if self._log_inode is not None and stat.st_ino != self._log_inode:
+            # the files were compacted, reload from scratch
+            self._reset()
+        self._log_inode = stat.st_ino
+        if stat.st_size == self._log_offset:
+            return
+
+        new_ids: list[str] = []
+        new_metadata: list[dict] = []
+        with open(self._log_path, "rb") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # partially written record, ignore it
+                    break
+                self._log_offset += len(line)
+                record = json.loads(line)
+                if "dim" in record:
+                    self._dim = record["dim"]
+                    self._generation = record["generation"]
+                elif "id" in record:
+                    new_ids.append(record["id"])
+                    new_metadata.append(record.get("metadata") or {})
+                elif "delete" in record:
+                    self._append_rows(new_ids, new_metadata)
+                    new_ids, new_metadata = [], []
+                    self._mark_dead(record["delete"])
+
+        self._append_rows(new_ids, new_metadata)
+        self._remap()
 
-        super().__init__(
-            data=data,
-            fs=fs,
-            **kwargs,
+    def _remap(self):
+        """Memory-map the rows of the current generation"""
+        self._vectors = self._norms = None
+        if not self._n_rows or self._dim is None:
+            return
+        vectors_path, norms_path = self._data_paths(self._generation)
+        self._vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode="r", shape=(self._n_rows, self._dim)
         )
+        self._norms = np.memmap(
+            norms_path, dtype=np.float32, mode="r", shape=(self._n_rows,)
+        )
+
+    def _append_rows(self, ids: list[str], metadatas: list[dict]):
+        """Register the rows appended to the matrix, replacing rows of the same id"""
+        if not ids:
+            return
+        start = self._n_rows
+        self._ids.extend(ids)
+        self._metadata.extend(metadatas)
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._n_rows += len(ids)
+
+        for row, id_ in enumerate(ids, start=start):
+            if id_ in self._row_of:
+                self._alive[self._row_of[id_]] = False
+                self._n_dead += 1
+            self._row_of[id_] = row
+
+        for key, index in self._value_index.items():
+            if index is not None:
+                self._index_rows(key, index, range(start, self._n_rows))
+
+    def _mark_dead(self, ids: list[str]):
+        for id_ in ids:
+            row = self._row_of.pop(id_, None)
+            if row is not None:
+                self._alive[row] = False
+                self._n_dead += 1
+
+    def _index_rows(self, key: str, index: dict, rows) -> bool:
+        for row in rows:
+            if key not in self._metadata[row]:
+                continue
+            value = self._metadata[row][key]
+            try:
+                index.setdefault(value, []).append(row)
+            except TypeError:
+                # unhashable values (e.g. lists) are filtered row by row
+                self._value_index[key] = None
+                return False
+        return True
+
+    def _write(self, vectors: np.ndarray, records: list[dict]):
+        """Write the rows at the end of the matrix, then commit them to the log"""
+        vectors_path, norms_path = self._data_paths(self._generation)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        for file_path, data, row_size in [
+            (vectors_path, vectors, vectors.shape[1] * 4),
+            (norms_path, norms, 4),
+        ]:
+            with open(file_path, "r+b" if file_path.is_file() else "wb") as f:
+                # overwrite the rows that were not committed to the log
+                f.seek(self._n_rows * row_size)
+                f.write(data.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with open(self._log_path, "r+b" if self._log_path.is_file() else "wb") as f:
+            f.seek(self._log_offset)
+            f.write(lines.encode("utf-8"))
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_offset += len(lines.encode("utf-8"))
+        self._log_inode = self._log_path.stat().st_ino
 
-        if self._save_path.is_file():
-            self._client = self._li_class.from_persist_path(
-                persist_path=str(self._save_path), fs=self._fs
+    def _migrate_legacy(self):
+        """Move the vectors of the legacy JSON file into the memory-mapped files"""
+        with open(self._legacy_path) as f:
+            data = json.load(f)
+        embedding_dict = data.get("embedding_dict", {})
+        metadata_dict = data.get("metadata_dict") or {}
+        if embedding_dict:
+            ids = list(embedding_dict)
+            self.add(
+                embeddings=[embedding_dict[id_] for id_ in ids],
+                metadatas=[metadata_dict.get(id_) or {} for id_ in ids],
+                ids=ids,
             )
+        self._legacy_path.rename(f"{self._legacy_path}.bak")
 
     def add(
         self,
         embeddings: list[list[float]] | list[DocumentWithEmbedding],
         metadatas: Optional[list[dict]] = None,
         ids: Optional[list[str]] = None,
-    ):
-        r = super().add(embeddings, metadatas, ids)
-        self._client.persist(str(self._save_path), self._fs)
-        return r
+    ) -> list[str]:
+        if not embeddings:
+            return []
+
+        if isinstance(embeddings[0], DocumentWithEmbedding):
+            docs: list[DocumentWithEmbedding] = embeddings  # type: ignore
+            vectors = [doc.embedding for doc in docs]
+            if metadatas is None:
+                metadatas = [doc.metadata for doc in docs]
+            if ids is None:
+                ids = [doc.doc_id for doc in docs]
+        else:
+            vectors = embeddings  # type: ignore
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in vectors]
+        if metadatas is None:
+            metadatas = [{} for _ in vectors]
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("All embeddings must have the same dimension")
+
+        with self._lock:
+            self._refresh()
+            records = [
+                {"id": id_, "metadata": metadata}
+                for id_, metadata in zip(ids, metadatas)
+            ]
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+                records.insert(0, {"dim": self._dim, "generation": self._generation})
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(
+                    f"Expected embeddings of dimension {self._dim}, "
+                    f"got {matrix.shape[1]}"
+                )
+
+            self._write(matrix, records)
+            self._append_rows(list(ids), list(metadatas))
+            self._remap()
+            self._maybe_compact()
+
+        return list(ids)
 
     def delete(self, ids: list[str], **kwargs):
-        r = super().delete(ids, **kwargs)
-        self._client.persist(str(self._save_path), self._fs)
-        return r
+        with self._lock:
+            self._refresh()
+            ids = [id_ for id_ in ids if id_ in self._row_of]
+            if not ids:
+                return
+
+            lines = (json.dumps({"delete": ids}) + "\n").encode("utf-8")
+            with open(self._log_path, "r+b") as f:
+                f.seek(self._log_offset)
+                f.write(lines)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_offset += len(lines)
+            self._mark_dead(ids)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._n_dead and self._n_dead >= self._compact_ratio * self._n_rows:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the alive rows into a new generation of files"""
+        with self._lock:
+            self._refresh()
+            if self._dim is None:
+                return
+
+            old_generation = self._generation
+            generation = old_generation + 1
+            vectors_path, norms_path = self._data_paths(generation)
+            rows = np.flatnonzero(self._alive)
+            with open(vectors_path, "wb") as fv, open(norms_path, "wb") as fn:
+                for start in range(0, len(rows), self._block_size):
+                    block = rows[start : start + self._block_size]
+                    assert self._vectors is not None and self._norms is not None
+                    fv.write(np.ascontiguousarray(self._vectors[block]).tobytes())
+                    fn.write(np.ascontiguousarray(self._norms[block]).tobytes())
+                fv.flush()
+                fn.flush()
+                os.fsync(fv.fileno())
+                os.fsync(fn.fileno())
+
+            tmp_log_path = self._log_path.with_suffix(".tmp")
+            with open(tmp_log_path, "w") as f:
+                f.write(json.dumps({"dim": self._dim, "generation": generation}) + "\n")
+                for row in rows:
+                    record = {"id": self._ids[row], "metadata": self._metadata[row]}
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            # the log switches to the new generation atomically
+            self._vectors = self._norms = None
+            os.replace(tmp_log_path, self._log_path)
+            for old_path in self._data_paths(old_generation):
+                old_path.unlink(missing_ok=True)
+
+            self._reset()
+            self._refresh()
+
+    def _filter_mask(self, filters: MetadataFilters) -> np.ndarray:
+        """Get the mask of the rows matching the metadata filters"""
+        from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+
+        masks = []
+        for filter_ in filters.filters:
+            if isinstance(filter_, MetadataFilters):
+                masks.append(self._filter_mask(filter_))
+                continue
+
+            index = None
+            if filter_.operator in _INDEXED_OPERATORS:
+                if filter_.key not in self._value_index:
+                    index = {}
+                    self._value_index[filter_.key] = index
+                    if not self._index_rows(filter_.key, index, range(self._n_rows)):
+                        index = None
+                else:
+                    index = self._value_index[filter_.key]
+
+            mask = np.zeros(self._n_rows, dtype=bool)
+            if index is not None:
+                values = filter_.value
+                if filter_.operator in (FilterOperator.EQ, FilterOperator.NE):
+                    values = [values]
+                for value in values:  # type: ignore
+                    mask[index.get(value, [])] = True
+                if filter_.operator in (FilterOperator.NE, FilterOperator.NIN):
+                    has_key = np.zeros(self._n_rows, dtype=bool)
+                    for key_rows in index.values():
+                        has_key[key_rows] = True
+                    mask = has_key & ~mask
+            else:
+                match = _build_metadata_filter_fn(
+                    lambda row: self._metadata[row], MetadataFilters(filters=[filter_])
+                )
+                for row in np.flatnonzero(self._alive):
+                    mask[row] = match(row)
+            masks.append(mask)
+
+        if not masks:
+            return np.ones(self._n_rows, dtype=bool)
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Get the cosine similarities of the query to the rows (or all rows)"""
+        assert self._vectors is not None and self._norms is not None
+        scores = np.empty(self._n_rows if rows is None else len(rows), np.float32)
+        for start in range(0, len(scores), self._block_size):
+            end = min(start + self._block_size, len(scores))
+            if rows is None:
+                block, norms = self._vectors[start:end], self._norms[start:end]
+            else:
+                block = self._vectors[rows[start:end]]
+                norms = self._norms[rows[start:end]]
+            denominator = norms * np.linalg.norm(query)
+            denominator[denominator == 0] = 1.0
+            scores[start:end] = (block @ query) / denominator
+        return scores
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Return the top k most similar vector embeddings
+
+        Args:
+            embedding: List of embeddings
+            top_k: Number of most similar embeddings to return
+            ids: List of ids of the embeddings to be queried
+            kwargs: `scope` (alias of `ids`), `filters` (llama-index
+                MetadataFilters), `mode` (default or MMR) and `mmr_threshold`
+
+        Returns:
+            the matched embeddings, the similarity scores, and the ids
+        """
+        mode = kwargs.get("mode", VectorStoreQueryMode.DEFAULT)
+        if mode not in (VectorStoreQueryMode.DEFAULT, VectorStoreQueryMode.MMR):
+            raise ValueError(f"Invalid query mode: {mode}")
+        if ids is None:
+            ids = kwargs.get("scope")
+
+        with self._lock:
+            self._refresh()
+            if self._vectors is None or top_k <= 0:
+                return [], [], []
+
+            mask = self._alive.copy()
+            if ids is not None:
+                id_mask = np.zeros(self._n_rows, dtype=bool)
+                id_mask[[self._row_of[id_] for id_ in ids if id_ in self._row_of]] = 1
+                mask &= id_mask
+            if kwargs.get("filters") is not None:
+                mask &= self._filter_mask(kwargs["filters"])
+
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return [], [], []
+
+            query = np.asarray(embedding, dtype=np.float32)
+            if len(rows) < self._n_rows // 4:
+                scores = self._scores(query, rows)
+            else:
+                scores = self._scores(query, None)[rows]
+
+            n_candidates = top_k
+            if mode == VectorStoreQueryMode.MMR:
+                n_candidates = top_k * 4
+            if n_candidates < len(rows):
+                top = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            top_rows = rows[top]
+            top_ids = [self._ids[row] for row in top_rows]
+            top_vectors = np.asarray(self._vectors[top_rows]).tolist()
+            top_scores = scores[top].tolist()
+
+        if mode == VectorStoreQueryMode.MMR:
+            from llama_index.core.indices.query.embedding_utils import (
+                get_top_k_mmr_embeddings,
+            )
+
+            top_scores, mmr_ids = get_top_k_mmr_embeddings(
+                list(embedding),
+                top_vectors,
+                similarity_top_k=top_k,
+                embedding_ids=top_ids,
+                mmr_threshold=kwargs.get("mmr_threshold"),
+            )
+            vector_of = dict(zip(top_ids, top_vectors))
+            top_ids = list(mmr_ids)
+            top_vectors = [vector_of[id_] for id_ in top_ids]
+
+        return top_vectors, top_scores, top_ids
+
+    def get(self, id_: str) -> list[float]:
+        """Get the embedding of an id"""
+        with self._lock:
+            if id_ not in self._row_of:
+                self._refresh()
+            assert self._vectors is not None
+            return self._vectors[self._row_of[id_]].tolist()
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._row_of)
 
     def drop(self):
-        self._data = SimpleVectorStoreData()
-        self._save_path.unlink(missing_ok=True)
+        with self._lock:
+            self._vectors = self._norms = None
+            for generation in {0, self._generation}:
+                for data_path in self._data_paths(generation):
+                    data_path.unlink(missing_ok=True)
+            self._log_path.unlink(missing_ok=True)
+            self._legacy_path.unlink(missing_ok=True)
+            self._reset()
 
     def __persist_flow__(self):
-        d = self._data.to_dict()
-        d["__type__"] = f"{self._data.__module__}.{self._data.__class__.__qualname__}"
         return {
-            "data": d,
             "collection_name": self._collection_name,
             "path": str(self._path),
-            # "fs": self._fs,
+            "compact_ratio": self._compact_ratio,
+            "block_size": self._block_size,
         }
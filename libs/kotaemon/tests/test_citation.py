@@ -0,0 +1,42 @@
+from kotaemon.indices.qa.citation import FactWithEvidence
+from kotaemon.indices.qa.span_search import align, find_span
+
+CONTEXT = (
+    "The quarterly revenue (excluding taxes) grew by 12% [unaudited], "
+    "while the operating costs* stayed flat. The board approved a new "
+    "dividend policy for the next fiscal year."
+)
+
+
+def test_find_span_exact():
+    quote = "revenue (excluding taxes) grew by 12% [unaudited]"
+    start = CONTEXT.index(quote)
+    assert find_span(quote, CONTEXT) == (start, start + len(quote))
+
+
+def test_find_span_fuzzy():
+    quote = "the operatng costs* stayd flat"
+    start, end = find_span(quote, CONTEXT)
+    assert CONTEXT[start:end] == "the operating costs* stayed flat"
+
+
+def test_find_span_not_found():
+    assert find_span("", CONTEXT) is None
+    assert find_span("zzzzzz", CONTEXT) is None
+    assert find_span("approved a new policy", CONTEXT, max_errors=1) is None
+
+
+def test_align():
+    assert align("kitten", "a sitting cat") == (2, 2, 8)
+
+
+def test_fact_with_evidence_get_spans():
+    fact = FactWithEvidence(
+        fact="Revenue grew.",
+        substring_quote=["grew by 12% [unaudited]", "the bord approved"],
+    )
+    spans = list(fact.get_spans(CONTEXT))
+    assert [CONTEXT[start:end] for start, end in spans] == [
+        "grew by 12% [unaudited]",
+        "The board approved",
+    ]
@@ -8,6 +8,7 @@ from kotaemon.base import Document
 from kotaemon.storages import (
     ElasticsearchDocumentStore,
     InMemoryDocumentStore,
+    LanceDBDocumentStore,
     SimpleFileDocumentStore,
 )
 
@@ -313,13 +314,83 @@ def test_simplefile_document_store_base_interfaces(tmp_path):
     assert len(store.get_all()) == 17, "Document store should have 17 documents"
 
     # Test save
-    assert (tmp_path / "default.json").exists(), "File should exist"
+    assert (tmp_path / "default.000000.seg").exists(), "File should exist"
 
     # Test load
     store2 = SimpleFileDocumentStore(path=tmp_path)
     assert len(store2.get_all()) == 17, "Laded document store should have 17 documents"
 
-    os.remove(tmp_path / "default.json")
+    store2.drop()
+    assert not (tmp_path / "default.000000.seg").exists(), "File should be removed"
+
+
+def test_simplefile_document_store_log(tmp_path):
+    store = SimpleFileDocumentStore(path=tmp_path, max_segment_size=2048)
+    docs = [Document(text=f"Sample text {idx}" * 10) for idx in range(20)]
+    store.add(docs)
+    assert len(list(tmp_path.glob("default.*.seg"))) > 1, "Should roll over segments"
+
+    # Test changes made by another instance are visible
+    store2 = SimpleFileDocumentStore(path=tmp_path, max_segment_size=2048)
+    store2.delete([doc.doc_id for doc in docs[:5]])
+    store2.add(Document(text="Updated"), ids=docs[5].doc_id, exist_ok=True)
+    assert store.count() == 15
+    assert store.get(docs[5].doc_id)[0].text == "Updated"
+    with pytest.raises(KeyError):
+        store.get(docs[0].doc_id)
+
+    # Test compaction keeps the live documents only
+    store.compact()
+    size = sum(file.stat().st_size for file in tmp_path.glob("default.*.seg"))
+    assert size == store._live_bytes
+    store3 = SimpleFileDocumentStore(path=tmp_path)
+    assert store3.count() == 15
+    assert [doc.text for doc in store3.get([docs[6].doc_id, docs[5].doc_id])] == [
+        docs[6].text,
+        "Updated",
+    ]
+    assert store2.get(docs[19].doc_id)[0].text == docs[19].text
+
+
+def test_simplefile_document_store_legacy_json(tmp_path):
+    legacy = InMemoryDocumentStore()
+    legacy.add([Document(text=f"Sample text {idx}") for idx in range(3)])
+    legacy.save(tmp_path / "default.json")
+
+    store = SimpleFileDocumentStore(path=tmp_path)
+    assert store.count() == 3
+    assert not (tmp_path / "default.json").exists(), "Legacy file should be migrated"
+
+
+def test_lancedb_document_store(tmp_path):
+    store = LanceDBDocumentStore(path=str(tmp_path), max_filter_ids=2)
+    docs = [Document(text=f"apple {idx}") for idx in range(5)]
+    store.add(docs)
+    store.add(Document(text="banana"), ids="it's")
+    assert store._pending_rows == 1, "The full-text index should not be rebuilt"
+
+    # Test the rows written after the index build are searchable
+    assert [doc.doc_id for doc in store.query("banana")] == ["it's"]
+    assert [doc.doc_id for doc in store.get(["it's", docs[3].doc_id])] == [
+        "it's",
+        docs[3].doc_id,
+    ]
+
+    # Test scope filtering, with a scope larger than `max_filter_ids`
+    scope = [doc.doc_id for doc in docs[1:4]]
+    results = store.query("apple", top_k=5, doc_ids=scope)
+    assert sorted(doc.doc_id for doc in results) == sorted(scope)
+    results = store.query("apple", top_k=5, doc_ids=scope[:1])
+    assert [doc.doc_id for doc in results] == scope[:1]
+
+    store.refresh_fts_index()
+    assert store._pending_rows == 0
+    store.delete(["it's", docs[0].doc_id])
+    assert store.query("banana") == []
+    assert len(store.get([doc.doc_id for doc in docs])) == 4
+
+    store.drop()
+    assert store.query("apple") == []
 
 
 @patch(
@@ -1,12 +1,16 @@
+import asyncio
 import json
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import pytest
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 
 from kotaemon.base import Document
 from kotaemon.embeddings import (
     AzureOpenAIEmbeddings,
+    CachedEmbeddings,
+    EndpointEmbeddings,
     FastEmbedEmbeddings,
     LCCohereEmbeddings,
     LCHuggingFaceEmbeddings,
@@ -109,6 +113,85 @@ def test_openai_embeddings_batch_raw(openai_embedding_call):
     openai_embedding_call.assert_called()
 
 
+def _fake_openai_embedding(*args, input, **kwargs):
+    """Embed each input as [len(input)], returning the items in reverse order"""
+    return CreateEmbeddingResponse.model_validate(
+        {
+            "object": "list",
+            "model": "ada",
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+            "data": [
+                {"object": "embedding", "index": idx, "embedding": [float(len(text))]}
+                for idx, text in reversed(list(enumerate(input)))
+            ],
+        }
+    )
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=_fake_openai_embedding,
+)
+def test_openai_embeddings_concurrent_batches(openai_embedding_call):
+    model = OpenAIEmbeddings(
+        api_key="some-key",
+        model="text-embedding-ada-002",
+        max_batch_size=2,
+        max_batch_tokens=10,
+    )
+    texts = ["a", "bb", "ccc", "dddddddd", "eeeee"]
+    output = model(texts)
+
+    # [a, bb], [ccc], [dddddddd], [eeeee]: split by the item and token limits
+    assert openai_embedding_call.call_count == 4
+    assert [doc.embedding for doc in output] == [[float(len(t))] for t in texts]
+    assert [doc.text for doc in output] == texts
+
+
+def _fake_endpoint_post(url, json, **kwargs):
+    response = MagicMock()
+    response.json.return_value = _fake_openai_embedding(input=json["input"]).dict()
+    return response
+
+
+@patch("requests.Session.post", side_effect=_fake_endpoint_post)
+def test_endpoint_embeddings_batch(endpoint_call):
+    model = EndpointEmbeddings(
+        endpoint_url="http://localhost:8000/v1/embeddings", batch_size=2
+    )
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    output = model(texts)
+
+    assert endpoint_call.call_count == 3
+    assert [doc.embedding for doc in output] == [[float(len(t))] for t in texts]
+    assert [doc.text for doc in output] == texts
+
+
+async def _fake_endpoint_apost(url, json, **kwargs):
+    return _fake_endpoint_post(url, json, **kwargs)
+
+
+@patch("httpx.AsyncClient.post", side_effect=_fake_endpoint_apost)
+def test_endpoint_embeddings_async_client_reused(endpoint_call):
+    model = EndpointEmbeddings(
+        endpoint_url="http://localhost:8000/v1/embeddings", batch_size=2
+    )
+
+    async def embed_twice():
+        first = await model.ainvoke(["a", "bb", "ccc"])
+        client = model._async_client
+        second = await model.ainvoke(["dddd"])
+        assert model._async_client is client
+        await model.aclose()
+        assert client.is_closed
+        return first + second
+
+    output = asyncio.run(embed_twice())
+
+    assert endpoint_call.call_count == 3
+    assert [doc.embedding for doc in output] == [[1.0], [2.0], [3.0], [4.0]]
+
+
 @skip_when_sentence_bert_not_installed
 @patch(
     "sentence_transformers.SentenceTransformer",
@@ -155,3 +238,51 @@ def test_fastembed_embeddings():
     model = FastEmbedEmbeddings()
     output = model("Hello World")
     assert_embedding_result(output)
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=lambda *args, **kwargs: openai_embedding,
+)
+def test_cached_embeddings(openai_embedding_call, tmp_path):
+    model = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(
+            api_key="some-key",
+            model="text-embedding-ada-002",
+        ),
+        cache_path=str(tmp_path / "cache.db"),
+    )
+    output = model("Hello world")
+    assert_embedding_result(output)
+    assert openai_embedding_call.call_count == 1
+
+    # same normalized text, served from cache
+    cached_output = model(" Hello   world ")
+    assert_embedding_result(cached_output)
+    assert openai_embedding_call.call_count == 1
+    assert cached_output[0].embedding == pytest.approx(output[0].embedding)
+    assert model.stats()["hits"] == 1
+    assert model.stats()["misses"] == 1
+
+    # a different model does not share the cache entries
+    other_model = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(
+            api_key="some-key",
+            model="text-embedding-3-small",
+        ),
+        cache_path=str(tmp_path / "cache.db"),
+    )
+    other_model("Hello world")
+    assert openai_embedding_call.call_count == 2
+
+
+def test_cached_embeddings_lru_eviction(tmp_path):
+    from kotaemon.embeddings.cache import SQLiteEmbeddingStore
+
+    store = SQLiteEmbeddingStore(tmp_path / "cache.db", max_size=2)
+    store.set_many({"a": [0.1], "b": [0.2]})
+    store.get_many(["a"])
+    store.set_many({"c": [0.3]})
+
+    assert len(store) == 2
+    assert set(store.get_many(["a", "b", "c"])) == {"a", "c"}
@@ -3,12 +3,17 @@ from pathlib import Path
 from typing import cast
 from unittest.mock import patch
 
+import pytest
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 
-from kotaemon.base import Document
+from kotaemon.base import Document, RetrievedDocument
 from kotaemon.embeddings import AzureOpenAIEmbeddings
 from kotaemon.indices import VectorIndexing, VectorRetrieval
-from kotaemon.storages import ChromaVectorStore, InMemoryDocumentStore
+from kotaemon.storages import (
+    ChromaVectorStore,
+    InMemoryDocumentStore,
+    InMemoryVectorStore,
+)
 
 with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
     openai_embedding = CreateEmbeddingResponse.model_validate(json.load(f))
@@ -65,3 +70,34 @@ def test_retrieving(tmp_path):
 
     assert len(output) == 1, "Expect 1 results"
     assert output == output1, "Expect identical results"
+
+
+def test_hybrid_fusion():
+    embedding = AzureOpenAIEmbeddings(
+        azure_deployment="text-embedding-ada-002",
+        azure_endpoint="https://test.openai.azure.com/",
+        api_key="some-key",
+        api_version="version",
+    )
+    retrieval_pipeline = VectorRetrieval(
+        vector_store=InMemoryVectorStore(),
+        doc_store=InMemoryDocumentStore(),
+        embedding=embedding,
+    )
+    vs_docs = [
+        RetrievedDocument(id_=id_, text=id_, score=score)
+        for id_, score in [("a", 0.9), ("b", 0.8), ("c", 0.7)]
+    ]
+    ds_docs = [
+        RetrievedDocument(id_=id_, text=id_, score=-1.0) for id_ in ["c", "d", "c"]
+    ]
+
+    output = retrieval_pipeline._fuse(vs_docs, ds_docs)
+    assert [doc.doc_id for doc in output] == ["c", "a", "b", "d"]
+    assert output[0].score == 0.7, "Expect the vector score to be kept"
+
+    retrieval_pipeline.hybrid_fusion = "weighted"
+    retrieval_pipeline.vector_weight = 0.8
+    output = retrieval_pipeline._fuse(vs_docs, ds_docs)
+    assert [doc.doc_id for doc in output] == ["a", "b", "c", "d"]
+    assert output[0].retrieval_metadata["fusion_score"] == pytest.approx(0.8)
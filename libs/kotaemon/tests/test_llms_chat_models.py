@@ -73,6 +73,34 @@ def test_azureopenai_model(openai_completion):
     openai_completion.assert_called()
 
 
+def test_openai_client_registry():
+    from kotaemon.base.clients import OpenAIClientRegistry
+
+    registry = OpenAIClientRegistry()
+    params = {
+        "api_key": "dummy",
+        "api_version": "2024-05-01-preview",
+        "azure_deployment": "gpt-4o",
+        "azure_endpoint": "https://test.openai.azure.com/",
+    }
+    with patch("kotaemon.llms.chats.openai.openai_clients", registry):
+        model_1 = AzureChatOpenAI(**params)
+        model_2 = AzureChatOpenAI(**params)
+        model_3 = AzureChatOpenAI(**{**params, "api_key": "other"})
+
+        client = model_1.prepare_client(async_version=False)
+        assert model_2.prepare_client(async_version=False) is client
+        assert model_3.prepare_client(async_version=False) is not client
+
+    stats = registry.stats()
+    assert len(stats) == 2
+    assert stats[0]["client"] == "AzureOpenAI(https://test.openai.azure.com/)"
+    assert stats[0]["requests"] == 0
+
+    registry.clear()
+    assert registry.stats() == []
+
+
 @skip_llama_cpp_not_installed
 def test_llamacpp_chat():
     from llama_cpp import Llama
@@ -11,8 +11,11 @@ from kotaemon.loaders import (
     DocxReader,
     HtmlReader,
     MhtmlReader,
+    PDFThumbnailReader,
+    TxtReader,
     UnstructuredReader,
 )
+from kotaemon.loaders.pdf_loader import resolve_thumbnail
 
 from .conftest import skip_when_unstructured_not_installed
 
@@ -54,6 +57,59 @@ def test_pdf_reader():
     assert len(nodes) > 0
 
 
+def test_pdf_thumbnail_reader(tmp_path):
+    input_path = Path(__file__).parent / "resources" / "multimodal.pdf"
+    inline_docs = PDFThumbnailReader(max_workers=1).load_data(input_path)
+    thumbnails = [doc for doc in inline_docs if doc.metadata.get("type") == "thumbnail"]
+    assert thumbnails
+    assert thumbnails[0].metadata["image_origin"].startswith("data:image/png")
+
+    # test the thumbnails stored as files, rendered in worker processes
+    reader = PDFThumbnailReader(thumbnail_dir=str(tmp_path), max_workers=2)
+    with patch("kotaemon.loaders.pdf_loader.PAGES_PER_WORKER", 1):
+        docs = [
+            doc
+            for doc in reader.load_data(input_path)
+            if doc.metadata.get("type") == "thumbnail"
+        ]
+    assert [doc.metadata["page_label"] for doc in docs] == [
+        doc.metadata["page_label"] for doc in thumbnails
+    ]
+    assert "image_origin" not in docs[0].metadata
+    assert Path(docs[0].metadata["thumbnail_path"]).parent == tmp_path
+    assert [resolve_thumbnail(doc.metadata)["image_origin"] for doc in docs] == [
+        doc.metadata["image_origin"] for doc in thumbnails
+    ]
+
+
+def test_pdf_thumbnail_reader_lazy():
+    input_path = Path(__file__).parent / "resources" / "multimodal.pdf"
+    reader = PDFThumbnailReader(max_workers=1)
+    with patch("kotaemon.loaders.pdf_loader.PAGES_PER_WORKER", 1):
+        docs = list(reader.lazy_load_data(input_path))
+
+    # each page text is followed by its thumbnail
+    assert [doc.metadata.get("type", "text") for doc in docs[:2]] == [
+        "text",
+        "thumbnail",
+    ]
+    assert docs[0].metadata["page_label"] == docs[1].metadata["page_label"]
+    assert sorted(doc.text for doc in docs) == sorted(
+        doc.text for doc in reader.load_data(input_path)
+    )
+
+
+def test_txt_reader_lazy(tmp_path):
+    text = "".join(f"Paragraph {idx}\nline\n\n" for idx in range(100))
+    input_path = tmp_path / "test.txt"
+    input_path.write_text(text)
+
+    docs = list(TxtReader().lazy_load_data(input_path, block_size=100))
+    assert len(docs) > 1
+    assert all(doc.text.endswith("\n\n") for doc in docs)
+    assert "".join(doc.text for doc in docs) == text
+
+
 @skip_when_unstructured_not_installed
 def test_unstructured_pdf_reader():
     reader = UnstructuredReader()
@@ -4,11 +4,12 @@ import pytest
 from openai.types.chat.chat_completion import ChatCompletion
 
 from kotaemon.base import Document
-from kotaemon.indices.rankings import LLMReranking
+from kotaemon.indices.rankings import LLMReranking, LLMTrulensScoring
 from kotaemon.llms import AzureChatOpenAI
 
-_openai_chat_completion_responses = [
-    ChatCompletion.parse_obj(
+
+def _chat_completion(text: str) -> ChatCompletion:
+    return ChatCompletion.parse_obj(
         {
             "id": "chatcmpl-7qyuw6Q1CFCpcKsMdFkmUPUa7JP2x",
             "object": "chat.completion",
@@ -31,6 +32,10 @@ _openai_chat_completion_responses = [
             "usage": {"completion_tokens": 9, "prompt_tokens": 10, "total_tokens": 19},
         }
     )
+
+
+_openai_chat_completion_responses = [
+    _chat_completion(text)
     for text in [
         "YES",
         "NO",
@@ -61,3 +66,43 @@ def test_reranking(openai_completion, llm):
     rerank_docs = reranker(documents, query=query)
 
     assert len(rerank_docs) == 2
+
+
+@patch("openai.resources.chat.completions.Completions.create")
+def test_llm_trulens_scoring_batch_cache(openai_completion, llm, tmp_path):
+    openai_completion.side_effect = [_chat_completion('{"1": 2, "2": 9, "3": 5}')]
+    scorer = LLMTrulensScoring(
+        llm=llm, batch_size=3, cache_path=str(tmp_path / "scores.db")
+    )
+
+    documents = [Document(text=f"passage {idx}") for idx in range(3)]
+    scored_docs = scorer(documents, query="test query")
+    assert [doc.text for doc in scored_docs] == ["passage 1", "passage 2", "passage 0"]
+    assert [doc.metadata["llm_trulens_score"] for doc in scored_docs] == [
+        0.9,
+        0.5,
+        0.2,
+    ]
+    assert openai_completion.call_count == 1
+
+    # the scores are served from the cache
+    documents = [Document(text=f"passage {idx}") for idx in range(3)]
+    scored_docs = scorer(documents, query="test query")
+    assert [doc.metadata["llm_trulens_score"] for doc in scored_docs] == [
+        0.9,
+        0.5,
+        0.2,
+    ]
+    assert openai_completion.call_count == 1
+
+
+@patch("openai.resources.chat.completions.Completions.create")
+def test_llm_reranking_early_stop(openai_completion, llm):
+    openai_completion.side_effect = [_chat_completion("YES")]
+    documents = [Document(text=f"early stop {idx}") for idx in range(3)]
+
+    reranker = LLMReranking(llm=llm, concurrent=False, early_stop=1, use_cache=False)
+    rerank_docs = reranker(documents, query="test query")
+
+    assert [doc.text for doc in rerank_docs] == ["early stop 0"]
+    assert openai_completion.call_count == 1
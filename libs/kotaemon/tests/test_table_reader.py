@@ -1,4 +1,5 @@
 import json
+from copy import deepcopy
 from pathlib import Path
 
 import pytest
@@ -49,3 +50,46 @@ def test_excel_reader():
         input_file_excel,
     )
     assert len(documents) == 1
+
+
+def test_ocr_merge_spatial_index(fullocr_output):
+    from kotaemon.loaders.utils.box import (
+        BoxIndex,
+        get_rect_iou,
+        get_rect_iou_many,
+        locations_to_array,
+    )
+    from kotaemon.loaders.utils.pdf_ocr import parse_ocr_output
+
+    page = fullocr_output[0]
+    locations = [item["location"] for item in page["json"]["ocr"]]
+    boxes = locations_to_array(locations)
+    index = BoxIndex(boxes)
+    for location, box in zip(locations[:20], boxes[:20]):
+        ious = [get_rect_iou(location, other, iou_type=1) for other in locations]
+        candidates = index.query(box)
+        assert set(candidates) >= {i for i, iou in enumerate(ious) if iou > 0}
+        assert get_rect_iou_many(box, boxes[candidates], iou_type=1) == pytest.approx(
+            [ious[i] for i in candidates]
+        )
+
+    # PDF texts overlapping half of the OCR texts
+    pdf_page_items = {
+        page_id: [
+            {
+                "text": item["text"],
+                "box": [*item["location"][0], *item["location"][2]],
+                "location": item["location"],
+                "page_shape": page["image_shape"],
+            }
+            for item in page["json"]["ocr"][::2]
+        ]
+        for page_id in range(2)
+    }
+    tables, texts = parse_ocr_output(
+        [deepcopy(page), deepcopy(page)], deepcopy(pdf_page_items), max_workers=2
+    )
+    assert len(tables) == 4 and [page_id for page_id, _ in texts] == [0, 1]
+    assert (tables, texts) == parse_ocr_output(
+        [deepcopy(page), deepcopy(page)], deepcopy(pdf_page_items), max_workers=1
+    )
@@ -34,7 +34,7 @@ def test_wikipedia_tool():
     "openai.resources.embeddings.Embeddings.create",
     side_effect=lambda *args, **kwargs: openai_embedding,
 )
-def test_pipeline_tool(tmp_path):
+def test_pipeline_tool(patch, tmp_path):
     db = ChromaVectorStore(path=str(tmp_path))
     doc_store = InMemoryDocumentStore()
     embedding = AzureOpenAIEmbeddings(
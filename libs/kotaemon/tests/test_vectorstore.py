@@ -1,11 +1,12 @@
 import json
-import os
 
+import numpy as np
 import pytest
 
 from kotaemon.base import DocumentWithEmbedding
 from kotaemon.storages import (
     ChromaVectorStore,
+    HNSWVectorStore,
     InMemoryVectorStore,
     MilvusVectorStore,
     QdrantVectorStore,
@@ -141,22 +142,112 @@ class TestSimpleFileVectorStore:
         db = SimpleFileVectorStore(path=tmp_path, collection_name=collection_name)
         db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
         db.delete(["3"])
-        with open(tmp_path / collection_name) as f:
-            data = json.load(f)
-        assert (
-            "1" and "2" in data["text_id_to_ref_doc_id"]
-        ), "save function does not save data completely"
-        assert (
-            "3" not in data["text_id_to_ref_doc_id"]
-        ), "delete function does not delete data completely"
+        assert db.count() == 2, "delete function does not delete data completely"
         db2 = SimpleFileVectorStore(path=tmp_path, collection_name=collection_name)
-        assert db2.get("2") == [
-            0.4,
-            0.5,
-            0.6,
-        ], "load function does not load data completely"
+        assert db2.count() == 2, "save function does not save data completely"
+        assert db2.get("2") == pytest.approx(
+            [0.4, 0.5, 0.6]
+        ), "load function does not load data completely"
 
-        os.remove(tmp_path / collection_name)
+        db2.drop()
+        assert not list(tmp_path.iterdir()), "drop function does not remove files"
+
+    def test_query(self, tmp_path):
+        from llama_index.core.vector_stores.types import (
+            FilterOperator,
+            MetadataFilter,
+            MetadataFilters,
+        )
+
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(100, 8)).tolist()
+        metadatas = [{"file_id": str(idx % 4)} for idx in range(100)]
+        ids = [str(idx) for idx in range(100)]
+        db = SimpleFileVectorStore(path=tmp_path)
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        _, scores, out_ids = db.query(embedding=embeddings[7], top_k=3)
+        assert out_ids[0] == "7" and scores[0] == pytest.approx(1.0)
+        assert scores == sorted(scores, reverse=True)
+
+        _, _, out_ids = db.query(embedding=embeddings[7], top_k=3, scope=["1", "2"])
+        assert sorted(out_ids) == ["1", "2"]
+
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="file_id", value=["1"], operator=FilterOperator.IN)
+            ]
+        )
+        _, _, out_ids = db.query(embedding=embeddings[7], top_k=50, filters=filters)
+        assert len(out_ids) == 25 and all(int(id_) % 4 == 1 for id_ in out_ids)
+
+        # deleting most of the rows compacts the files, replaced rows are searchable
+        db.delete(ids[:60])
+        db.add(embeddings=[embeddings[0]], ids=["99"])
+        assert db.count() == 40
+        db2 = SimpleFileVectorStore(path=tmp_path)
+        _, _, out_ids = db2.query(embedding=embeddings[0], top_k=1)
+        assert out_ids == ["99"]
+        assert db2.query(embedding=embeddings[7], top_k=3, ids=["7"]) == ([], [], [])
+
+    def test_migrate_legacy(self, tmp_path):
+        data = {
+            "embedding_dict": {"1": [0.1, 0.2], "2": [0.3, 0.4]},
+            "text_id_to_ref_doc_id": {"1": "1", "2": "2"},
+            "metadata_dict": {"1": {"a": 1}, "2": {"a": 2}},
+        }
+        with open(tmp_path / "default", "w") as f:
+            json.dump(data, f)
+
+        db = SimpleFileVectorStore(path=tmp_path)
+        assert db.count() == 2
+        assert db.get("2") == pytest.approx([0.3, 0.4])
+
+
+class TestHNSWVectorStore:
+    def test_add_query_delete(self, tmp_path):
+        pytest.importorskip("hnswlib")
+        from llama_index.core.vector_stores.types import (
+            FilterOperator,
+            MetadataFilter,
+            MetadataFilters,
+        )
+
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(300, 8)).tolist()
+        metadatas = [{"file_id": str(idx % 3)} for idx in range(300)]
+        ids = [str(idx) for idx in range(300)]
+        db = HNSWVectorStore(path=tmp_path, exact_search_threshold=10)
+        db.add(embeddings=embeddings[:150], metadatas=metadatas[:150], ids=ids[:150])
+        db.add(embeddings=embeddings[150:], metadatas=metadatas[150:], ids=ids[150:])
+        assert db.count() == 300
+
+        _, scores, out_ids = db.query(embedding=embeddings[7], top_k=3, ef=100)
+        assert out_ids[0] == "7" and scores[0] == pytest.approx(1.0, abs=1e-5)
+
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="file_id", value=["2"], operator=FilterOperator.IN)
+            ]
+        )
+        _, _, out_ids = db.query(embedding=embeddings[7], top_k=5, filters=filters)
+        assert len(out_ids) == 5 and all(int(id_) % 3 == 2 for id_ in out_ids)
+
+        _, _, out_ids = db.query(embedding=embeddings[7], top_k=5, scope=["1", "2"])
+        assert sorted(out_ids) == ["1", "2"]
+
+        db.delete(["7"])
+        _, _, out_ids = db.query(embedding=embeddings[7], top_k=3)
+        assert "7" not in out_ids
+
+        # reload from the snapshot and the log
+        db2 = HNSWVectorStore(path=tmp_path)
+        assert db2.count() == 299
+        _, _, out_ids = db2.query(embedding=embeddings[8], top_k=1)
+        assert out_ids == ["8"]
+
+        db2.drop()
+        assert not list(tmp_path.iterdir()), "drop function does not remove files"
 
 
 class TestMilvusVectorStore:
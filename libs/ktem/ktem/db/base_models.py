@@ -3,7 +3,7 @@ import uuid
 from typing import Optional
 from zoneinfo import ZoneInfo
 
-from sqlalchemy import JSON, Column
+from sqlalchemy import JSON, Column, Index
 from sqlmodel import Field, SQLModel
 from theflow.settings import settings as flowsettings
 
@@ -15,12 +15,20 @@ class BaseConversation(SQLModel):
         id: canonical id to identify the conversation
         name: human-friendly name of the conversation
         user: the user id
-        data_source: the data source of the conversation
+        data_source: the data source of the conversation: the selected files,
+            the chat state and the likes. The turns are stored in
+            `ConversationTurn`, `ConversationRetrieval` and `ConversationPlot`
         date_created: the date the conversation was created
         date_updated: the date the conversation was updated
     """
 
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        # listing of the conversations of a user, and of the public ones
+        Index(
+            "ix_conversation__user_public_created", "user", "is_public", "date_created"
+        ),
+        {"extend_existing": True},
+    )
 
     id: str = Field(
         default_factory=lambda: uuid.uuid4().hex, primary_key=True, index=True
@@ -34,7 +42,7 @@ class BaseConversation(SQLModel):
 
     is_public: bool = Field(default=False)
 
-    # contains messages + current files
+    # contains current files and chat state
     data_source: dict = Field(default={}, sa_column=Column(JSON))
 
     date_created: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
@@ -95,3 +103,97 @@ class BaseIssueReport(SQLModel):
     chat: Optional[dict] = Field(default=None, sa_column=Column(JSON))
     settings: Optional[dict] = Field(default=None, sa_column=Column(JSON))
     user: Optional[int] = Field(default=None)
+
+
+class BaseIndexingJob(SQLModel):
+    """Background job embedding the chunks of a file into the vector store
+
+    Attributes:
+        id: canonical id to identify the job
+        index_id: the id of the file index
+        file_id: the id of the file in the index
+        file_name: the name of the file
+        user: the user id
+        chunk_ids: the ids of the chunks to embed, already in the docstore
+        n_done: the number of chunks processed, the checkpoint to resume from
+        status: "pending", "running", "done", "failed" or "cancelled"
+        attempts: the number of failed attempts
+        error: the error of the last failed attempt
+        not_before: the job is not run before this date (retry backoff)
+        date_created: the date the job was created
+        date_updated: the date the job was updated
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    index_id: int = Field(index=True)
+    file_id: str = Field(index=True)
+    file_name: str = Field(default="")
+    user: Optional[int] = Field(default=None)
+    chunk_ids: list = Field(default=[], sa_column=Column(JSON))
+    n_done: int = Field(default=0)
+    status: str = Field(default="pending", index=True)
+    attempts: int = Field(default=0)
+    error: Optional[str] = Field(default=None)
+    not_before: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    date_created: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    date_updated: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+
+class BaseConversationTurn(SQLModel):
+    """Store a turn of a conversation: the user message and the bot answer
+
+    Attributes:
+        id: canonical id to identify the turn
+        conversation_id: the id of the conversation
+        position: the position of the turn in the conversation, from 0
+        user_message: the message of the user
+        bot_message: the answer of the bot
+        date_created: the date the turn was created
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: str = Field(index=True)
+    position: int
+    user_message: Optional[str] = Field(default=None)
+    bot_message: Optional[str] = Field(default=None)
+    date_created: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+
+class BaseConversationRetrieval(SQLModel):
+    """Store the retrieval panel (evidence HTML) of a turn of a conversation
+
+    Attributes:
+        id: canonical id to identify the retrieval panel
+        conversation_id: the id of the conversation
+        position: the position of the turn in the conversation, from 0
+        content: the HTML content of the panel
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: str = Field(index=True)
+    position: int
+    content: str = Field(default="")
+
+
+class BaseConversationPlot(SQLModel):
+    """Store the plot of a turn of a conversation
+
+    Attributes:
+        id: canonical id to identify the plot
+        conversation_id: the id of the conversation
+        position: the position of the turn in the conversation, from 0
+        data: the plotly figure, in json format
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: str = Field(index=True)
+    position: int
+    data: Optional[dict] = Field(default=None, sa_column=Column(JSON))
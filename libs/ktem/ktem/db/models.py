@@ -28,11 +28,47 @@ _base_issue_report = (
     else base_models.BaseIssueReport
 )
 
+_base_indexing_job = (
+    import_dotted_string(settings.KH_TABLE_INDEXING_JOB, safe=False)
+    if hasattr(settings, "KH_TABLE_INDEXING_JOB")
+    else base_models.BaseIndexingJob
+)
+
+_base_conv_turn = (
+    import_dotted_string(settings.KH_TABLE_CONV_TURN, safe=False)
+    if hasattr(settings, "KH_TABLE_CONV_TURN")
+    else base_models.BaseConversationTurn
+)
+
+_base_conv_retrieval = (
+    import_dotted_string(settings.KH_TABLE_CONV_RETRIEVAL, safe=False)
+    if hasattr(settings, "KH_TABLE_CONV_RETRIEVAL")
+    else base_models.BaseConversationRetrieval
+)
+
+_base_conv_plot = (
+    import_dotted_string(settings.KH_TABLE_CONV_PLOT, safe=False)
+    if hasattr(settings, "KH_TABLE_CONV_PLOT")
+    else base_models.BaseConversationPlot
+)
+
 
 class Conversation(_base_conv, table=True):  # type: ignore
     """Conversation record"""
 
 
+class ConversationTurn(_base_conv_turn, table=True):  # type: ignore
+    """Turn of a conversation"""
+
+
+class ConversationRetrieval(_base_conv_retrieval, table=True):  # type: ignore
+    """Retrieval panel of a conversation turn"""
+
+
+class ConversationPlot(_base_conv_plot, table=True):  # type: ignore
+    """Plot of a conversation turn"""
+
+
 class User(_base_user, table=True):  # type: ignore
     """User table"""
 
@@ -45,5 +81,12 @@ class IssueReport(_base_issue_report, table=True):  # type: ignore
     """Record of issues"""
 
 
+class IndexingJob(_base_indexing_job, table=True):  # type: ignore
+    """Record of background indexing jobs"""
+
+
 if not getattr(settings, "KH_ENABLE_ALEMBIC", False):
     SQLModel.metadata.create_all(engine)
+    # tables created before the indexes were declared
+    for index in Conversation.__table__.indexes:  # type: ignore
+        index.create(engine, checkfirst=True)
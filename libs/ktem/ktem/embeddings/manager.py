@@ -6,6 +6,7 @@ from theflow.settings import settings as flowsettings
 from theflow.utils.modules import deserialize
 
 from kotaemon.embeddings.base import BaseEmbeddings
+from kotaemon.embeddings.cache import CachedEmbeddings
 
 from .db import EmbeddingTable, engine
 
@@ -42,7 +43,7 @@ class EmbeddingManager:
             items = sess.execute(stmt)
 
             for (item,) in items:
-                self._models[item.name] = deserialize(item.spec, safe=False)
+                self._models[item.name] = self.build(item.spec)
                 self._info[item.name] = {
                     "name": item.name,
                     "spec": item.spec,
@@ -52,6 +53,22 @@ class EmbeddingManager:
                     self._default = item.name
                     self._models["default"] = self._models[item.name]
 
+    def build(self, spec: dict) -> BaseEmbeddings:
+        """Build the embedding model from its spec
+
+        Set `__cache__` in the spec to cache the vectors of this model on disk, with
+        either `true` or the params of `kotaemon.embeddings.CachedEmbeddings`
+        (e.g. `{"max_size": 100000}`).
+        """
+        spec = dict(spec)
+        cache = spec.pop("__cache__", False)
+        model = deserialize(spec, safe=False)
+        if cache:
+            model = CachedEmbeddings(
+                embedding=model, **(cache if isinstance(cache, dict) else {})
+            )
+        return model
+
     def load_vendors(self):
         from kotaemon.embeddings import (
             AzureOpenAIEmbeddings,
@@ -343,6 +343,8 @@ class EmbeddingManagement(BasePage):
             # Parse content & create dummy embedding
             spec = yaml.load(selected_spec, Loader=YAMLNoDateSafeLoader)
             info["spec"].update(spec)
+            # always test the connection with the real model, not the cache
+            info["spec"].pop("__cache__", None)
 
             emb = deserialize(info["spec"], safe=False)
 
@@ -55,6 +55,7 @@ class BaseFileIndexIndexing(BaseComponent):
     FSPath = Param(help="The file storage path")
     user_id = Param(help="The user id")
     private = Param(False, help="Whether this is private index")
+    index_id = Param(None, help="The id of the index")
 
     def run(
         self, file_paths: str | Path | list[str | Path], *args, **kwargs
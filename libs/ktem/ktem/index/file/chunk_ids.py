@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Optional
+
+from ktem.db.models import engine
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from theflow.settings import settings as flowsettings
+
+
+class ChunkIdCache:
+    """Cache the chunk ids of the files, as resolved from the Index tables, and the
+    ids of the files their chunks are shared from, as resolved from the Source tables
+
+    The entries are keyed by table, file id and relation type. They are
+    invalidated by the indexing pipelines when the chunks of a file change, and
+    expire after `ttl` seconds to pick up the changes made by other processes.
+
+    Args:
+        max_size: the maximum number of (file, relation type) entries kept
+        ttl: the number of seconds an entry is valid
+    """
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_size = max_size or getattr(
+            flowsettings, "KH_CHUNK_ID_CACHE_SIZE", 4096
+        )
+        self.ttl = ttl or getattr(flowsettings, "KH_CHUNK_ID_CACHE_TTL", 300)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, tuple[str, ...]]] = OrderedDict()
+        # bumped on invalidation, so a query racing with it is not cached
+        self._generation = 0
+
+    def _get(
+        self,
+        table: str,
+        relation_type: str,
+        file_ids: list[str],
+        resolve: Callable[[list[str]], dict[str, list[str]]],
+    ) -> list[str]:
+        """Get the cached ids of the files, resolving only the files not cached"""
+        now = time.monotonic()
+        found: dict[str, tuple[str, ...]] = {}
+        with self._lock:
+            generation = self._generation
+            for file_id in file_ids:
+                key = (table, file_id, relation_type)
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    found[file_id] = entry[1]
+
+        missing = [
+            file_id for file_id in dict.fromkeys(file_ids) if file_id not in found
+        ]
+        if missing:
+            resolved = resolve(missing)
+            with self._lock:
+                for file_id in missing:
+                    found[file_id] = tuple(resolved.get(file_id, []))
+                    if generation == self._generation:
+                        self._entries[(table, file_id, relation_type)] = (
+                            now,
+                            found[file_id],
+                        )
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return [
+            chunk_id
+            for file_id in dict.fromkeys(file_ids)
+            for chunk_id in found[file_id]
+        ]
+
+    def get(
+        self, Index, file_ids: list[str], relation_type: str = "document"
+    ) -> list[str]:
+        """Get the chunk ids of the files, querying only the files not cached
+
+        Args:
+            Index: the SQLAlchemy Index table
+            file_ids: the file ids
+            relation_type: the relation type of the chunks, e.g. "document"
+
+        Returns:
+            the chunk ids, in the order of the files
+        """
+
+        def resolve(missing: list[str]) -> dict[str, list[str]]:
+            resolved: dict[str, list[str]] = defaultdict(list)
+            with Session(engine) as session:
+                rows = session.execute(
+                    select(Index.source_id, Index.target_id).where(
+                        Index.relation_type == relation_type,
+                        Index.source_id.in_(missing),
+                    )
+                )
+                for source_id, target_id in rows:
+                    resolved[source_id].append(target_id)
+            return resolved
+
+        return self._get(Index.__tablename__, relation_type, file_ids, resolve)
+
+    def get_file_ids(self, Source, file_ids: list[str]) -> list[str]:
+        """Get the file ids, followed by the ids of the files their chunks are
+        shared from, as the shared chunks keep the `file_id` metadata of the file
+        they were indexed for
+
+        Args:
+            Source: the SQLAlchemy Source table
+            file_ids: the file ids
+
+        Returns:
+            the file ids and the ids of the files sharing their chunks
+        """
+
+        def resolve(missing: list[str]) -> dict[str, list[str]]:
+            with Session(engine) as session:
+                rows = session.execute(
+                    select(Source.id, Source.note).where(Source.id.in_(missing))
+                )
+                return {
+                    file_id: (note or {}).get("shared_file_ids", [])
+                    for file_id, note in rows
+                }
+
+        shared_ids = self._get(
+            Source.__tablename__, "shared_file_ids", file_ids, resolve
+        )
+        return list(file_ids) + shared_ids
+
+    def invalidate(self, table, file_ids: Optional[list[str]] = None):
+        """Drop the cached ids of the files, or of the whole table
+
+        Args:
+            table: the SQLAlchemy Index or Source table
+            file_ids: the file ids, None for all the files of the table
+        """
+        table = table.__tablename__
+        with self._lock:
+            self._generation += 1
+            if file_ids is None:
+                for key in [key for key in self._entries if key[0] == table]:
+                    del self._entries[key]
+                return
+
+            file_ids_ = set(file_ids)
+            for key in [
+                key for key in self._entries if key[0] == table and key[1] in file_ids_
+            ]:
+                del self._entries[key]
+
+
+chunk_id_cache = ChunkIdCache()
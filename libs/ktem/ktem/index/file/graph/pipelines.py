@@ -8,6 +8,7 @@ from uuid import uuid4
 import pandas as pd
 import tiktoken
 from ktem.db.models import engine
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from theflow.settings import settings
 
@@ -55,9 +56,11 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
     """GraphRAG specific indexing pipeline"""
 
     def route(self, file_path: Path) -> IndexPipeline:
-        """Simply disable the splitter (chunking) for this pipeline"""
+        """Simply disable the splitter (chunking) for this pipeline, and keep the
+        loaded documents for the graph index"""
         pipeline = super().route(file_path)
         pipeline.splitter = None
+        pipeline.keep_docs = True
 
         return pipeline
 
@@ -65,21 +68,15 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
         # create new graph_id and assign them to doc_id in self.Index
         # record in the index
         graph_id = str(uuid4())
-        with Session(engine) as session:
-            nodes = []
-            for file_id in file_ids:
-                if not file_id:
-                    continue
-                nodes.append(
-                    self.Index(
-                        source_id=file_id,
-                        target_id=graph_id,
-                        relation_type="graph",
-                    )
-                )
-
-            session.add_all(nodes)
-            session.commit()
+        rows = [
+            {"source_id": file_id, "target_id": graph_id, "relation_type": "graph"}
+            for file_id in file_ids
+            if file_id
+        ]
+        if rows:
+            with Session(engine) as session:
+                session.execute(insert(self.Index), rows)
+                session.commit()
 
         return graph_id
 
@@ -4,7 +4,10 @@ from typing import Any, Optional, Type
 from ktem.components import filestorage_path, get_docstore, get_vectorstore
 from ktem.db.engine import engine
 from ktem.index.base import BaseIndex
-from sqlalchemy import JSON, Column, DateTime, Integer, String, UniqueConstraint
+from ktem.reasoning.cache import answer_cache
+from sqlalchemy import JSON, Column, DateTime
+from sqlalchemy import Index as SQLIndex
+from sqlalchemy import Integer, String, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.sql import func
@@ -14,6 +17,8 @@ from theflow.utils.modules import import_dotted_string
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
+from .chunk_ids import chunk_id_cache
+from .jobs import indexing_jobs
 
 
 class FileIndex(BaseIndex):
@@ -112,6 +117,21 @@ class FileIndex(BaseIndex):
             (Base,),
             {
                 "__tablename__": f"index__{self.id}__index",
+                "__table_args__": (
+                    # lookup of the chunks of the files, covering the target id
+                    SQLIndex(
+                        f"ix_index__{self.id}__source_relation",
+                        "source_id",
+                        "relation_type",
+                        "target_id",
+                    ),
+                    # lookup of the files sharing a chunk
+                    SQLIndex(
+                        f"ix_index__{self.id}__target_source",
+                        "target_id",
+                        "source_id",
+                    ),
+                ),
                 "id": Column(Integer, primary_key=True, autoincrement=True),
                 "source_id": Column(String),
                 "target_id": Column(String),
@@ -306,6 +326,10 @@ class FileIndex(BaseIndex):
         self._setup_resources()
         self._resources["Source"].__table__.drop(engine)  # type: ignore
         self._resources["Index"].__table__.drop(engine)  # type: ignore
+        chunk_id_cache.invalidate(self._resources["Index"])
+        chunk_id_cache.invalidate(self._resources["Source"])
+        answer_cache.invalidate(self.id)
+        indexing_jobs.remove(self.id)
         self._vs.drop()
         self._docstore.drop()
         shutil.rmtree(self._fs_path)
@@ -313,10 +337,14 @@ class FileIndex(BaseIndex):
     def on_start(self):
         """Setup the classes and hooks"""
         self._setup_resources()
+        # tables created before the indexes were declared
+        for index in self._resources["Index"].__table__.indexes:  # type: ignore
+            index.create(engine, checkfirst=True)
         self._setup_indexing_cls()
         self._setup_retriever_cls()
         self._setup_file_index_ui_cls()
         self._setup_file_selector_ui_cls()
+        indexing_jobs.register(self)
 
     def get_selector_component_ui(self):
         if self._selector_ui is None:
@@ -402,6 +430,7 @@ class FileIndex(BaseIndex):
         obj.FSPath = self._fs_path
         obj.user_id = user_id
         obj.private = self.config.get("private", False)
+        obj.index_id = self.id
 
         return obj
 
@@ -0,0 +1,366 @@
+"""Durable queue of the background embedding jobs of the file indices
+
+When the quick index mode is used, the chunks of a file are written to the
+docstore during the upload, and their embedding is deferred to a job recorded in
+the `IndexingJob` table. The jobs are run by a bounded pool of worker threads,
+batch by batch, and the number of processed chunks is checkpointed after each
+batch, so the jobs interrupted by a restart are resumed where they stopped.
+
+The queue can be configured in the flowsettings:
+    - KH_INDEXING_JOB_WORKERS: number of worker threads
+    - KH_INDEXING_JOB_INDEX_CONCURRENCY: maximum number of jobs running at the
+      same time for one index
+    - KH_INDEXING_JOB_BATCHES_PER_MINUTE: maximum number of batches embedded per
+      minute for one index, 0 for no limit
+    - KH_INDEXING_JOB_MAX_ATTEMPTS: number of attempts before a job is failed
+    - KH_INDEXING_JOB_STALE_AFTER: number of seconds after which a running job
+      that is not updated anymore (e.g. interrupted by a restart) is run again
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from ktem.db.models import IndexingJob, engine
+from ktem.reasoning.cache import answer_cache
+from sqlalchemy import delete, update
+from sqlmodel import Session, select
+from theflow.settings import settings as flowsettings
+
+from .chunk_ids import chunk_id_cache
+
+if TYPE_CHECKING:
+    from .index import FileIndex
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+class IndexingJobQueue:
+    """Run the embedding jobs of the file indices in background threads
+
+    Args:
+        workers: number of worker threads
+        index_concurrency: maximum number of running jobs per index
+        batches_per_minute: maximum number of batches per minute per index, 0 for
+            no limit
+        max_attempts: number of attempts before a job is failed
+        stale_after: seconds after which a running job that is not updated anymore
+            is run again, the running jobs updated more recently may be run by
+            another process
+        poll_interval: seconds between 2 checks for new jobs when idle
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        index_concurrency: Optional[int] = None,
+        batches_per_minute: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        stale_after: Optional[float] = None,
+        poll_interval: float = 2.0,
+    ):
+        self.workers = workers or getattr(flowsettings, "KH_INDEXING_JOB_WORKERS", 2)
+        self.index_concurrency = index_concurrency or getattr(
+            flowsettings, "KH_INDEXING_JOB_INDEX_CONCURRENCY", 1
+        )
+        if batches_per_minute is None:
+            batches_per_minute = getattr(
+                flowsettings, "KH_INDEXING_JOB_BATCHES_PER_MINUTE", 0
+            )
+        self.batches_per_minute = batches_per_minute
+        self.max_attempts = max_attempts or getattr(
+            flowsettings, "KH_INDEXING_JOB_MAX_ATTEMPTS", 3
+        )
+        self.stale_after = stale_after or getattr(
+            flowsettings, "KH_INDEXING_JOB_STALE_AFTER", 600
+        )
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._indices: dict[int, "FileIndex"] = {}
+        self._running: dict[int, int] = defaultdict(int)
+        self._next_batch_at: dict[int, float] = defaultdict(float)
+        self._next_requeue_at = 0.0
+        self._threads: list[threading.Thread] = []
+
+    def register(self, index: "FileIndex"):
+        """Let the queue run the jobs of the index, including the jobs interrupted
+        by a restart
+        """
+        self._requeue_stale([index.id])
+
+        with self._lock:
+            self._indices[index.id] = index
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._wakeup.set()
+
+    def submit(
+        self,
+        index_id: int,
+        file_id: str,
+        file_name: str,
+        chunk_ids: list[str],
+        user: Optional[int] = None,
+    ) -> Optional[int]:
+        """Queue the embedding of the chunks of a file, return the job id
+
+        The active jobs of the file are cancelled, as the new job covers the
+        current chunks of the file.
+        """
+        self.cancel(index_id, file_id)
+        if not chunk_ids:
+            return None
+
+        job = IndexingJob(
+            index_id=index_id,
+            file_id=file_id,
+            file_name=file_name,
+            user=user,
+            chunk_ids=list(chunk_ids),
+        )
+        with Session(engine) as session:
+            session.add(job)
+            session.commit()
+            job_id = job.id
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, index_id: int, file_id: str) -> int:
+        """Cancel the active jobs of a file, return the number of cancelled jobs"""
+        with Session(engine) as session:
+            n_cancelled = session.execute(
+                update(IndexingJob)
+                .where(
+                    IndexingJob.index_id == index_id,  # type: ignore
+                    IndexingJob.file_id == file_id,  # type: ignore
+                    IndexingJob.status.in_(ACTIVE_STATUSES),  # type: ignore
+                )
+                .values(status="cancelled", date_updated=datetime.datetime.utcnow())
+            ).rowcount
+            session.commit()
+        return n_cancelled
+
+    def remove(self, index_id: int, file_id: Optional[str] = None):
+        """Remove the jobs of a deleted file (or index), stopping the running ones"""
+        statement = delete(IndexingJob).where(
+            IndexingJob.index_id == index_id  # type: ignore
+        )
+        if file_id is not None:
+            statement = statement.where(IndexingJob.file_id == file_id)  # type: ignore
+        else:
+            with self._lock:
+                self._indices.pop(index_id, None)
+
+        with Session(engine) as session:
+            session.execute(statement)
+            session.commit()
+
+    def status(self, index_id: int, file_ids: Optional[list[str]] = None) -> dict:
+        """Get the status of the latest job of each file of the index
+
+        Returns:
+            a dict of file id to {"status", "done", "total", "attempts", "error"}
+        """
+        statement = select(IndexingJob).where(IndexingJob.index_id == index_id)
+        if file_ids is not None:
+            statement = statement.where(
+                IndexingJob.file_id.in_(file_ids)  # type: ignore
+            )
+        statement = statement.order_by(IndexingJob.id)  # type: ignore
+
+        result = {}
+        with Session(engine) as session:
+            for job in session.exec(statement).all():
+                result[job.file_id] = {
+                    "status": job.status,
+                    "done": job.n_done,
+                    "total": len(job.chunk_ids),
+                    "attempts": job.attempts,
+                    "error": job.error,
+                }
+        return result
+
+    def _requeue_stale(self, index_ids: list[int]):
+        """Mark the running jobs not updated for `stale_after` seconds as pending"""
+        stale_before = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.stale_after
+        )
+        with Session(engine) as session:
+            session.execute(
+                update(IndexingJob)
+                .where(
+                    IndexingJob.index_id.in_(index_ids),  # type: ignore
+                    IndexingJob.status == "running",  # type: ignore
+                    IndexingJob.date_updated < stale_before,  # type: ignore
+                )
+                .values(status="pending")
+            )
+            session.commit()
+
+    def _claim(self) -> Optional[IndexingJob]:
+        """Mark the next runnable job as running and return it"""
+        with self._lock:
+            index_ids = [
+                index_id
+                for index_id in self._indices
+                if self._running[index_id] < self.index_concurrency
+            ]
+
+        with Session(engine) as session:
+            for index_id in index_ids:
+                job = session.exec(
+                    select(IndexingJob)
+                    .where(
+                        IndexingJob.index_id == index_id,
+                        IndexingJob.status == "pending",
+                        IndexingJob.not_before <= datetime.datetime.utcnow(),
+                    )
+                    .order_by(IndexingJob.id)  # type: ignore
+                ).first()
+                if job is None:
+                    continue
+
+                with self._lock:
+                    if self._running[index_id] >= self.index_concurrency:
+                        continue
+                    # the job may be claimed by another worker meanwhile
+                    claimed = session.execute(
+                        update(IndexingJob)
+                        .where(
+                            IndexingJob.id == job.id,  # type: ignore
+                            IndexingJob.status == "pending",  # type: ignore
+                        )
+                        .values(
+                            status="running", date_updated=datetime.datetime.utcnow()
+                        )
+                    ).rowcount
+                    session.commit()
+                    if not claimed:
+                        continue
+                    self._running[index_id] += 1
+
+                session.refresh(job)
+                session.expunge(job)
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._maybe_requeue_stale()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.exception(f"Indexing job {job.id} failed")
+                self._fail(job, e)
+            finally:
+                with self._lock:
+                    self._running[job.index_id] -= 1
+
+    def _maybe_requeue_stale(self):
+        """Requeue the stale jobs of the registered indices from time to time"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_requeue_at:
+                return
+            self._next_requeue_at = now + self.stale_after / 2
+            index_ids = list(self._indices)
+        if index_ids:
+            self._requeue_stale(index_ids)
+
+    def _throttle(self, index_id: int):
+        """Wait for the rate limit of the index"""
+        if not self.batches_per_minute:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_batch_at[index_id])
+            self._next_batch_at[index_id] = start_at + 60 / self.batches_per_minute
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def _update(self, job_id: int, **values):
+        """Update a running job, unless it was cancelled meanwhile"""
+        with Session(engine) as session:
+            session.execute(
+                update(IndexingJob)
+                .where(
+                    IndexingJob.id == job_id,  # type: ignore
+                    IndexingJob.status == "running",  # type: ignore
+                )
+                .values(date_updated=datetime.datetime.utcnow(), **values)
+            )
+            session.commit()
+
+    def _is_active(self, job_id: int) -> bool:
+        with Session(engine) as session:
+            job = session.get(IndexingJob, job_id)
+            return job is not None and job.status == "running"
+
+    def _run(self, job: IndexingJob):
+        index = self._indices[job.index_id]
+        pipeline = index.get_indexing_pipeline({}, job.user).route(Path(job.file_name))
+        batch_size = pipeline.chunk_batch_size
+        n_done = job.n_done
+
+        for start in range(n_done, len(job.chunk_ids), batch_size):
+            if not self._is_active(job.id):
+                # cancelled, e.g. the file was deleted or re-indexed
+                return
+
+            # skip the chunks removed since the job was queued, and the chunks
+            # embedded before an interruption
+            live_ids = set(chunk_id_cache.get(pipeline.Index, [job.file_id]))
+            embedded_ids = set(
+                chunk_id_cache.get(pipeline.Index, [job.file_id], "vector")
+            )
+            ids = [
+                chunk_id
+                for chunk_id in job.chunk_ids[start : start + batch_size]
+                if chunk_id in live_ids and chunk_id not in embedded_ids
+            ]
+
+            if ids:
+                self._throttle(job.index_id)
+                pipeline.handle_chunks_vectorstore(pipeline.DS.get(ids), job.file_id)
+
+            n_done = min(start + batch_size, len(job.chunk_ids))
+            self._update(job.id, n_done=n_done)
+
+        self._update(job.id, status="done", error=None)
+        # the answers can now use the embedded chunks
+        answer_cache.invalidate(job.index_id, [job.file_id])
+
+    def _fail(self, job: IndexingJob, error: Exception):
+        attempts = job.attempts + 1
+        if attempts >= self.max_attempts:
+            self._update(job.id, status="failed", attempts=attempts, error=str(error))
+            return
+
+        backoff = datetime.timedelta(seconds=30 * 2 ** (attempts - 1))
+        self._update(
+            job.id,
+            status="pending",
+            attempts=attempts,
+            error=str(error),
+            not_before=datetime.datetime.utcnow() + backoff,
+        )
+
+
+indexing_jobs = IndexingJobQueue()
@@ -1,21 +1,26 @@
 from __future__ import annotations
 
+import json
 import logging
+import pickle
+import queue
 import shutil
 import threading
 import time
 import warnings
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from copy import deepcopy
 from functools import lru_cache
 from hashlib import sha256
 from pathlib import Path
-from typing import Generator, Optional, Sequence
+from typing import Generator, Iterable, Optional, Sequence
 
 import tiktoken
 from ktem.db.models import engine
 from ktem.embeddings.manager import embedding_models_manager
 from ktem.llms.manager import llms
+from ktem.reasoning.cache import answer_cache
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.readers.file.base import default_file_metadata_func
 from llama_index.core.vector_stores import (
@@ -25,10 +30,10 @@ from llama_index.core.vector_stores import (
     MetadataFilters,
 )
 from llama_index.core.vector_stores.types import VectorStoreQueryMode
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
 from sqlalchemy.orm import Session
 from theflow.settings import settings
-from theflow.utils.modules import import_dotted_string
+from theflow.utils.modules import deserialize, import_dotted_string
 
 from kotaemon.base import BaseComponent, Document, Node, Param, RetrievedDocument
 from kotaemon.embeddings import BaseEmbeddings
@@ -46,8 +51,12 @@ from kotaemon.indices.rankings import (
     LLMTrulensScoring,
 )
 from kotaemon.indices.splitters import BaseSplitter, TokenSplitter
+from kotaemon.loaders import PDFThumbnailReader
+from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
+from .chunk_ids import chunk_id_cache
+from .jobs import indexing_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +86,276 @@ def dev_settings():
 _default_token_func = tiktoken.encoding_for_model("gpt-3.5-turbo").encode
 
 
+def split_docs(docs: list[Document], splitter: BaseSplitter | None) -> list[Document]:
+    """Split the loaded documents into the chunks to be indexed
+
+    Text documents are split with the splitter, and each resulting chunk is linked
+    to the thumbnail of its page (if any). Non-text and thumbnail documents are
+    kept as-is.
+
+    Args:
+        docs: the documents returned by the loader
+        splitter: the splitter to chunk the text documents, None to skip splitting
+
+    Returns:
+        the list of chunks to be stored in the docstore and vectorstore
+    """
+    text_docs = []
+    non_text_docs = []
+    thumbnail_docs = []
+
+    for doc in docs:
+        doc_type = doc.metadata.get("type", "text")
+        if doc_type == "text":
+            text_docs.append(doc)
+        elif doc_type == "thumbnail":
+            thumbnail_docs.append(doc)
+        else:
+            non_text_docs.append(doc)
+
+    print(f"Got {len(thumbnail_docs)} page thumbnails")
+    page_label_to_thumbnail = {
+        doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
+    }
+
+    if splitter:
+        all_chunks = splitter(text_docs)
+    else:
+        all_chunks = text_docs
+
+    # add the thumbnails doc_id to the chunks
+    for chunk in all_chunks:
+        page_label = chunk.metadata.get("page_label", None)
+        if page_label and page_label in page_label_to_thumbnail:
+            chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
+
+    return all_chunks + non_text_docs + thumbnail_docs
+
+
+def load_and_split(
+    loader: BaseReader,
+    splitter: BaseSplitter | dict | None,
+    file_path: str,
+    extra_info: dict,
+) -> tuple[list[Document], list[Document]]:
+    """Load and split a file. Used as the worker function of the parallel indexing.
+
+    Args:
+        loader: the loader of the file
+        splitter: the splitter, or its dump (see `BaseComponent.dump`) to rebuild it
+            in the worker process, as the splitters wrapping a LlamaIndex parser do
+            not work anymore once unpickled
+        file_path: the path to the file
+        extra_info: the metadata to attach to every loaded document
+
+    Returns:
+        the loaded documents and the chunks to be indexed
+    """
+    if isinstance(splitter, dict):
+        splitter = deserialize(splitter, safe=False)
+    docs = loader.load_data(Path(file_path), extra_info=extra_info)
+    return docs, split_docs(docs, splitter)
+
+
+def lazy_load(
+    loader: BaseReader, file_path: Path, extra_info: dict
+) -> Iterable[Document]:
+    """Load a file with the `lazy_load_data` iterator of the loader if it has one,
+    otherwise with `load_data`
+    """
+    if getattr(type(loader), "lazy_load_data", None) in (
+        None,
+        BaseReader.lazy_load_data,
+    ):
+        return loader.load_data(file_path, extra_info=extra_info)
+    return loader.lazy_load_data(file_path, extra_info=extra_info)
+
+
+def prefetch_windows(
+    docs: Iterable[Document], window_size: int, ahead: int = 1
+) -> Generator[list[Document], None, None]:
+    """Group the documents in windows of about `window_size` documents, loaded in a
+    background thread at most `ahead` windows ahead of the consumer
+
+    A page thumbnail is kept in the window of the text of its page.
+    """
+    windows: queue.Queue = queue.Queue(maxsize=ahead)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                windows.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load():
+        try:
+            window: list[Document] = []
+            for doc in docs:
+                if (
+                    len(window) >= window_size
+                    and doc.metadata.get("type", "text") != "thumbnail"
+                ):
+                    if not put(("window", window)):
+                        return
+                    window = []
+                window.append(doc)
+            if window and not put(("window", window)):
+                return
+            put(("end", None))
+        except Exception as e:
+            put(("error", e))
+
+    threading.Thread(target=load, name="document-loader", daemon=True).start()
+    try:
+        while True:
+            kind, value = windows.get()
+            if kind == "window":
+                yield value
+            elif kind == "end":
+                return
+            else:
+                raise value
+    finally:
+        stop.set()
+
+
+def remove_chunks(
+    Index,
+    VS: BaseVectorStore | None,
+    DS: BaseDocumentStore,
+    file_id: str,
+    chunk_ids: Optional[list[str]] = None,
+    index_id: Optional[int] = None,
+):
+    """Remove chunks of a file from the Index table, docstore and vectorstore
+
+    Chunks that are also referenced by other files (files with identical
+    content) are kept in the docstore and vectorstore.
+
+    Args:
+        Index: the SQLAlchemy Index table
+        VS: the vector store
+        DS: the document store
+        file_id: the file id
+        chunk_ids: the chunks to remove, None to remove all chunks of the file
+        index_id: the id of the file index, to invalidate its cached answers
+    """
+    cond = [Index.source_id == file_id]
+    if chunk_ids is not None:
+        cond.append(Index.target_id.in_(chunk_ids))
+
+    with Session(engine) as session:
+        rows = session.execute(
+            select(Index.target_id, Index.relation_type).where(*cond)
+        ).all()
+        shared_ids = {
+            each[0]
+            for each in session.execute(
+                select(Index.target_id).where(
+                    Index.source_id != file_id,
+                    Index.target_id.in_(select(Index.target_id).where(*cond)),
+                )
+            ).all()
+        }
+        session.execute(delete(Index).where(*cond))
+        session.commit()
+    chunk_id_cache.invalidate(Index, [file_id])
+    if index_id is not None:
+        answer_cache.invalidate(index_id, [file_id])
+
+    vs_ids, ds_ids = [], []
+    for target_id, relation_type in rows:
+        if target_id in shared_ids:
+            continue
+        if relation_type == "vector":
+            vs_ids.append(target_id)
+        elif relation_type == "document":
+            ds_ids.append(target_id)
+
+    if vs_ids and VS:
+        VS.delete(vs_ids)
+    if ds_ids:
+        DS.delete(ds_ids)
+
+
+def remove_file(
+    Source,
+    Index,
+    VS: BaseVectorStore | None,
+    DS: BaseDocumentStore,
+    file_id: str,
+    index_id: Optional[int] = None,
+):
+    """Delete a file from the db, including its chunks in docstore and vectorstore
+
+    Args:
+        Source: the SQLAlchemy Source table
+        Index: the SQLAlchemy Index table
+        VS: the vector store
+        DS: the document store
+        file_id: the file id
+        index_id: the id of the file index, to remove its jobs and cached answers
+    """
+    with Session(engine) as session:
+        session.execute(delete(Source).where(Source.id == file_id))
+        session.commit()
+    chunk_id_cache.invalidate(Source, [file_id])
+
+    if index_id is not None:
+        indexing_jobs.remove(index_id, file_id)
+    remove_chunks(Index, VS, DS, file_id, index_id=index_id)
+
+
+def _is_picklable(*objs) -> bool:
+    """Check that the objects can be sent to a worker process and back"""
+    try:
+        pickle.loads(pickle.dumps(objs))
+    except Exception:
+        return False
+    return True
+
+
+def _hash_chunk(chunk: Document, linked_hash: str = "") -> str:
+    content = [
+        chunk.text,
+        chunk.metadata.get("type", "text"),
+        str(chunk.metadata.get("page_label", "")),
+        # thumbnail files are named after their content hash
+        chunk.metadata.get("image_origin", "")
+        or chunk.metadata.get("thumbnail_path", ""),
+        linked_hash,
+    ]
+    return sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def compute_chunk_hashes(chunks: list[Document]) -> list[str]:
+    """Compute a stable hash for each chunk, independent of the chunk id
+
+    The hash only depends on the content of the chunk and its page, so the same
+    chunk produced by 2 different indexing runs has the same hash. The hash of a
+    text chunk also covers its linked page thumbnail (if any).
+    """
+    thumbnail_hashes = {
+        chunk.doc_id: _hash_chunk(chunk)
+        for chunk in chunks
+        if chunk.metadata.get("type", "text") == "thumbnail"
+    }
+
+    hashes = []
+    for chunk in chunks:
+        if chunk.doc_id in thumbnail_hashes:
+            hashes.append(thumbnail_hashes[chunk.doc_id])
+            continue
+        linked_hash = thumbnail_hashes.get(chunk.metadata.get("thumbnail_doc_id"), "")
+        hashes.append(_hash_chunk(chunk, linked_hash))
+
+    return hashes
+
+
 class DocumentRetrievalPipeline(BaseFileIndexRetriever):
     """Retrieve relevant document
 
@@ -89,6 +368,8 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             for surrounding tables (e.g. within the page)
         top_k: number of documents to retrieve
         mmr: whether to use mmr to re-rank the documents
+        hybrid_fusion: how the vector and full-text results are fused in hybrid
+            retrieval mode: "rrf" (reciprocal rank fusion) or "weighted"
     """
 
     embedding: BaseEmbeddings
@@ -99,6 +380,7 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
     mmr: bool = False
     top_k: int = 5
     retrieval_mode: str = "hybrid"
+    hybrid_fusion: str = "rrf"
 
     @Node.auto(depends_on=["embedding", "VS", "DS"])
     def vector_retrieval(self) -> VectorRetrieval:
@@ -107,6 +389,7 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             vector_store=self.VS,
             doc_store=self.DS,
             retrieval_mode=self.retrieval_mode,  # type: ignore
+            hybrid_fusion=self.hybrid_fusion,  # type: ignore
             rerankers=self.rerankers,
         )
 
@@ -129,13 +412,9 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             return []
 
         retrieval_kwargs: dict = {}
-        with Session(engine) as session:
-            stmt = select(self.Index).where(
-                self.Index.relation_type == "document",
-                self.Index.source_id.in_(doc_ids),
-            )
-            results = session.execute(stmt)
-            chunk_ids = [r[0].target_id for r in results.all()]
+        chunk_ids = chunk_id_cache.get(self.Index, doc_ids)
+        # chunks shared from identical files keep the id of the original file
+        file_ids = chunk_id_cache.get_file_ids(self.Source, doc_ids)
 
         # do first round top_k extension
         retrieval_kwargs["do_extend"] = True
@@ -144,7 +423,7 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             filters=[
                 MetadataFilter(
                     key="file_id",
-                    value=doc_ids,
+                    value=file_ids,
                     operator=FilterOperator.IN,
                 )
             ],
@@ -238,6 +517,15 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
                 "choices": ["vector", "text", "hybrid"],
                 "component": "dropdown",
             },
+            "hybrid_fusion": {
+                "name": "Hybrid fusion (hybrid retrieval mode)",
+                "value": "rrf",
+                "choices": [
+                    ("Reciprocal rank fusion", "rrf"),
+                    ("Weighted scores", "weighted"),
+                ],
+                "component": "dropdown",
+            },
             "prioritize_table": {
                 "name": "Prioritize table",
                 "value": False,
@@ -284,7 +572,19 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
                 )
             ],
             retrieval_mode=user_settings["retrieval_mode"],
-            llm_scorer=(LLMTrulensScoring() if use_llm_reranking else None),
+            hybrid_fusion=user_settings.get("hybrid_fusion", "rrf"),
+            llm_scorer=(
+                LLMTrulensScoring(
+                    batch_size=getattr(settings, "KH_RERANKING_BATCH_SIZE", 1),
+                    early_stop=getattr(settings, "KH_RERANKING_EARLY_STOP", 0),
+                    cache_path=str(
+                        Path(getattr(settings, "KH_APP_DATA_DIR", "."))
+                        / "relevance_scores.db"
+                    ),
+                )
+                if use_llm_reranking
+                else None
+            ),
             rerankers=[CohereReranking()],
         )
         if not user_settings["use_reranking"]:
@@ -312,6 +612,10 @@ class IndexPipeline(BaseComponent):
     loader: BaseReader
     splitter: BaseSplitter | None
     chunk_batch_size: int = 200
+    # number of documents of a lazy loader split and stored at once
+    docs_window_size: int = getattr(settings, "FILE_INDEX_PIPELINE_DOCS_WINDOW", 32)
+    # return the loaded documents from `stream`, the lazy loaders are not used then
+    keep_docs: bool = False
 
     Source = Param(help="The SQLAlchemy Source table")
     Index = Param(help="The SQLAlchemy Index table")
@@ -319,8 +623,10 @@ class IndexPipeline(BaseComponent):
     DS = Param(help="The DocStore")
     FSPath = Param(help="The file storage path")
     user_id = Param(help="The user id")
+    index_id = Param(None, help="The id of the index, to queue background jobs")
     collection_name: str = "default"
     private: bool = False
+    # defer the embedding to the background job queue (quick index mode)
     run_embedding_in_thread: bool = False
     embedding: BaseEmbeddings
 
@@ -331,95 +637,177 @@ class IndexPipeline(BaseComponent):
         )
 
     def handle_docs(self, docs, file_id, file_name) -> Generator[Document, None, int]:
+        """Split and store the documents loaded from a file
+
+        The documents of a lazy loader (see `lazy_load`) are loaded in a background
+        thread, and split and stored by windows of `docs_window_size` documents, so
+        that only a few windows are held in memory and the embedding of a window
+        overlaps with the parsing of the next one.
+        """
+        if isinstance(docs, list):
+            to_index_chunks = split_docs(docs, self.splitter)
+            return (yield from self.handle_chunks(to_index_chunks, file_id, file_name))
+
+        windows = prefetch_windows(docs, self.docs_window_size)
+        try:
+            return (
+                yield from self.handle_chunk_windows(
+                    (split_docs(window, self.splitter) for window in windows),
+                    file_id,
+                    file_name,
+                )
+            )
+        finally:
+            windows.close()
+
+    def handle_chunks(
+        self, to_index_chunks, file_id, file_name
+    ) -> Generator[Document, None, int]:
+        """Store the already split chunks into the docstore and vectorstore"""
+        return (
+            yield from self.handle_chunk_windows([to_index_chunks], file_id, file_name)
+        )
+
+    def handle_chunk_windows(
+        self, windows: Iterable[list[Document]], file_id, file_name
+    ) -> Generator[Document, None, int]:
+        """Store the windows of chunks of a file into the docstore and vectorstore
+
+        Chunks that were already indexed for this file (e.g. when re-indexing a new
+        revision of the file) are kept as-is and are not embedded again. The other
+        indexed chunks of the file are removed once all the windows are stored. If
+        a window cannot be loaded or stored, the new chunks are removed and the
+        previously indexed chunks are kept.
+        """
         s_time = time.time()
-        text_docs = []
-        non_text_docs = []
-        thumbnail_docs = []
 
-        for doc in docs:
-            doc_type = doc.metadata.get("type", "text")
-            if doc_type == "text":
-                text_docs.append(doc)
-            elif doc_type == "thumbnail":
-                thumbnail_docs.append(doc)
-            else:
-                non_text_docs.append(doc)
+        indexed_rows, indexed_ids_by_hash = self.get_indexed_chunks(file_id)
+        reused_ids: dict[str, str] = {}
 
-        print(f"Got {len(thumbnail_docs)} page thumbnails")
-        page_label_to_thumbnail = {
-            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
-        }
+        # queue the vector indexing as a background job if specified
+        queue_embedding = bool(
+            self.run_embedding_in_thread and self.VS and self.index_id is not None
+        )
+        n_cancelled = 0
+        if not queue_embedding and self.index_id is not None:
+            # the chunks left by a previous job are embedded again below
+            n_cancelled = indexing_jobs.cancel(self.index_id, file_id)
+
+        written_ids: list[str] = []
+        queued_ids: list[str] = []
+        n_chunks = n_embedded = n_reused = 0
+        try:
+            for to_index_chunks in windows:
+                if indexed_rows:
+                    n_total = len(to_index_chunks)
+                    to_index_chunks = self.match_indexed_chunks(
+                        to_index_chunks, indexed_ids_by_hash, reused_ids
+                    )
+                    n_reused += n_total - len(to_index_chunks)
 
-        if self.splitter:
-            all_chunks = self.splitter(text_docs)
-        else:
-            all_chunks = text_docs
-
-        # add the thumbnails doc_id to the chunks
-        for chunk in all_chunks:
-            page_label = chunk.metadata.get("page_label", None)
-            if page_label and page_label in page_label_to_thumbnail:
-                chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
-
-        to_index_chunks = all_chunks + non_text_docs + thumbnail_docs
-
-        # add to doc store
-        chunks = []
-        n_chunks = 0
-        chunk_size = self.chunk_batch_size * 4
-        for start_idx in range(0, len(to_index_chunks), chunk_size):
-            chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-            self.handle_chunks_docstore(chunks, file_id)
-            n_chunks += len(chunks)
-            yield Document(
-                f" => [{file_name}] Processed {n_chunks} chunks",
-                channel="debug",
-            )
+                # count the tokens once, for the evidence packing at query time
+                for chunk in to_index_chunks:
+                    if chunk.text and "token_count" not in chunk.metadata:
+                        chunk.metadata["token_count"] = len(
+                            _default_token_func(chunk.text, disallowed_special=())
+                        )
 
-        def insert_chunks_to_vectorstore():
-            chunks = []
-            n_chunks = 0
-            chunk_size = self.chunk_batch_size
-            for start_idx in range(0, len(to_index_chunks), chunk_size):
-                chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-                self.handle_chunks_vectorstore(chunks, file_id)
-                n_chunks += len(chunks)
-                if self.VS:
+                # add to doc store
+                chunk_size = self.chunk_batch_size * 4
+                for start_idx in range(0, len(to_index_chunks), chunk_size):
+                    chunks = to_index_chunks[start_idx : start_idx + chunk_size]
+                    written_ids.extend(chunk.doc_id for chunk in chunks)
+                    self.handle_chunks_docstore(chunks, file_id)
+                    n_chunks += len(chunks)
                     yield Document(
-                        f" => [{file_name}] Created embedding for {n_chunks} chunks",
+                        f" => [{file_name}] Processed {n_chunks} chunks",
                         channel="debug",
                     )
 
-        # run vector indexing in thread if specified
-        if self.run_embedding_in_thread:
-            print("Running embedding in thread")
-            threading.Thread(
-                target=lambda: list(insert_chunks_to_vectorstore())
-            ).start()
-        else:
-            yield from insert_chunks_to_vectorstore()
+                if queue_embedding:
+                    queued_ids.extend(chunk.doc_id for chunk in to_index_chunks)
+                    continue
+
+                chunk_size = self.chunk_batch_size
+                for start_idx in range(0, len(to_index_chunks), chunk_size):
+                    chunks = to_index_chunks[start_idx : start_idx + chunk_size]
+                    self.handle_chunks_vectorstore(chunks, file_id)
+                    n_embedded += len(chunks)
+                    if self.VS:
+                        yield Document(
+                            f" => [{file_name}] Created embedding for {n_embedded} "
+                            "chunks",
+                            channel="debug",
+                        )
+        except BaseException:
+            self.rollback_chunks(
+                file_id, file_name, written_ids, indexed_rows, bool(n_cancelled)
+            )
+            raise
+
+        if n_reused:
+            yield Document(
+                f" => [{file_name}] Reused {n_reused} unchanged chunks",
+                channel="debug",
+            )
+        if indexed_rows:
+            self.delete_stale_chunks(file_id, indexed_rows, reused_ids)
+
+        if queue_embedding:
+            indexing_jobs.submit(
+                self.index_id,
+                file_id,
+                file_name,
+                queued_ids,
+                user=self.user_id,
+            )
+            yield Document(
+                f" => [{file_name}] Queued the embedding of {n_chunks} chunks",
+                channel="debug",
+            )
 
         print("indexing step took", time.time() - s_time)
         return n_chunks
 
+    def rollback_chunks(
+        self,
+        file_id: str,
+        file_name: str,
+        written_ids: list[str],
+        indexed_rows: list[tuple[str, str]],
+        requeue: bool,
+    ):
+        """Remove the new chunks of a file whose indexing failed, keeping its
+        previously indexed chunks
+
+        Args:
+            file_id: the file id
+            file_name: the file name
+            written_ids: the ids of the new chunks written so far
+            indexed_rows: the (target id, relation type) rows of the previously
+                indexed chunks of the file
+            requeue: queue again the embedding of the previously indexed chunks, as
+                their job was cancelled
+        """
+        if written_ids:
+            self.delete_chunks(file_id, written_ids)
+
+        if requeue and indexed_rows and self.VS and self.index_id is not None:
+            indexing_jobs.submit(
+                self.index_id,
+                file_id,
+                file_name,
+                [target_id for target_id, rel in indexed_rows if rel == "document"],
+                user=self.user_id,
+            )
+
     def handle_chunks_docstore(self, chunks, file_id):
         """Run chunks"""
         # run embedding, add to both vector store and doc store
         self.vector_indexing.add_to_docstore(chunks)
 
         # record in the index
-        with Session(engine) as session:
-            nodes = []
-            for chunk in chunks:
-                nodes.append(
-                    self.Index(
-                        source_id=file_id,
-                        target_id=chunk.doc_id,
-                        relation_type="document",
-                    )
-                )
-            session.add_all(nodes)
-            session.commit()
+        self.add_index_rows(file_id, [chunk.doc_id for chunk in chunks], "document")
 
     def handle_chunks_vectorstore(self, chunks, file_id):
         """Run chunks"""
@@ -429,18 +817,119 @@ class IndexPipeline(BaseComponent):
 
         if self.VS:
             # record in the index
-            with Session(engine) as session:
-                nodes = []
-                for chunk in chunks:
-                    nodes.append(
-                        self.Index(
-                            source_id=file_id,
-                            target_id=chunk.doc_id,
-                            relation_type="vector",
-                        )
-                    )
-                session.add_all(nodes)
-                session.commit()
+            self.add_index_rows(file_id, [chunk.doc_id for chunk in chunks], "vector")
+
+    def add_index_rows(self, file_id: str, target_ids: list[str], relation_type: str):
+        """Bulk insert the relations of a file into the Index table"""
+        if not target_ids:
+            return
+
+        with Session(engine) as session:
+            session.execute(
+                insert(self.Index),
+                [
+                    {
+                        "source_id": file_id,
+                        "target_id": target_id,
+                        "relation_type": relation_type,
+                    }
+                    for target_id in target_ids
+                ],
+            )
+            session.commit()
+        chunk_id_cache.invalidate(self.Index, [file_id])
+        if self.index_id is not None:
+            answer_cache.invalidate(self.index_id, [file_id])
+
+    def get_indexed_chunks(
+        self, file_id: str
+    ) -> tuple[list[tuple[str, str]], dict[str, list[str]]]:
+        """Get the currently indexed chunks of a file, to diff the new chunks of the
+        file against them
+
+        Args:
+            file_id: the file id
+
+        Returns:
+            the (target id, relation type) rows of the file in the Index table, and
+                the ids of the reusable indexed chunks by hash
+        """
+        with Session(engine) as session:
+            rows = session.execute(
+                select(self.Index.target_id, self.Index.relation_type).where(
+                    self.Index.source_id == file_id
+                )
+            ).all()
+        if not rows:
+            return [], {}
+
+        ds_ids = [target_id for target_id, rel in rows if rel == "document"]
+        vs_ids = {target_id for target_id, rel in rows if rel == "vector"}
+
+        old_docs = self.DS.get(ds_ids) if ds_ids else []
+        old_ids_by_hash: dict[str, list[str]] = defaultdict(list)
+        for doc, chunk_hash in zip(old_docs, compute_chunk_hashes(old_docs)):
+            if self.VS and doc.doc_id not in vs_ids:
+                # the embedding of this chunk was not finished, index it again
+                continue
+            old_ids_by_hash[chunk_hash].append(doc.doc_id)
+
+        return [tuple(row) for row in rows], old_ids_by_hash
+
+    def match_indexed_chunks(
+        self,
+        chunks: list[Document],
+        indexed_ids_by_hash: dict[str, list[str]],
+        reused_ids: dict[str, str],
+    ) -> list[Document]:
+        """Reuse the indexed chunks having the same hash as new chunks
+
+        Args:
+            chunks: the new chunks of the file
+            indexed_ids_by_hash: the ids of the reusable indexed chunks by hash,
+                the reused ones are removed
+            reused_ids: updated with the reused chunk id of each matched new chunk
+
+        Returns:
+            the new chunks that are not indexed yet
+        """
+        new_chunks = []
+        for chunk, chunk_hash in zip(chunks, compute_chunk_hashes(chunks)):
+            if indexed_ids_by_hash.get(chunk_hash):
+                reused_ids[chunk.doc_id] = indexed_ids_by_hash[chunk_hash].pop()
+            else:
+                new_chunks.append(chunk)
+
+        # link the new chunks to the reused page thumbnails
+        for chunk in new_chunks:
+            thumbnail_id = chunk.metadata.get("thumbnail_doc_id")
+            if thumbnail_id in reused_ids:
+                chunk.metadata["thumbnail_doc_id"] = reused_ids[thumbnail_id]
+
+        return new_chunks
+
+    def delete_stale_chunks(
+        self,
+        file_id: str,
+        indexed_rows: list[tuple[str, str]],
+        reused_ids: dict[str, str],
+    ):
+        """Remove the previously indexed chunks of a file that were not reused"""
+        kept_ids = set(reused_ids.values())
+        stale_ids = list(
+            {target_id for target_id, _ in indexed_rows if target_id not in kept_ids}
+        )
+        if stale_ids:
+            self.delete_chunks(file_id, stale_ids)
+
+    def delete_chunks(self, file_id: str, chunk_ids: Optional[list[str]] = None):
+        """Remove chunks of a file from the Index table, docstore and vectorstore
+
+        Args:
+            file_id: the file id
+            chunk_ids: the chunks to remove, None to remove all chunks of the file
+        """
+        remove_chunks(self.Index, self.VS, self.DS, file_id, chunk_ids, self.index_id)
 
     def get_id_if_exists(self, file_path: Path) -> Optional[str]:
         """Check if the file is already indexed
@@ -467,17 +956,52 @@ class IndexPipeline(BaseComponent):
 
         return None
 
-    def store_file(self, file_path: Path) -> str:
+    def get_id_by_content(self, file_hash: str) -> Optional[str]:
+        """Get the id of an indexed file having the same content
+
+        Only the files whose indexing finished (see `finish`) are matched, not the
+        files being indexed or whose indexing failed, as their chunks are not all
+        stored.
+
+        Args:
+            file_hash: the sha256 of the file content
+
+        Returns:
+            the file id if such file is indexed, otherwise None
+        """
+        if self.private:
+            cond: tuple = (
+                self.Source.path == file_hash,
+                self.Source.user == self.user_id,
+            )
+        else:
+            cond = (self.Source.path == file_hash,)
+
+        with Session(engine) as session:
+            stmt = select(self.Source.id, self.Source.note).where(*cond)
+            for file_id, note in session.execute(stmt).all():
+                if "loader" in (note or {}):
+                    return file_id
+
+        return None
+
+    def hash_file(self, file_path: Path) -> str:
+        """Get the sha256 of the file content"""
+        with file_path.open("rb") as fi:
+            return sha256(fi.read()).hexdigest()
+
+    def store_file(self, file_path: Path, file_hash: Optional[str] = None) -> str:
         """Store file into the database and storage, return the file id
 
         Args:
             file_path: the path to the file
+            file_hash: the sha256 of the file content, computed if not provided
 
         Returns:
             the file id
         """
-        with file_path.open("rb") as fi:
-            file_hash = sha256(fi.read()).hexdigest()
+        if file_hash is None:
+            file_hash = self.hash_file(file_path)
 
         shutil.copy(file_path, self.FSPath / file_hash)
         source = self.Source(
@@ -493,6 +1017,74 @@ class IndexPipeline(BaseComponent):
 
         return file_id
 
+    def update_file(self, file_id: str, file_path: Path, file_hash: str):
+        """Update the storage and the database record of an indexed file
+
+        Args:
+            file_id: the file id
+            file_path: the path to the new revision of the file
+            file_hash: the sha256 of the new revision
+        """
+        shutil.copy(file_path, self.FSPath / file_hash)
+        with Session(engine) as session:
+            result = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()
+            if not result:
+                return
+            item = result[0]
+            item.path = file_hash
+            item.size = file_path.stat().st_size
+            # the file is not matched by its content until it is indexed again
+            item.note.pop("loader", None)
+            session.add(item)
+            session.commit()
+
+    def link_file(self, file_id: str, same_content_id: str):
+        """Share the chunks of an indexed file with a file having the same content
+
+        Args:
+            file_id: the id of the new file
+            same_content_id: the id of the indexed file with the same content
+        """
+        with Session(engine) as session:
+            rows = session.execute(
+                select(self.Index.target_id, self.Index.relation_type).where(
+                    self.Index.source_id == same_content_id,
+                    self.Index.relation_type.in_(["document", "vector"]),
+                )
+            ).all()
+            if rows:
+                session.execute(
+                    insert(self.Index),
+                    [
+                        {
+                            "source_id": file_id,
+                            "target_id": target_id,
+                            "relation_type": relation_type,
+                        }
+                        for target_id, relation_type in rows
+                    ],
+                )
+
+            # the shared chunks keep the `file_id` metadata of the original file
+            source = session.execute(
+                select(self.Source).where(self.Source.id == same_content_id)
+            ).first()
+            item = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()
+            if source and item:
+                item[0].note["shared_file_ids"] = [same_content_id] + source[
+                    0
+                ].note.get("shared_file_ids", [])
+                session.add(item[0])
+            session.commit()
+        chunk_id_cache.invalidate(self.Index, [file_id])
+        chunk_id_cache.invalidate(self.Source, [file_id])
+        if self.index_id is not None:
+            answer_cache.invalidate(self.index_id, [file_id])
+
     def finish(self, file_id: str, file_path: Path) -> str:
         """Finish the indexing"""
         with Session(engine) as session:
@@ -520,6 +1112,11 @@ class IndexPipeline(BaseComponent):
             session.add(item)
             session.commit()
 
+        # update the full-text index once per file rather than once per batch
+        refresh_fts_index = getattr(self.DS, "refresh_fts_index", None)
+        if refresh_fts_index is not None:
+            refresh_fts_index()
+
         return file_id
 
     def get_token_func(self):
@@ -532,35 +1129,26 @@ class IndexPipeline(BaseComponent):
         Args:
             file_id: the file id
         """
-        with Session(engine) as session:
-            session.execute(delete(self.Source).where(self.Source.id == file_id))
-            vs_ids, ds_ids = [], []
-            index = session.execute(
-                select(self.Index).where(self.Index.source_id == file_id)
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(each[0].target_id)
-                elif each[0].relation_type == "document":
-                    ds_ids.append(each[0].target_id)
-                session.delete(each[0])
-            session.commit()
-
-        if vs_ids and self.VS:
-            self.VS.delete(vs_ids)
-        if ds_ids:
-            self.DS.delete(ds_ids)
+        remove_file(self.Source, self.Index, self.VS, self.DS, file_id, self.index_id)
 
     def run(
         self, file_path: str | Path, reindex: bool, **kwargs
     ) -> tuple[str, list[Document]]:
         raise NotImplementedError
 
-    def stream(
-        self, file_path: str | Path, reindex: bool, **kwargs
-    ) -> Generator[Document, None, tuple[str, list[Document]]]:
-        # check for duplication
-        file_path = Path(file_path).resolve()
+    def register_file(
+        self, file_path: Path, reindex: bool
+    ) -> Generator[Document, None, tuple[str, bool]]:
+        """Check for duplication and add the file record to the db
+
+        A file with the same name is updated in place (if `reindex`), so that its
+        unchanged chunks can be reused. A file with the same content as an indexed
+        file shares the chunks of that file.
+
+        Returns:
+            the file id, and whether the file chunks are already indexed
+        """
+        file_hash = self.hash_file(file_path)
         file_id = self.get_id_if_exists(file_path)
         if file_id is not None:
             if not reindex:
@@ -568,27 +1156,96 @@ class IndexPipeline(BaseComponent):
                     f"File {file_path.name} already indexed. Please rerun with "
                     "reindex=True to force reindexing."
                 )
-            else:
-                # remove the existing records
-                yield Document(f" => Removing old {file_path.name}", channel="debug")
-                self.delete_file(file_id)
-                file_id = self.store_file(file_path)
-        else:
-            # add record to db
-            file_id = self.store_file(file_path)
+            yield Document(f" => Updating old {file_path.name}", channel="debug")
+            self.update_file(file_id, file_path, file_hash)
+            return file_id, False
+
+        same_content_id = self.get_id_by_content(file_hash)
+        file_id = self.store_file(file_path, file_hash)
+        if same_content_id is None:
+            return file_id, False
+
+        yield Document(
+            f" => Reusing the chunks of an identical file for {file_path.name}",
+            channel="debug",
+        )
+        self.link_file(file_id, same_content_id)
+        return file_id, True
 
-        # extract the file
+    def get_extra_info(self, file_path: Path, file_id: str) -> dict:
+        """Get the metadata to attach to every document loaded from the file"""
         extra_info = default_file_metadata_func(str(file_path))
         extra_info["file_id"] = file_id
         extra_info["collection_name"] = self.collection_name
+        return extra_info
+
+    def stream(
+        self, file_path: str | Path, reindex: bool, **kwargs
+    ) -> Generator[Document, None, tuple[str, list[Document]]]:
+        # check for duplication
+        file_path = Path(file_path).resolve()
+        file_id, is_indexed = yield from self.register_file(file_path, reindex)
+        if is_indexed:
+            return (yield from self.stream_indexed(file_path, file_id))
+
+        # extract the file
+        extra_info = self.get_extra_info(file_path, file_id)
 
         yield Document(f" => Converting {file_path.name} to text", channel="debug")
-        docs = self.loader.load_data(file_path, extra_info=extra_info)
-        yield Document(f" => Converted {file_path.name} to text", channel="debug")
+        if self.keep_docs:
+            docs = self.loader.load_data(file_path, extra_info=extra_info)
+        else:
+            docs = lazy_load(self.loader, file_path, extra_info)
+        if isinstance(docs, list):
+            # otherwise the file is converted while its chunks are stored
+            yield Document(f" => Converted {file_path.name} to text", channel="debug")
         yield from self.handle_docs(docs, file_id, file_path.name)
 
         self.finish(file_id, file_path)
 
+        yield Document(f" => Finished indexing {file_path.name}", channel="debug")
+        return file_id, docs if isinstance(docs, list) else []
+
+    def stream_indexed(
+        self, file_path: Path, file_id: str
+    ) -> Generator[Document, None, tuple[str, list[Document]]]:
+        """Finish a file whose chunks are shared from an identical file"""
+        with Session(engine) as session:
+            ds_ids = [
+                each[0]
+                for each in session.execute(
+                    select(self.Index.target_id).where(
+                        self.Index.source_id == file_id,
+                        self.Index.relation_type == "document",
+                    )
+                ).all()
+            ]
+        docs = self.DS.get(ds_ids) if ds_ids else []
+
+        self.finish(file_id, file_path)
+
+        yield Document(f" => Finished indexing {file_path.name}", channel="debug")
+        return file_id, docs
+
+    def stream_chunks(
+        self,
+        file_path: Path,
+        file_id: str,
+        docs: list[Document],
+        to_index_chunks: list[Document],
+    ) -> Generator[Document, None, tuple[str, list[Document]]]:
+        """Index a file that was already loaded and split (e.g. in a worker process)
+
+        Args:
+            file_path: the resolved path to the file
+            file_id: the file id returned by `register_file`
+            docs: the documents returned by the loader
+            to_index_chunks: the chunks returned by `split_docs`
+        """
+        yield from self.handle_chunks(to_index_chunks, file_id, file_path.name)
+
+        self.finish(file_id, file_path)
+
         yield Document(f" => Finished indexing {file_path.name}", channel="debug")
         return file_id, docs
 
@@ -608,6 +1265,8 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     reader_mode: str = Param("default", help="The reader mode")
     embedding: BaseEmbeddings
     run_embedding_in_thread: bool = False
+    # number of worker processes to load and split files, 1 to index sequentially
+    max_workers: int = getattr(settings, "FILE_INDEX_PIPELINE_MAX_WORKERS", 1)
 
     @Param.auto(depends_on="reader_mode")
     def readers(self):
@@ -671,6 +1330,14 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 "the suitable pipeline for this file type in the settings."
             )
 
+        if isinstance(reader, PDFThumbnailReader):
+            # keep the page thumbnails as files rather than in the docstore
+            reader.thumbnail_dir = str(self.FSPath / "thumbnails")
+            if self.max_workers > 1:
+                # the files are already read in `max_workers` processes, a
+                # rendering pool in each of them would multiply the processes
+                reader.max_workers = 1
+
         print("Using reader", reader)
         pipeline: IndexPipeline = IndexPipeline(
             loader=reader,
@@ -681,6 +1348,7 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 backup_separators=["\n", ".", "\u200B"],
             ),
             run_embedding_in_thread=self.run_embedding_in_thread,
+            index_id=self.index_id,
             Source=self.Source,
             Index=self.Index,
             VS=self.VS,
@@ -707,6 +1375,9 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         if not isinstance(file_paths, list):
             file_paths = [file_paths]
 
+        if self.max_workers > 1 and len(file_paths) > 1:
+            return (yield from self.stream_parallel(file_paths, reindex, **kwargs))
+
         file_ids: list[str | None] = []
         errors: list[str | None] = []
         all_docs = []
@@ -745,3 +1416,147 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 )
 
         return file_ids, errors, all_docs
+
+    def stream_parallel(
+        self, file_paths: list[str | Path], reindex: bool = False, **kwargs
+    ) -> Generator[
+        Document, None, tuple[list[str | None], list[str | None], list[Document]]
+    ]:
+        """Index the files with a pool of `max_workers` processes
+
+        Loading and splitting run in the worker processes, at most `max_workers`
+        files ahead of the file currently being indexed. Embedding and storage
+        writes run in the calling process, one file at a time and in the input
+        order, so the debug and index messages are streamed in the same order as
+        the sequential mode.
+        """
+        file_ids: list[str | None] = []
+        errors: list[str | None] = []
+        all_docs = []
+
+        n_files = len(file_paths)
+        pending_paths = iter(enumerate(file_paths))
+        jobs: deque[dict] = deque()
+
+        def submit_next(executor: ProcessPoolExecutor) -> bool:
+            """Register the next file and send it to the pool"""
+            try:
+                idx, file_path = next(pending_paths)
+            except StopIteration:
+                return False
+
+            job: dict = {"idx": idx, "file_path": Path(file_path), "messages": []}
+            jobs.append(job)
+            try:
+                resolved_path = job["file_path"].resolve()
+                pipeline = self.route(job["file_path"])
+                register = pipeline.register_file(resolved_path, reindex)
+                try:
+                    while True:
+                        job["messages"].append(next(register))
+                except StopIteration as e:
+                    file_id, is_indexed = e.value
+
+                job.update(
+                    pipeline=pipeline,
+                    resolved_path=resolved_path,
+                    file_id=file_id,
+                    is_indexed=is_indexed,
+                )
+                if is_indexed:
+                    return True
+
+                extra_info = pipeline.get_extra_info(resolved_path, file_id)
+                job["extra_info"] = extra_info
+                try:
+                    splitter = pipeline.splitter.dump() if pipeline.splitter else None
+                except Exception:
+                    splitter = pipeline.splitter
+                if _is_picklable(pipeline.loader, splitter, extra_info):
+                    job["future"] = executor.submit(
+                        load_and_split,
+                        pipeline.loader,
+                        splitter,
+                        str(resolved_path),
+                        extra_info,
+                    )
+                else:
+                    logger.warning(
+                        f"Cannot send {pipeline.loader} to worker processes, "
+                        f"{job['file_path'].name} will be loaded in this process"
+                    )
+            except Exception as e:
+                job["error"] = e
+
+            return True
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            for _ in range(self.max_workers):
+                if not submit_next(executor):
+                    break
+
+            while jobs:
+                job = jobs.popleft()
+                # keep the pool busy while this file is being embedded
+                submit_next(executor)
+
+                file_path = job["file_path"]
+                yield Document(
+                    content=f"Indexing [{job['idx']+1}/{n_files}]: {file_path.name}",
+                    channel="debug",
+                )
+
+                try:
+                    if "error" in job:
+                        raise job["error"]
+
+                    yield from job["messages"]
+                    pipeline = job["pipeline"]
+                    if job["is_indexed"]:
+                        file_id, docs = yield from pipeline.stream_indexed(
+                            job["resolved_path"], job["file_id"]
+                        )
+                    else:
+                        yield Document(
+                            f" => Converting {file_path.name} to text",
+                            channel="debug",
+                        )
+                        future: Future | None = job.get("future")
+                        if future is not None:
+                            docs, to_index_chunks = future.result()
+                        else:
+                            docs, to_index_chunks = load_and_split(
+                                pipeline.loader,
+                                pipeline.splitter,
+                                str(job["resolved_path"]),
+                                job["extra_info"],
+                            )
+                        yield Document(
+                            f" => Converted {file_path.name} to text",
+                            channel="debug",
+                        )
+
+                        file_id, docs = yield from pipeline.stream_chunks(
+                            job["resolved_path"], job["file_id"], docs, to_index_chunks
+                        )
+                    all_docs.extend(docs)
+                    file_ids.append(file_id)
+                    errors.append(None)
+                    yield Document(
+                        content={"file_path": file_path, "status": "success"},
+                        channel="index",
+                    )
+                except Exception as e:
+                    logger.exception(e)
+                    file_ids.append(None)
+                    errors.append(str(e))
+                    yield Document(
+                        content={
+                            "file_path": file_path,
+                            "status": "failed",
+                            "message": str(e),
+                        },
+                        channel="index",
+                    )
+
+        return file_ids, errors, all_docs
@@ -5,7 +5,7 @@ import tempfile
 import zipfile
 from copy import deepcopy
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Optional
 
 import gradio as gr
 import pandas as pd
@@ -18,6 +18,9 @@ from sqlalchemy import select
 from sqlalchemy.orm import Session
 from theflow.settings import settings as flowsettings
 
+from .chunk_ids import chunk_id_cache
+from .jobs import indexing_jobs
+
 DOWNLOAD_MESSAGE = "Press again to download"
 
 
@@ -168,8 +171,9 @@ class FileIndexPage(BasePage):
                         "tokens",
                         "loader",
                         "date_created",
+                        "status",
                     ],
-                    column_widths=["0%", "50%", "8%", "7%", "15%", "20%"],
+                    column_widths=["0%", "42%", "8%", "7%", "15%", "18%", "10%"],
                     interactive=False,
                     wrap=False,
                     elem_id="file_list_view",
@@ -231,44 +235,37 @@ class FileIndexPage(BasePage):
             # get the chunks
 
             Index = self._index._resources["Index"]
-            with Session(engine) as session:
-                matches = session.execute(
-                    select(Index).where(
-                        Index.source_id == file_id,
-                        Index.relation_type == "document",
-                    )
-                )
-                doc_ids = [doc.target_id for (doc,) in matches]
-                docs = self._index._docstore.get(doc_ids)
-                docs = sorted(
-                    docs, key=lambda x: x.metadata.get("page_label", float("inf"))
-                )
+            doc_ids = chunk_id_cache.get(Index, [file_id])
+            docs = self._index._docstore.get(doc_ids)
+            docs = sorted(
+                docs, key=lambda x: x.metadata.get("page_label", float("inf"))
+            )
 
-                for idx, doc in enumerate(docs):
-                    title = html.escape(
-                        f"{doc.text[:50]}..." if len(doc.text) > 50 else doc.text
+            for idx, doc in enumerate(docs):
+                title = html.escape(
+                    f"{doc.text[:50]}..." if len(doc.text) > 50 else doc.text
+                )
+                doc_type = doc.metadata.get("type", "text")
+                content = ""
+                if doc_type == "text":
+                    content = html.escape(doc.text)
+                elif doc_type == "table":
+                    content = Render.table(doc.text)
+                elif doc_type == "image":
+                    content = Render.image(
+                        url=doc.metadata.get("image_origin", ""), text=doc.text
                     )
-                    doc_type = doc.metadata.get("type", "text")
-                    content = ""
-                    if doc_type == "text":
-                        content = html.escape(doc.text)
-                    elif doc_type == "table":
-                        content = Render.table(doc.text)
-                    elif doc_type == "image":
-                        content = Render.image(
-                            url=doc.metadata.get("image_origin", ""), text=doc.text
-                        )
 
-                    header_prefix = f"[{idx+1}/{len(docs)}]"
-                    if doc.metadata.get("page_label"):
-                        header_prefix += f" [Page {doc.metadata['page_label']}]"
+                header_prefix = f"[{idx+1}/{len(docs)}]"
+                if doc.metadata.get("page_label"):
+                    header_prefix += f" [Page {doc.metadata['page_label']}]"
 
-                    chunks.append(
-                        Render.collapsible(
-                            header=f"{header_prefix} {title}",
-                            content=content,
-                        )
+                chunks.append(
+                    Render.collapsible(
+                        header=f"{header_prefix} {title}",
+                        content=content,
                     )
+                )
         return (
             gr.update(value="".join(chunks), visible=file_id is not None),
             gr.update(visible=file_id is not None),
@@ -277,34 +274,25 @@ class FileIndexPage(BasePage):
         )
 
     def delete_event(self, file_id):
+        from .pipelines import remove_file
+
+        Source = self._index._resources["Source"]
         file_name = ""
         with Session(engine) as session:
             source = session.execute(
-                select(self._index._resources["Source"]).where(
-                    self._index._resources["Source"].id == file_id
-                )
+                select(Source.name).where(Source.id == file_id)
             ).first()
             if source:
-                file_name = source[0].name
-                session.delete(source[0])
-
-            vs_ids, ds_ids = [], []
-            index = session.execute(
-                select(self._index._resources["Index"]).where(
-                    self._index._resources["Index"].source_id == file_id
-                )
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(each[0].target_id)
-                elif each[0].relation_type == "document":
-                    ds_ids.append(each[0].target_id)
-                session.delete(each[0])
-            session.commit()
-
-        if vs_ids:
-            self._index._vs.delete(vs_ids)
-        self._index._docstore.delete(ds_ids)
+                file_name = source[0]
+
+        remove_file(
+            Source,
+            self._index._resources["Index"],
+            self._index._vs,
+            self._index._docstore,
+            file_id,
+            self._index.id,
+        )
 
         gr.Info(f"File {file_name} has been deleted")
 
@@ -775,6 +763,14 @@ class FileIndexPage(BasePage):
             num /= 1024.0
         return f"{num:.0f}Yi{suffix}"
 
+    def format_job_status(self, status: Optional[dict]) -> str:
+        """Format the status of the background embedding job of a file"""
+        if status is None or status["status"] in ("done", "cancelled"):
+            return "ready"
+        if status["status"] == "failed":
+            return f"failed: {status['error']}"
+        return f"embedding {status['done']}/{status['total']}"
+
     def list_file(self, user_id, name_pattern=""):
         if user_id is None:
             # not signed in
@@ -787,11 +783,13 @@ class FileIndexPage(BasePage):
                         "tokens": "-",
                         "loader": "-",
                         "date_created": "-",
+                        "status": "-",
                     }
                 ]
             )
 
         Source = self._index._resources["Source"]
+        job_status = indexing_jobs.status(self._index.id)
         with Session(engine) as session:
             statement = select(Source)
             if self._index.config.get("private", False):
@@ -808,6 +806,7 @@ class FileIndexPage(BasePage):
                     ),
                     "loader": each[0].note.get("loader", "-"),
                     "date_created": each[0].date_created.strftime("%Y-%m-%d %H:%M:%S"),
+                    "status": self.format_job_status(job_status.get(each[0].id)),
                 }
                 for each in session.execute(statement).all()
             ]
@@ -824,6 +823,7 @@ class FileIndexPage(BasePage):
                         "tokens": "-",
                         "loader": "-",
                         "date_created": "-",
+                        "status": "-",
                     }
                 ]
             )
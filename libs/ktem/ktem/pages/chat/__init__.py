@@ -1,7 +1,9 @@
 import asyncio
 import csv
+import time
 from copy import deepcopy
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 from typing import Optional
 
@@ -11,6 +13,7 @@ from ktem.app import BasePage
 from ktem.components import reasonings
 from ktem.db.models import Conversation, engine
 from ktem.index.file.ui import File
+from ktem.reasoning.cache import answer_cache
 from ktem.reasoning.prompt_optimization.suggest_conversation_name import (
     SuggestConvNamePipeline,
 )
@@ -25,7 +28,9 @@ from .chat_panel import ChatPanel
 from .chat_suggestion import ChatSuggestion
 from .common import STATE
 from .control import ConversationControl
+from .history import load_panels, migrate_data_source, save_turn
 from .report import ReportIssue
+from .stream import chat_stream_metrics, iter_windows
 
 DEFAULT_SETTING = "(default)"
 INFO_PANEL_SCALES = {True: 8, False: 4}
@@ -472,6 +477,7 @@ class ChatPage(BasePage):
         self.chat_panel.chatbot.select(
             self.message_selected,
             inputs=[
+                self.chat_control.conversation_id,
                 self.state_retrieval_history,
                 self.state_plot_history,
             ],
@@ -540,8 +546,8 @@ class ChatPage(BasePage):
         if not conv_id:
             id_, update = self.chat_control.new_conv(user_id)
             with Session(engine) as session:
-                statement = select(Conversation).where(Conversation.id == id_)
-                name = session.exec(statement).one().name
+                statement = select(Conversation.name).where(Conversation.id == id_)
+                name = session.exec(statement).one()
                 new_conv_id = id_
                 conv_update = update
                 new_conv_name = name
@@ -660,6 +666,7 @@ class ChatPage(BasePage):
         with Session(engine) as session:
             statement = select(Conversation).where(Conversation.id == convo_id)
             result = session.exec(statement).one()
+            migrate_data_source(session, result)
 
             data_source = result.data_source
             old_selecteds = data_source.get("selected", {})
@@ -668,15 +675,19 @@ class ChatPage(BasePage):
             # Write down to db
             result.data_source = {
                 "selected": selecteds_ if is_owner else old_selecteds,
-                "messages": messages,
-                "retrieval_messages": retrival_history,
-                "plot_history": plot_history,
                 "state": state,
                 "likes": deepcopy(data_source.get("likes", [])),
             }
+            result.date_updated = datetime.utcnow()
             session.add(result)
             session.commit()
 
+        # only the new (or regenerated) turn is written
+        if messages:
+            save_turn(
+                convo_id, len(messages) - 1, messages[-1], retrieval_msg, plot_data
+            )
+
         return retrival_history, plot_history
 
     def reasoning_changed(self, reasoning_type):
@@ -699,9 +710,31 @@ class ChatPage(BasePage):
             session.add(result)
             session.commit()
 
-    def message_selected(self, retrieval_history, plot_history, msg: gr.SelectData):
+    def message_selected(
+        self, convo_id, retrieval_history, plot_history, msg: gr.SelectData
+    ):
         index = msg.index[0]
-        return retrieval_history[index], plot_history[index]
+        if index < len(retrieval_history) and retrieval_history[index] is not None:
+            return retrieval_history[index], plot_history[index]
+
+        # the panels of the older turns are loaded on demand
+        retrieval, plot = load_panels(convo_id, index)
+        if index < len(retrieval_history):
+            retrieval_history[index], plot_history[index] = retrieval, plot
+        return retrieval, plot
+
+    def _index_selections(self, selecteds) -> list:
+        """Get the file selection of each index from the selector components"""
+        selections = []
+        for index in self._app.index_manager.indices:
+            index_selected = []
+            if isinstance(index.selector, int):
+                index_selected = selecteds[index.selector]
+            if isinstance(index.selector, tuple):
+                for i in index.selector:
+                    index_selected.append(selecteds[i])
+            selections.append((index, index_selected))
+        return selections
 
     def create_pipeline(
         self,
@@ -742,13 +775,7 @@ class ChatPage(BasePage):
 
         # get retrievers
         retrievers = []
-        for index in self._app.index_manager.indices:
-            index_selected = []
-            if isinstance(index.selector, int):
-                index_selected = selecteds[index.selector]
-            if isinstance(index.selector, tuple):
-                for i in index.selector:
-                    index_selected.append(selecteds[i])
+        for index, index_selected in self._index_selections(selecteds):
             iretrievers = index.get_retriever_pipelines(
                 settings, user_id, index_selected
             )
@@ -775,7 +802,13 @@ class ChatPage(BasePage):
         user_id,
         *selecteds,
     ):
-        """Chat function"""
+        """Chat function
+
+        The pipeline responses are coalesced in time windows, and only the outputs
+        of the channels that changed in a window are sent to the browser.
+        """
+        stream_id = chat_stream_metrics.start()
+        cpu_start = time.thread_time()
         chat_input = chat_history[-1][0]
         chat_history = chat_history[:-1]
 
@@ -793,6 +826,9 @@ class ChatPage(BasePage):
             flowsettings, "KH_CHAT_MSG_PLACEHOLDER", "Thinking ..."
         )
         print(msg_placeholder)
+        pipeline_id = pipeline.get_info()["id"]
+        state[pipeline_id] = reasoning_state["pipeline"]
+        chat_stream_metrics.add_cpu_time(stream_id, time.thread_time() - cpu_start)
         yield (
             chat_history + [(chat_input, text or msg_placeholder)],
             refs,
@@ -801,51 +837,105 @@ class ChatPage(BasePage):
             state,
         )
 
-        for response in pipeline.stream(chat_input, conversation_id, chat_history):
-
-            if not isinstance(response, Document):
-                continue
+        responses = pipeline.stream(chat_input, conversation_id, chat_history)
+        if answer_cache.enabled:
+            # the regenerated answers replace the cached ones
+            cache_key = answer_cache.context_key(
+                pipeline_id,
+                llm_type,
+                settings,
+                chat_history,
+                [
+                    (index.id, index_selected)
+                    for index, index_selected in self._index_selections(selecteds)
+                ],
+            )
+            responses = answer_cache.stream(
+                cache_key,
+                chat_input,
+                responses,
+                refresh=state["app"].get("regen", False),
+            )
 
-            if response.channel is None:
-                continue
+        windows = iter_windows(
+            responses,
+            interval=getattr(flowsettings, "KH_CHAT_STREAM_INTERVAL", 0.05),
+            max_chars=getattr(flowsettings, "KH_CHAT_STREAM_MAX_CHARS", 256),
+            on_cpu_time=partial(chat_stream_metrics.add_cpu_time, stream_id),
+        )
+        emitted = False
+        try:
+            for window in windows:
+                cpu_start = time.thread_time()
+                text_changed = refs_changed = plot_changed = False
+                for response in window:
+                    if not isinstance(response, Document):
+                        continue
 
-            if response.channel == "chat":
-                if response.content is None:
-                    text = ""
-                else:
-                    text += response.content
-
-            if response.channel == "info":
-                if response.content is None:
-                    refs = ""
-                else:
-                    refs += response.content
-
-            if response.channel == "plot":
-                plot = response.content
-                plot_gr = self._json_to_plot(plot)
-
-            state[pipeline.get_info()["id"]] = reasoning_state["pipeline"]
-            yield (
-                chat_history + [(chat_input, text or msg_placeholder)],
-                refs,
-                plot_gr,
-                plot,
-                state,
-            )
+                    if response.channel is None:
+                        continue
 
-        if not text:
-            empty_msg = getattr(
-                flowsettings, "KH_CHAT_EMPTY_MSG_PLACEHOLDER", "(Sorry, I don't know)"
-            )
-            print(f"Generate nothing: {empty_msg}")
-            yield (
-                chat_history + [(chat_input, text or empty_msg)],
-                refs,
-                plot_gr,
-                plot,
-                state,
-            )
+                    if response.channel == "chat":
+                        if response.content is None:
+                            text = ""
+                        else:
+                            text += response.content
+                        text_changed = True
+
+                    if response.channel == "info":
+                        if response.content is None:
+                            refs = ""
+                        else:
+                            refs += response.content
+                        refs_changed = True
+
+                    if response.channel == "plot":
+                        plot = response.content
+                        plot_gr = self._json_to_plot(plot)
+                        plot_changed = True
+
+                if text_changed and text:
+                    chat_stream_metrics.first_token(stream_id)
+                chat_stream_metrics.add_cpu_time(
+                    stream_id, time.thread_time() - cpu_start
+                )
+                if not (text_changed or refs_changed or plot_changed):
+                    continue
+
+                yield (
+                    (
+                        chat_history + [(chat_input, text or msg_placeholder)]
+                        if text_changed
+                        else gr.update()
+                    ),
+                    refs if refs_changed else gr.update(),
+                    plot_gr if plot_changed else gr.update(),
+                    plot if plot_changed else gr.update(),
+                    gr.update(),
+                )
+                emitted = True
+
+            # the pipeline state is sent once, after the responses changed it
+            state[pipeline_id] = reasoning_state["pipeline"]
+            if not text:
+                empty_msg = getattr(
+                    flowsettings,
+                    "KH_CHAT_EMPTY_MSG_PLACEHOLDER",
+                    "(Sorry, I don't know)",
+                )
+                print(f"Generate nothing: {empty_msg}")
+                yield (
+                    chat_history + [(chat_input, text or empty_msg)],
+                    refs,
+                    plot_gr,
+                    plot,
+                    state,
+                )
+            elif emitted:
+                yield gr.update(), gr.update(), gr.update(), gr.update(), state
+        finally:
+            windows.close()
+            chat_stream_metrics.finish(stream_id)
 
     def regen_fn(
         self,
@@ -8,8 +8,8 @@ from sqlmodel import Session, or_, select
 
 import flowsettings
 
-from ...utils.conversation import sync_retrieval_n_message
 from .common import STATE
+from .history import delete_turns, load_turns, migrate_data_source
 
 logger = logging.getLogger(__name__)
 ASSETS_DIR = "assets/icons"
@@ -130,7 +130,7 @@ class ConversationControl(BasePage):
             # - can_not_see: only see their conversations
             if can_see_public:
                 statement = (
-                    select(Conversation)
+                    select(Conversation.name, Conversation.id)
                     .where(
                         or_(
                             Conversation.user == user_id,
@@ -143,14 +143,15 @@ class ConversationControl(BasePage):
                 )
             else:
                 statement = (
-                    select(Conversation)
+                    select(Conversation.name, Conversation.id)
                     .where(Conversation.user == user_id)
                     .order_by(Conversation.date_created.desc())  # type: ignore
                 )
 
+            # only the listed columns are loaded, not the data source
             results = session.exec(statement).all()
-            for result in results:
-                options.append((result.name, result.id))
+            for name, id_ in results:
+                options.append((name, id_))
 
         return options
 
@@ -191,6 +192,7 @@ class ConversationControl(BasePage):
             statement = select(Conversation).where(Conversation.id == conversation_id)
             result = session.exec(statement).one()
 
+            delete_turns(session, conversation_id)
             session.delete(result)
             session.commit()
 
@@ -207,6 +209,9 @@ class ConversationControl(BasePage):
             statement = select(Conversation).where(Conversation.id == conversation_id)
             try:
                 result = session.exec(statement).one()
+                if migrate_data_source(session, result):
+                    session.commit()
+                    session.refresh(result)
                 id_ = result.id
                 name = result.name
                 is_conv_public = result.is_public
@@ -218,16 +223,9 @@ class ConversationControl(BasePage):
                 else:
                     selected = {}
 
-                chats = result.data_source.get("messages", [])
-
-                retrieval_history: list[str] = result.data_source.get(
-                    "retrieval_messages", []
-                )
-                plot_history: list[dict] = result.data_source.get("plot_history", [])
-
-                # On initialization
-                # Ensure len of retrieval and messages are equal
-                retrieval_history = sync_retrieval_n_message(chats, retrieval_history)
+                # the retrieval panels and plots of the older turns are loaded
+                # when the user selects them
+                chats, retrieval_history, plot_history = load_turns(id_)
 
                 info_panel = (
                     retrieval_history[-1]
@@ -0,0 +1,163 @@
+"""Storage of the conversation turns
+
+Each turn of a conversation is stored as a row of `ConversationTurn`, with its
+retrieval panel and plot in `ConversationRetrieval` and `ConversationPlot`, so
+that persisting a turn only writes this turn. The retrieval panels and plots of
+the older turns are loaded when the user selects them.
+"""
+from typing import Optional
+
+from ktem.db.models import (
+    Conversation,
+    ConversationPlot,
+    ConversationRetrieval,
+    ConversationTurn,
+    engine,
+)
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+# the keys of the legacy data source, moved to the turn tables
+LEGACY_KEYS = ("messages", "retrieval_messages", "plot_history")
+
+TURN_TABLES = (ConversationTurn, ConversationRetrieval, ConversationPlot)
+
+
+def _delete_from(session: Session, conversation_id: str, position: int = 0):
+    """Delete the rows of the turns of the conversation from the position"""
+    for table in TURN_TABLES:
+        session.execute(
+            delete(table).where(
+                table.conversation_id == conversation_id,  # type: ignore
+                table.position >= position,  # type: ignore
+            )
+        )
+
+
+def _add_turn(
+    session: Session,
+    conversation_id: str,
+    position: int,
+    message: list,
+    retrieval: Optional[str],
+    plot: Optional[dict],
+):
+    user_message, bot_message = (list(message) + [None, None])[:2]
+    session.add(
+        ConversationTurn(
+            conversation_id=conversation_id,
+            position=position,
+            user_message=user_message,
+            bot_message=bot_message,
+        )
+    )
+    if retrieval:
+        session.add(
+            ConversationRetrieval(
+                conversation_id=conversation_id, position=position, content=retrieval
+            )
+        )
+    if plot:
+        session.add(
+            ConversationPlot(
+                conversation_id=conversation_id, position=position, data=plot
+            )
+        )
+
+
+def migrate_data_source(session: Session, conversation: Conversation) -> bool:
+    """Move the turns stored in the data source of a conversation (legacy format)
+    to the turn tables, return whether the conversation was migrated
+
+    The session is committed by the caller.
+    """
+    data_source = conversation.data_source or {}
+    if not any(key in data_source for key in LEGACY_KEYS):
+        return False
+
+    messages = data_source.get("messages", [])
+    retrievals = data_source.get("retrieval_messages", [])
+    plots = data_source.get("plot_history", [])
+
+    _delete_from(session, conversation.id)
+    for position, message in enumerate(messages):
+        _add_turn(
+            session,
+            conversation.id,
+            position,
+            message,
+            retrievals[position] if position < len(retrievals) else None,
+            plots[position] if position < len(plots) else None,
+        )
+
+    conversation.data_source = {
+        key: value for key, value in data_source.items() if key not in LEGACY_KEYS
+    }
+    session.add(conversation)
+    return True
+
+
+def save_turn(
+    conversation_id: str,
+    position: int,
+    message: list,
+    retrieval: Optional[str],
+    plot: Optional[dict],
+):
+    """Store the turn at the position, replacing it (regeneration) and dropping
+    the later turns if any
+    """
+    with Session(engine) as session:
+        _delete_from(session, conversation_id, position)
+        _add_turn(session, conversation_id, position, message, retrieval, plot)
+        session.commit()
+
+
+def load_turns(
+    conversation_id: str,
+) -> tuple[list[list], list[Optional[str]], list[Optional[dict]]]:
+    """Load the messages of the conversation, with the retrieval panel and plot
+    of the last turn only
+
+    Returns:
+        the messages, and the retrieval panels and plots of the turns, None for
+        the ones not loaded yet
+    """
+    with Session(engine) as session:
+        turns = session.exec(
+            select(ConversationTurn.user_message, ConversationTurn.bot_message)
+            .where(ConversationTurn.conversation_id == conversation_id)
+            .order_by(ConversationTurn.position)  # type: ignore
+        ).all()
+
+    messages = [[user_message, bot_message] for user_message, bot_message in turns]
+    retrievals: list[Optional[str]] = [None] * len(messages)
+    plots: list[Optional[dict]] = [None] * len(messages)
+    if messages:
+        retrievals[-1], plots[-1] = load_panels(conversation_id, len(messages) - 1)
+
+    return messages, retrievals, plots
+
+
+def load_panels(conversation_id: str, position: int) -> tuple[str, Optional[dict]]:
+    """Load the retrieval panel and plot of a turn"""
+    with Session(engine) as session:
+        retrieval = session.exec(
+            select(ConversationRetrieval.content).where(
+                ConversationRetrieval.conversation_id == conversation_id,
+                ConversationRetrieval.position == position,
+            )
+        ).first()
+        plot = session.exec(
+            select(ConversationPlot.data).where(
+                ConversationPlot.conversation_id == conversation_id,
+                ConversationPlot.position == position,
+            )
+        ).first()
+
+    return retrieval or "", plot
+
+
+def delete_turns(session: Session, conversation_id: str):
+    """Delete all the turns of the conversation, committed by the caller"""
+    _delete_from(session, conversation_id)
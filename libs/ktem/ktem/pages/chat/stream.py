@@ -0,0 +1,194 @@
+"""Coalescing of the responses streamed by the reasoning pipelines, and the
+metrics of the chat streams
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+
+from kotaemon.base import Document
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Error:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _chat_size(response) -> int:
+    if (
+        isinstance(response, Document)
+        and response.channel == "chat"
+        and isinstance(response.content, str)
+    ):
+        return len(response.content)
+    return 0
+
+
+def iter_windows(
+    responses: Iterable,
+    interval: float,
+    max_chars: int,
+    on_cpu_time: Optional[Callable[[float], None]] = None,
+) -> Iterator[list]:
+    """Group the streamed responses into windows
+
+    The responses are consumed in a background thread. A window is emitted
+    `interval` seconds after the previous one, or as soon as it holds `max_chars`
+    characters of chat text. A response arriving after a quiet period longer than
+    `interval` (e.g. the first token) is emitted right away.
+
+    Args:
+        responses: the responses streamed by the pipeline
+        interval: the minimum number of seconds between two windows
+        max_chars: the number of chat characters that flushes a window early
+        on_cpu_time: called with the CPU time spent consuming the responses
+    """
+    items: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def produce():
+        cpu_start = time.thread_time()
+        iterator = iter(responses)
+        try:
+            for item in iterator:
+                items.put(item)
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            items.put(_Error(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            if on_cpu_time is not None:
+                on_cpu_time(time.thread_time() - cpu_start)
+            items.put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    window: list = []
+    chars, last_emit, done = 0, float("-inf"), False
+    try:
+        while not done:
+            timeout = None
+            if window:
+                timeout = max(0.0, last_emit + interval - time.monotonic())
+
+            timed_out = False
+            try:
+                item = items.get(timeout=timeout)
+            except queue.Empty:
+                timed_out = True
+            else:
+                if item is _DONE:
+                    done = True
+                elif isinstance(item, _Error):
+                    raise item.error
+                else:
+                    window.append(item)
+                    chars += _chat_size(item)
+
+            if window and (
+                done
+                or timed_out
+                or chars >= max_chars
+                or time.monotonic() - last_emit >= interval
+            ):
+                yield window
+                window, chars = [], 0
+                last_emit = time.monotonic()
+    finally:
+        stop.set()
+
+
+class ChatStreamMetrics:
+    """Time-to-first-token and server CPU time of the chat streams
+
+    Args:
+        history_size: the number of finished streams kept for the statistics
+    """
+
+    def __init__(self, history_size: int = 1000):
+        self._lock = threading.Lock()
+        self._active: dict[int, dict] = {}
+        self._finished: deque = deque(maxlen=history_size)
+        self._next_id = 0
+
+    def start(self) -> int:
+        """Start recording a stream, return its id"""
+        with self._lock:
+            stream_id = self._next_id
+            self._next_id += 1
+            self._active[stream_id] = {
+                "start": time.monotonic(),
+                "ttft": None,
+                "cpu_time": 0.0,
+            }
+        return stream_id
+
+    def first_token(self, stream_id: int):
+        """Record the time to the first token, if not already recorded"""
+        with self._lock:
+            record = self._active.get(stream_id)
+            if record is not None and record["ttft"] is None:
+                record["ttft"] = time.monotonic() - record["start"]
+
+    def add_cpu_time(self, stream_id: int, seconds: float):
+        with self._lock:
+            record = self._active.get(stream_id)
+            if record is not None:
+                record["cpu_time"] += seconds
+
+    def finish(self, stream_id: int):
+        """Stop recording a stream"""
+        with self._lock:
+            record = self._active.pop(stream_id, None)
+            if record is None:
+                return
+            record["duration"] = time.monotonic() - record.pop("start")
+            self._finished.append(record)
+
+        logger.info(
+            "Chat stream finished: ttft=%s, cpu=%.3fs, duration=%.3fs",
+            "-" if record["ttft"] is None else f"{record['ttft']:.3f}s",
+            record["cpu_time"],
+            record["duration"],
+        )
+
+    def stats(self) -> dict:
+        """Get the statistics of the active and the recently finished streams"""
+        with self._lock:
+            now = time.monotonic()
+            active = [
+                {
+                    "elapsed": now - record["start"],
+                    "ttft": record["ttft"],
+                    "cpu_time": record["cpu_time"],
+                }
+                for record in self._active.values()
+            ]
+            finished = list(self._finished)
+
+        ttfts = sorted(rec["ttft"] for rec in finished if rec["ttft"] is not None)
+        return {
+            "active_chats": len(active),
+            "active": active,
+            "finished_chats": len(finished),
+            "avg_ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+            "p95_ttft": ttfts[int(0.95 * (len(ttfts) - 1))] if ttfts else None,
+            "avg_cpu_time": (
+                sum(rec["cpu_time"] for rec in finished) / len(finished)
+                if finished
+                else None
+            ),
+        }
+
+
+chat_stream_metrics = ChatStreamMetrics()
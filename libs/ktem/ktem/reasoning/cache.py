@@ -0,0 +1,302 @@
+"""Cache of the answers of the reasoning pipelines
+
+The answers are keyed on the normalized question, and on the context of the
+question: the reasoning pipeline, the LLM, the settings, the chat history and the
+selected files. A cached answer is replayed (chat, info and plot channels)
+without running the pipeline. When `KH_ANSWER_CACHE_SIMILARITY` is set, a
+question whose embedding is that similar to a cached question of the same
+context is also answered from the cache.
+
+The selected files are stamped with a version, bumped by the file indices when a
+file is indexed, re-indexed or deleted, so the answers based on a changed file
+are not replayed anymore.
+
+The cache can be configured in the flowsettings:
+    - KH_ANSWER_CACHE: enable the cache
+    - KH_ANSWER_CACHE_SIZE: maximum number of cached answers
+    - KH_ANSWER_CACHE_TTL: number of seconds an answer is valid
+    - KH_ANSWER_CACHE_SIMILARITY: minimum cosine similarity of the question
+      embeddings to reuse an answer, None to only reuse the answers of the same
+      normalized question
+"""
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from hashlib import sha256
+from typing import Any, Generator, Iterable, Optional
+
+import numpy as np
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document
+
+logger = logging.getLogger(__name__)
+
+CACHED_CHANNELS = ("chat", "info", "plot")
+# the channels whose contents are appended to each other by the chat page
+APPENDED_CHANNELS = ("chat", "info")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize the question, so that trivially different questions (case,
+    whitespaces, final punctuation) share the same cache entry
+    """
+    question = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(question.split()).rstrip(" ?!.")
+
+
+class AnswerCache:
+    """Cache the answers of the reasoning pipelines in memory
+
+    Args:
+        enabled: whether to cache the answers
+        max_size: the maximum number of cached answers, the least recently used
+            are evicted
+        ttl: the number of seconds an answer is valid
+        similarity: the minimum cosine similarity of the question embeddings to
+            reuse an answer, None to only reuse the answers of the same
+            normalized question
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        similarity: Optional[float] = None,
+    ):
+        self.enabled = (
+            enabled
+            if enabled is not None
+            else getattr(flowsettings, "KH_ANSWER_CACHE", False)
+        )
+        self.max_size = max_size or getattr(flowsettings, "KH_ANSWER_CACHE_SIZE", 1000)
+        self.ttl = ttl or getattr(flowsettings, "KH_ANSWER_CACHE_TTL", 24 * 3600)
+        self.similarity = (
+            similarity
+            if similarity is not None
+            else getattr(flowsettings, "KH_ANSWER_CACHE_SIMILARITY", None)
+        )
+
+        self._lock = threading.Lock()
+        # (context key, question) -> (time, question embedding, responses)
+        self._entries: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        self._index_versions: dict[Any, int] = defaultdict(int)
+        self._file_versions: dict[tuple[Any, str], int] = defaultdict(int)
+
+        self.hits = 0
+        self.misses = 0
+
+    def context_key(
+        self,
+        reasoning_id: str,
+        llm_name: Optional[str],
+        settings: dict,
+        history: list,
+        selections: Iterable[tuple[Any, Any]],
+    ) -> str:
+        """Get the key of the context of a question
+
+        Args:
+            reasoning_id: the id of the reasoning pipeline
+            llm_name: the name of the LLM chosen for the chat, if any
+            settings: the settings of the app
+            history: the chat history
+            selections: the (index id, file selection) of each index, where the
+                file selection of the file indices is (mode, file ids, user id)
+        """
+        stamps = []
+        with self._lock:
+            for index_id, selection in selections:
+                if (
+                    isinstance(selection, (list, tuple))
+                    and len(selection) == 3
+                    and selection[0] == "select"
+                ):
+                    # the explicitly selected files
+                    stamps.append(
+                        [
+                            index_id,
+                            selection[2],
+                            sorted(
+                                [file_id, self._file_versions[(index_id, file_id)]]
+                                for file_id in selection[1] or []
+                            ),
+                        ]
+                    )
+                else:
+                    # e.g. all the files of the index
+                    stamps.append([index_id, selection, self._index_versions[index_id]])
+
+        content = json.dumps(
+            [reasoning_id, llm_name, settings, history, stamps],
+            sort_keys=True,
+            default=str,
+        )
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    def invalidate(self, index_id: Any, file_ids: Optional[list[str]] = None):
+        """Stop replaying the answers based on the files of the index, or on any
+        file of the index if `file_ids` is None
+        """
+        with self._lock:
+            self._index_versions[index_id] += 1
+            for file_id in file_ids or []:
+                self._file_versions[(index_id, file_id)] += 1
+
+    def stats(self) -> dict:
+        """Get the cache hit/miss counters"""
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": size,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    def clear(self):
+        """Remove all the answers and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        from ktem.embeddings.manager import embedding_models_manager
+
+        try:
+            embedding = embedding_models_manager.get_default()(question)[0].embedding
+        except Exception as e:
+            logger.warning(f"Cannot embed the question for the answer cache: {e}")
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _lookup(
+        self, context_key: str, question: str
+    ) -> tuple[Optional[list], Optional[np.ndarray]]:
+        """Get the cached responses of the question, and the question embedding
+        if it was computed
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((context_key, question))
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end((context_key, question))
+                return entry[2], None
+
+            candidates = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if key[0] == context_key
+                and entry[1] is not None
+                and now - entry[0] < self.ttl
+            ]
+
+        if self.similarity is None:
+            return None, None
+
+        embedding = self._embed(question)
+        if embedding is None or not candidates:
+            return None, embedding
+
+        similarities = np.stack([entry[1] for _, entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity:
+            return None, embedding
+
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry[2], embedding
+
+    def _store(
+        self,
+        context_key: str,
+        question: str,
+        embedding: Optional[np.ndarray],
+        responses: list,
+    ):
+        with self._lock:
+            self._entries[(context_key, question)] = (
+                time.monotonic(),
+                embedding,
+                responses,
+            )
+            self._entries.move_to_end((context_key, question))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stream(
+        self,
+        context_key: str,
+        question: str,
+        responses: Iterable,
+        refresh: bool = False,
+    ) -> Generator:
+        """Replay the cached answer of the question, or stream and cache the
+        responses of the pipeline
+
+        Args:
+            context_key: the key of the context of the question
+            question: the question
+            responses: the responses streamed by the pipeline, consumed only if the
+                answer is not cached
+            refresh: ignore the cached answer (e.g. to regenerate it)
+        """
+        if not self.enabled:
+            yield from responses
+            return
+
+        question = normalize_question(question)
+        cached, embedding = None, None
+        if not refresh:
+            cached, embedding = self._lookup(context_key, question)
+
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            elif not refresh:
+                self.misses += 1
+            hits, misses = self.hits, self.misses
+        if not refresh:
+            logger.info(
+                f"Answer cache {'hit' if cached is not None else 'miss'}, "
+                f"hit rate {hits / (hits + misses):.2%}"
+            )
+
+        if cached is not None:
+            for channel, content in cached:
+                yield Document(channel=channel, content=content)
+            return
+
+        recorded: list[list] = []
+        for response in responses:
+            if isinstance(response, Document) and response.channel in CACHED_CHANNELS:
+                last = recorded[-1] if recorded else None
+                if (
+                    last is not None
+                    and last[0] == response.channel
+                    and response.channel in APPENDED_CHANNELS
+                    and isinstance(last[1], str)
+                    and isinstance(response.content, str)
+                ):
+                    last[1] += response.content
+                else:
+                    recorded.append([response.channel, response.content])
+            yield response
+
+        # only the complete answers are cached
+        if any(channel == "chat" and content for channel, content in recorded):
+            if embedding is None and self.similarity is not None:
+                embedding = self._embed(question)
+            self._store(context_key, question, embedding, recorded)
+
+
+answer_cache = AnswerCache()
@@ -1,9 +1,10 @@
 import html
 import logging
+import queue
 import threading
+import time
 from collections import defaultdict
-from difflib import SequenceMatcher
-from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Generator
 
 import numpy as np
@@ -14,6 +15,7 @@ from ktem.reasoning.prompt_optimization import (
     RewriteQuestionPipeline,
 )
 from ktem.utils.render import Render
+from ktem.utils.span_index import get_substring_index, warm_substring_indices
 from theflow.settings import settings as flowsettings
 
 from kotaemon.base import (
@@ -46,100 +48,158 @@ def find_text(search_span, context):
     matches = []
     # don't search for small text
     if len(search_span) > 5:
+        index = get_substring_index(context)
         for sentence in sentence_list:
-            match = SequenceMatcher(
-                None, sentence, context, autojunk=False
-            ).find_longest_match()
-            if match.size > len(sentence) * 0.35:
-                matches.append((match.b, match.b + match.size))
+            _, start, size = index.longest_match(sentence)
+            if size > len(sentence) * 0.35:
+                matches.append((start, start + size))
 
     return matches
 
 
+_encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def stream_in_background(
+    executor: ThreadPoolExecutor, stream: Generator, stop: threading.Event
+) -> Generator:
+    """Run a stream in the executor, and replay its outputs as they are produced
+
+    The returned generator yields the outputs of the stream, then returns its
+    return value or raises its exception. The stream is closed once `stop` is set.
+    """
+    outputs: queue.Queue = queue.Queue()
+
+    def consume():
+        try:
+            while not stop.is_set():
+                try:
+                    outputs.put(("output", next(stream)))
+                except StopIteration as e:
+                    outputs.put(("return", e.value))
+                    return
+            stream.close()
+        except Exception as e:
+            outputs.put(("error", e))
+
+    def replay():
+        while True:
+            kind, value = outputs.get()
+            if kind == "output":
+                yield value
+            elif kind == "return":
+                return value
+            else:
+                raise value
+
+    # submitted now, rather than when the replay starts
+    executor.submit(consume)
+    return replay()
+
+
 class PrepareEvidencePipeline(BaseComponent):
     """Prepare the evidence text from the list of retrieved documents
 
     This step usually happens after `DocumentRetrievalPipeline`.
 
+    The documents are packed in their retrieval order until `max_context_length`
+    tokens are reached, the last one being trimmed to fit. The token counts
+    recorded at indexing time (`token_count` metadata) are used when available,
+    and the content of the documents left out is never tokenized.
+
     Args:
         trim_func: a callback function or a BaseComponent, that splits a large
             chunk of text into smaller ones. The first one will be retained.
+            If set, it is applied to the packed evidence.
     """
 
     max_context_length: int = 32000
     trim_func: TokenSplitter | None = None
 
     def run(self, docs: list[RetrievedDocument]) -> Document:
-        evidence = ""
+        pieces: list[str] = []
+        seen_contents: set[str] = set()
         images = []
         table_found = 0
         evidence_modes = []
-
-        evidence_trim_func = (
-            self.trim_func
-            if self.trim_func
-            else TokenSplitter(
-                chunk_size=self.max_context_length,
-                chunk_overlap=0,
-                separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
-                ),
-            )
-        )
+        budget = self.max_context_length
 
         for _id, retrieved_item in enumerate(docs):
-            retrieved_content = ""
+            if budget <= 0:
+                break
+
             page = retrieved_item.metadata.get("page_label", None)
             source = filename = retrieved_item.metadata.get("file_name", "-")
             if page:
                 source += f" (Page {page})"
+
+            # the token count of the content, if known without tokenizing
+            n_tokens = None
+            image = None
             if retrieved_item.metadata.get("type", "") == "table":
                 evidence_modes.append(EVIDENCE_MODE_TABLE)
-                if table_found < 5:
-                    retrieved_content = retrieved_item.metadata.get(
-                        "table_origin", retrieved_item.text
-                    )
-                    if retrieved_content not in evidence:
-                        table_found += 1
-                        evidence += (
-                            f"<br><b>Table from {source}</b>\n"
-                            + retrieved_content
-                            + "\n<br>"
-                        )
+                if table_found >= 5:
+                    continue
+                retrieved_content = retrieved_item.metadata.get(
+                    "table_origin", retrieved_item.text
+                )
+                if retrieved_content in seen_contents:
+                    continue
+                table_found += 1
+                header, footer = f"<br><b>Table from {source}</b>\n", "\n<br>"
             elif retrieved_item.metadata.get("type", "") == "chatbot":
                 evidence_modes.append(EVIDENCE_MODE_CHATBOT)
                 retrieved_content = retrieved_item.metadata["window"]
-                evidence += (
-                    f"<br><b>Chatbot scenario from {filename} (Row {page})</b>\n"
-                    + retrieved_content
-                    + "\n<br>"
-                )
+                header = f"<br><b>Chatbot scenario from {filename} (Row {page})</b>\n"
+                footer = "\n<br>"
             elif retrieved_item.metadata.get("type", "") == "image":
                 evidence_modes.append(EVIDENCE_MODE_FIGURE)
-                retrieved_content = retrieved_item.metadata.get("image_origin", "")
                 retrieved_caption = html.escape(retrieved_item.get_content())
-                evidence += (
+                header = (
                     f"<br><b>Figure from {source}</b>\n"
                     + "<img width='85%' src='<src>' "
                     + f"alt='{retrieved_caption}'/>"
-                    + "\n<br>"
                 )
-                images.append(retrieved_content)
+                retrieved_content, footer = "", "\n<br>"
+                image = retrieved_item.metadata.get("image_origin", "")
             else:
                 if "window" in retrieved_item.metadata:
                     retrieved_content = retrieved_item.metadata["window"]
                 else:
                     retrieved_content = retrieved_item.text
+                    n_tokens = retrieved_item.metadata.get("token_count")
                 retrieved_content = retrieved_content.replace("\n", " ")
-                if retrieved_content not in evidence:
-                    evidence += (
-                        f"<br><b>Content from {source}: </b> "
-                        + retrieved_content
-                        + " \n<br>"
-                    )
+                if retrieved_content in seen_contents:
+                    continue
+                header = f"<br><b>Content from {source}: </b> "
+                footer = " \n<br>"
+
+            budget -= count_tokens(header + footer)
+            if budget <= 0:
+                break
+            if retrieved_content:
+                seen_contents.add(retrieved_content)
+            if n_tokens is None and len(retrieved_content.encode("utf-8")) <= budget:
+                # a token is at least one byte, the content fits anyway
+                n_tokens = count_tokens(retrieved_content)
+            if n_tokens is None or n_tokens > budget:
+                # only the last packed document is tokenized to be trimmed
+                tokens = _encoding.encode(retrieved_content, disallowed_special=())
+                n_tokens = len(tokens)
+                if n_tokens > budget:
+                    retrieved_content = _encoding.decode(tokens[:budget])
+                    n_tokens = budget
+
+            pieces.append(header + retrieved_content + footer)
+            if image is not None:
+                images.append(image)
+            budget -= n_tokens
+
+        evidence = "".join(pieces)
 
         # resolve evidence mode
         evidence_mode = EVIDENCE_MODE_TEXT
@@ -148,10 +208,9 @@ class PrepareEvidencePipeline(BaseComponent):
         elif EVIDENCE_MODE_TABLE in evidence_modes:
             evidence_mode = EVIDENCE_MODE_TABLE
 
-        # trim context by trim_len
-        print("len (original)", len(evidence))
-        if evidence:
-            texts = evidence_trim_func([Document(text=evidence)])
+        print("len (packed)", len(evidence), "tokens left", budget)
+        if evidence and self.trim_func:
+            texts = self.trim_func([Document(text=evidence)])
             evidence = texts[0].text
             print("len (trimmed)", len(evidence))
 
@@ -453,6 +512,7 @@ class FullQAPipeline(BaseReasoning):
     # configuration parameters
     trigger_context: int = 150
     use_rewrite: bool = False
+    retriever_timeout: float = getattr(flowsettings, "KH_RETRIEVER_TIMEOUT", 60)
 
     retrievers: list[BaseComponent]
 
@@ -480,28 +540,90 @@ class FullQAPipeline(BaseReasoning):
             # like "Hello", "I need help"...
             query = message
 
-        docs, doc_ids = [], []
+        # the retrievers run concurrently, the slow ones are left out after the
+        # timeout
+        retriever_nodes = [
+            self._prepare_child(retriever, f"retriever_{idx}")
+            for idx, retriever in enumerate(self.retrievers)
+        ]
+        latencies: dict[int, float] = {}
+
+        def run_retriever(idx: int) -> list[RetrievedDocument]:
+            start = time.perf_counter()
+            try:
+                return retriever_nodes[idx](text=query)
+            finally:
+                latencies[idx] = time.perf_counter() - start
+
+        results: dict[int, list[RetrievedDocument]] = {}
+        debug_info = []
+        executor = ThreadPoolExecutor(
+            max_workers=max(len(retriever_nodes), 1),
+            thread_name_prefix="retriever",
+        )
+        try:
+            futures = {
+                executor.submit(run_retriever, idx): idx
+                for idx in range(len(retriever_nodes))
+            }
+            done, not_done = wait(futures, timeout=self.retriever_timeout)
+            for future in sorted(not_done, key=futures.__getitem__):
+                idx = futures[future]
+                logger.warning(f"Retriever {idx} timed out")
+                debug_info.append(
+                    Document(
+                        f" => Retriever {idx} timed out after "
+                        f"{self.retriever_timeout}s",
+                        channel="debug",
+                    )
+                )
+            for future in sorted(done, key=futures.__getitem__):
+                idx = futures[future]
+                try:
+                    results[idx] = future.result()
+                except Exception as e:
+                    logger.exception(f"Retriever {idx} failed")
+                    debug_info.append(
+                        Document(f" => Retriever {idx} failed: {e}", channel="debug")
+                    )
+                    continue
+                logger.info(f"Retriever {idx} took {latencies[idx]:.3f}s")
+                debug_info.append(
+                    Document(
+                        f" => Retriever {idx}: {len(results[idx])} documents in "
+                        f"{latencies[idx]:.3f}s",
+                        channel="debug",
+                    )
+                )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # merge the ranked lists rank by rank, the best scored first within a rank,
+        # so that no retriever crowds out the others; a document returned by
+        # several retrievers keeps its best scored copy at its best rank
+        best_docs: dict[str, RetrievedDocument] = {}
+        best_ranks: dict[str, tuple[int, float]] = {}
         plot_docs = []
-
-        for idx, retriever in enumerate(self.retrievers):
-            retriever_node = self._prepare_child(retriever, f"retriever_{idx}")
-            retriever_docs = retriever_node(text=query)
-
-            retriever_docs_text = []
-            retriever_docs_plot = []
-
-            for doc in retriever_docs:
+        for idx in sorted(results):
+            rank = 0
+            for doc in results[idx]:
                 if doc.metadata.get("type", "") == "plot":
-                    retriever_docs_plot.append(doc)
-                else:
-                    retriever_docs_text.append(doc)
-
-            for doc in retriever_docs_text:
-                if doc.doc_id not in doc_ids:
-                    docs.append(doc)
-                    doc_ids.append(doc.doc_id)
-
-            plot_docs.extend(retriever_docs_plot)
+                    plot_docs.append(doc)
+                    continue
+                score = doc.score or 0.0
+                if doc.doc_id not in best_docs or score > (
+                    best_docs[doc.doc_id].score or 0.0
+                ):
+                    best_docs[doc.doc_id] = doc
+                sort_key = (rank, -score)
+                if doc.doc_id not in best_ranks or sort_key < best_ranks[doc.doc_id]:
+                    best_ranks[doc.doc_id] = sort_key
+                rank += 1
+
+        docs = [
+            best_docs[doc_id]
+            for doc_id in sorted(best_ranks, key=lambda doc_id: best_ranks[doc_id])
+        ]
 
         info = [
             Document(
@@ -517,7 +639,7 @@ class FullQAPipeline(BaseReasoning):
             for doc in plot_docs
         ]
 
-        return docs, info
+        return docs, debug_info + info
 
     def prepare_citations(self, answer, docs) -> tuple[list[Document], list[Document]]:
         """Prepare the citations to show on the UI"""
@@ -663,6 +785,13 @@ class FullQAPipeline(BaseReasoning):
 
         evidence_mode, evidence, images = self.evidence_pipeline(docs).content
 
+        # index the documents for the citations while the answer is generated
+        threading.Thread(
+            target=warm_substring_indices,
+            args=([doc.text for doc in docs],),
+            daemon=True,
+        ).start()
+
         def generate_relevant_scores():
             nonlocal docs
             docs = self.retrievers[0].generate_relevant_scores(message, docs)
@@ -808,36 +937,83 @@ class FullQAPipeline(BaseReasoning):
 
 
 class FullDecomposeQAPipeline(FullQAPipeline):
+    """Decompose the question into sub-questions, answer them, then answer the
+    question with the sub-answers as additional evidence
+
+    With `concurrent_sub_questions`, the sub-questions are retrieved and answered
+    concurrently, as well as the retrieval for the main question. Their answers
+    are still streamed in order.
+    """
+
+    concurrent_sub_questions: bool = getattr(
+        flowsettings, "KH_DECOMPOSE_CONCURRENT", True
+    )
+
+    def answer_sub_question(
+        self, idx: int, message: str, conv_id: str, history: list, **kwargs
+    ) -> Generator[Document, None, Document]:
+        """Retrieve and answer one sub-question"""
+        start = time.perf_counter()
+
+        # should populate the context
+        docs, infos = self.retrieve(message, history)
+        print(f"Got {len(docs)} retrieved documents")
+
+        yield from infos
+
+        evidence_mode, evidence, images = self.evidence_pipeline(docs).content
+        answer = yield from self.answering_pipeline.stream(
+            question=message,
+            history=history,
+            evidence=evidence,
+            evidence_mode=evidence_mode,
+            images=images,
+            conv_id=conv_id,
+            **kwargs,
+        )
+
+        yield Document(
+            f" => Sub-question {idx + 1} answered in "
+            f"{time.perf_counter() - start:.3f}s",
+            channel="debug",
+        )
+        return answer
+
     def answer_sub_questions(
         self, messages: list, conv_id: str, history: list, **kwargs
     ):
-        output_str = ""
-        for idx, message in enumerate(messages):
-            yield Document(
-                channel="chat",
-                content=f"<br><b>Sub-question {idx + 1}</b>"
-                f"<br>{message}<br><b>Answer</b><br>",
-            )
-            # should populate the context
-            docs, infos = self.retrieve(message, history)
-            print(f"Got {len(docs)} retrieved documents")
-
-            yield from infos
-
-            evidence_mode, evidence, images = self.evidence_pipeline(docs).content
-            answer = yield from self.answering_pipeline.stream(
-                question=message,
-                history=history,
-                evidence=evidence,
-                evidence_mode=evidence_mode,
-                images=images,
-                conv_id=conv_id,
-                **kwargs,
-            )
+        streams = [
+            self.answer_sub_question(idx, message, conv_id, history, **kwargs)
+            for idx, message in enumerate(messages)
+        ]
 
-            output_str += (
-                f"Sub-question {idx + 1}-th: '{message}'\nAnswer: '{answer.text}'\n\n"
+        executor, stop = None, threading.Event()
+        if self.concurrent_sub_questions and len(streams) > 1:
+            executor = ThreadPoolExecutor(
+                max_workers=len(streams), thread_name_prefix="sub-question"
             )
+            streams = [
+                stream_in_background(executor, stream, stop) for stream in streams
+            ]
+
+        output_str = ""
+        try:
+            for idx, (message, stream) in enumerate(zip(messages, streams)):
+                yield Document(
+                    channel="chat",
+                    content=f"<br><b>Sub-question {idx + 1}</b>"
+                    f"<br>{message}<br><b>Answer</b><br>",
+                )
+                answer = yield from stream
+
+                output_str += (
+                    f"Sub-question {idx + 1}-th: '{message}'\n"
+                    f"Answer: '{answer.text}'\n\n"
+                )
+        finally:
+            if executor is not None:
+                stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
 
         return output_str
 
@@ -845,6 +1021,7 @@ class FullDecomposeQAPipeline(FullQAPipeline):
         self, message: str, conv_id: str, history: list, **kwargs  # type: ignore
     ) -> Generator[Document, None, Document]:
         sub_question_answer_output = ""
+        main_retrieval: Future | None = None
         if self.rewrite_pipeline:
             print("Chosen rewrite pipeline", self.rewrite_pipeline)
             result = self.rewrite_pipeline(question=message)
@@ -856,6 +1033,15 @@ class FullDecomposeQAPipeline(FullQAPipeline):
                 and len(result) > 0
                 and isinstance(result[0], Document)
             ):
+                if self.concurrent_sub_questions:
+                    # retrieve for the main question while the sub-questions are
+                    # answered
+                    executor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="main-question"
+                    )
+                    main_retrieval = executor.submit(self.retrieve, message, history)
+                    executor.shutdown(wait=False)
+
                 yield Document(
                     channel="chat",
                     content="<h4>Sub questions and their answers</h4>",
@@ -870,7 +1056,10 @@ class FullDecomposeQAPipeline(FullQAPipeline):
         )
 
         # should populate the context
-        docs, infos = self.retrieve(message, history)
+        if main_retrieval is not None:
+            docs, infos = main_retrieval.result()
+        else:
+            docs, infos = self.retrieve(message, history)
         print(f"Got {len(docs)} retrieved documents")
         yield from infos
 
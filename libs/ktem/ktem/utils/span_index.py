@@ -0,0 +1,105 @@
+"""Index of a text to locate the spans quoted from it, e.g. the citations"""
+from functools import lru_cache
+from typing import Iterable
+
+
+class SubstringIndex:
+    """Suffix automaton of a text
+
+    Once built in linear time of the text length, it finds the longest substring
+    of a query that occurs in the text in linear time of the query length.
+
+    Args:
+        text: the text to index
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+        # for each state: suffix link, length of its longest string, transitions,
+        # and end position of the first occurrence of its strings in the text
+        link = [-1]
+        length = [0]
+        transitions: list[dict[str, int]] = [{}]
+        first_end = [-1]
+
+        last = 0
+        for pos, char in enumerate(text):
+            cur = len(length)
+            link.append(-1)
+            length.append(length[last] + 1)
+            transitions.append({})
+            first_end.append(pos)
+
+            state = last
+            while state != -1 and char not in transitions[state]:
+                transitions[state][char] = cur
+                state = link[state]
+
+            if state == -1:
+                link[cur] = 0
+            else:
+                next_state = transitions[state][char]
+                if length[state] + 1 == length[next_state]:
+                    link[cur] = next_state
+                else:
+                    clone = len(length)
+                    link.append(link[next_state])
+                    length.append(length[state] + 1)
+                    transitions.append(transitions[next_state].copy())
+                    first_end.append(first_end[next_state])
+                    while state != -1 and transitions[state].get(char) == next_state:
+                        transitions[state][char] = clone
+                        state = link[state]
+                    link[next_state] = clone
+                    link[cur] = clone
+            last = cur
+
+        self._link = link
+        self._length = length
+        self._transitions = transitions
+        self._first_end = first_end
+
+    def longest_match(self, query: str) -> tuple[int, int, int]:
+        """Find the longest substring of the query that occurs in the text
+
+        Like `difflib.SequenceMatcher(None, query, text, autojunk=False)
+        .find_longest_match()`, the earliest match in the query, then in the text,
+        is returned among the longest ones.
+
+        Returns:
+            the start in the query, the start in the text and the size of the match
+        """
+        link, length = self._link, self._length
+        transitions, first_end = self._transitions, self._first_end
+
+        best_query_start, best_text_start, best_size = 0, 0, 0
+        state, size = 0, 0
+        for pos, char in enumerate(query):
+            while state and char not in transitions[state]:
+                state = link[state]
+                size = length[state]
+            next_state = transitions[state].get(char)
+            if next_state is None:
+                state, size = 0, 0
+                continue
+
+            state, size = next_state, size + 1
+            if size > best_size:
+                best_size = size
+                best_query_start = pos - size + 1
+                best_text_start = first_end[state] - size + 1
+
+        return best_query_start, best_text_start, best_size
+
+
+@lru_cache(maxsize=64)
+def get_substring_index(text: str) -> SubstringIndex:
+    """Get the index of a text, built once for the texts searched repeatedly"""
+    return SubstringIndex(text)
+
+
+def warm_substring_indices(texts: Iterable[str]):
+    """Build the indices of the texts ahead of the searches"""
+    for text in texts:
+        get_substring_index(text)
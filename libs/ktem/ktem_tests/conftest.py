@@ -0,0 +1,62 @@
+import itertools
+import os
+from hashlib import sha256
+
+import pytest
+
+# must be set before the ktem modules read the settings
+os.environ["THEFLOW_SETTINGS_MODULE"] = "ktem_tests.flowsettings"
+
+from kotaemon.base import DocumentWithEmbedding  # noqa: E402
+from kotaemon.embeddings import BaseEmbeddings  # noqa: E402
+
+_index_ids = itertools.count(1)
+
+
+class FakeEmbeddings(BaseEmbeddings):
+    """Embed the texts into deterministic vectors, without any model"""
+
+    def invoke(self, text, *args, **kwargs) -> list[DocumentWithEmbedding]:
+        return [
+            DocumentWithEmbedding(
+                content=doc.text,
+                embedding=[byte / 255 for byte in sha256(doc.text.encode()).digest()],
+            )
+            for doc in self.prepare_input(text)
+        ]
+
+
+@pytest.fixture(scope="function")
+def file_index():
+    """A file index with its own tables, docstore and vectorstore"""
+    from ktem.db.engine import engine
+    from ktem.index.file.index import FileIndex
+
+    index = FileIndex(app=None, id=next(_index_ids), name="test", config={})
+    index._setup_resources()
+    index._resources["Source"].metadata.create_all(engine)
+    index._resources["Index"].metadata.create_all(engine)
+    index._fs_path.mkdir(parents=True, exist_ok=True)
+    return index
+
+
+@pytest.fixture(scope="function")
+def indexing_pipeline(file_index):
+    """Get an indexing pipeline of the file index"""
+    from ktem.index.file.pipelines import IndexDocumentPipeline
+
+    def get_pipeline(**params) -> IndexDocumentPipeline:
+        return IndexDocumentPipeline(
+            embedding=FakeEmbeddings(),
+            Source=file_index._resources["Source"],
+            Index=file_index._resources["Index"],
+            VS=file_index._vs,
+            DS=file_index._docstore,
+            FSPath=file_index._fs_path,
+            user_id=1,
+            private=False,
+            index_id=file_index.id,
+            **params,
+        )
+
+    return get_pipeline
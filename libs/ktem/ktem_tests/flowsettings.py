@@ -0,0 +1,17 @@
+"""Settings of the ktem tests: a temporary SQLite database and file stores"""
+import tempfile
+from pathlib import Path
+
+from theflow.settings.default import *  # noqa
+
+KH_APP_DATA_DIR = Path(tempfile.mkdtemp(prefix="ktem_tests_"))
+KH_DATABASE = f"sqlite:///{KH_APP_DATA_DIR / 'sql.db'}"
+KH_FILESTORAGE_PATH = str(KH_APP_DATA_DIR / "files")
+KH_DOCSTORE = {
+    "__type__": "kotaemon.storages.SimpleFileDocumentStore",
+    "path": str(KH_APP_DATA_DIR / "docstore"),
+}
+KH_VECTORSTORE = {
+    "__type__": "kotaemon.storages.SimpleFileVectorStore",
+    "path": str(KH_APP_DATA_DIR / "vectorstore"),
+}
@@ -0,0 +1,250 @@
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+
+def index_files(pipeline, file_paths: list[Path], reindex: bool = False):
+    """Run the indexing pipeline, return the file ids and the errors"""
+    stream = pipeline.stream(file_paths, reindex=reindex)
+    try:
+        while True:
+            next(stream)
+    except StopIteration as e:
+        file_ids, errors, _ = e.value
+    return file_ids, errors
+
+
+def get_chunk_ids(file_index, file_id: str, relation_type: str = "document"):
+    from ktem.db.engine import engine
+
+    Index = file_index._resources["Index"]
+    with Session(engine) as session:
+        return {
+            target_id
+            for (target_id,) in session.execute(
+                select(Index.target_id).where(
+                    Index.source_id == file_id, Index.relation_type == relation_type
+                )
+            )
+        }
+
+
+def get_jobs(file_index, file_id: str):
+    from ktem.db.models import IndexingJob, engine
+
+    with Session(engine, expire_on_commit=False) as session:
+        return (
+            session.execute(
+                select(IndexingJob)
+                .where(IndexingJob.index_id == file_index.id)
+                .where(IndexingJob.file_id == file_id)
+                .order_by(IndexingJob.id)
+            )
+            .scalars()
+            .all()
+        )
+
+
+def write_files(tmp_path: Path, contents: dict[str, str]) -> list[Path]:
+    paths = []
+    for name, text in contents.items():
+        path = tmp_path / name
+        path.write_text(text)
+        paths.append(path)
+    return paths
+
+
+def test_index_files_in_worker_processes(file_index, indexing_pipeline, tmp_path):
+    file_paths = write_files(
+        tmp_path,
+        {
+            "first.txt": "The first file.\n\n" + "alpha beta gamma " * 1000,
+            "second.txt": "The second file.\n\n" + "delta epsilon zeta " * 1000,
+        },
+    )
+
+    file_ids, errors = index_files(indexing_pipeline(max_workers=2), file_paths)
+
+    assert errors == [None, None]
+    for file_id in file_ids:
+        chunk_ids = get_chunk_ids(file_index, file_id)
+        assert len(chunk_ids) > 1
+        assert chunk_ids == get_chunk_ids(file_index, file_id, "vector")
+    first_chunks = file_index._docstore.get(
+        list(get_chunk_ids(file_index, file_ids[0]))
+    )
+    assert all(chunk.metadata["file_name"] == "first.txt" for chunk in first_chunks)
+
+
+def test_no_thumbnail_pool_in_worker_processes(
+    indexing_pipeline, tmp_path, monkeypatch
+):
+    from kotaemon.indices.ingests.files import KH_DEFAULT_FILE_EXTRACTORS
+    from kotaemon.loaders import PDFThumbnailReader
+
+    monkeypatch.setattr(KH_DEFAULT_FILE_EXTRACTORS[".pdf"], "max_workers", 4)
+    file_path = tmp_path / "file.pdf"
+
+    loader = indexing_pipeline().route(file_path).loader
+    assert isinstance(loader, PDFThumbnailReader)
+    assert loader.max_workers == 4
+
+    loader = indexing_pipeline(max_workers=2).route(file_path).loader
+    assert loader.max_workers == 1
+
+
+def get_docstore_ids(file_index) -> set[str]:
+    return {doc.doc_id for doc in file_index._docstore.get_all()}
+
+
+def test_reuse_chunks_of_identical_file(file_index, indexing_pipeline, tmp_path):
+    first, second = write_files(
+        tmp_path,
+        {"first.txt": "same content " * 500, "second.txt": "same content " * 500},
+    )
+    (first_id,), _ = index_files(indexing_pipeline(), [first])
+    docstore_ids = get_docstore_ids(file_index)
+
+    (second_id,), errors = index_files(indexing_pipeline(), [second])
+
+    assert errors == [None]
+    assert get_chunk_ids(file_index, second_id) == get_chunk_ids(file_index, first_id)
+    assert get_docstore_ids(file_index) == docstore_ids
+
+
+def test_identical_files_in_same_upload(file_index, indexing_pipeline, tmp_path):
+    file_paths = write_files(
+        tmp_path,
+        {"first.txt": "same content " * 500, "second.txt": "same content " * 500},
+    )
+
+    file_ids, errors = index_files(indexing_pipeline(max_workers=2), file_paths)
+
+    assert errors == [None, None]
+    for file_id in file_ids:
+        assert get_chunk_ids(file_index, file_id)
+
+
+def test_identical_file_after_failed_load(
+    file_index, indexing_pipeline, tmp_path, monkeypatch
+):
+    from kotaemon.loaders import TxtReader
+
+    first, second = write_files(
+        tmp_path,
+        {"first.txt": "same content " * 500, "second.txt": "same content " * 500},
+    )
+    with monkeypatch.context() as patch:
+        patch.setattr(TxtReader, "load_data", lambda *args, **kwargs: 1 / 0)
+        patch.setattr(TxtReader, "lazy_load_data", lambda *args, **kwargs: 1 / 0)
+        _, errors = index_files(indexing_pipeline(), [first])
+    assert errors[0] is not None
+
+    (second_id,), errors = index_files(indexing_pipeline(), [second])
+
+    assert errors == [None]
+    assert get_chunk_ids(file_index, second_id)
+
+
+def test_reindex_reuses_unchanged_chunks(file_index, indexing_pipeline, tmp_path):
+    paragraphs = [f"paragraph {idx} " * 400 for idx in range(4)]
+    (file_path,) = write_files(tmp_path, {"file.txt": "\n\n".join(paragraphs)})
+    (file_id,), _ = index_files(indexing_pipeline(), [file_path])
+    old_ids = get_chunk_ids(file_index, file_id)
+
+    file_path.write_text("\n\n".join(paragraphs[:-1] + ["changed paragraph " * 400]))
+    (new_file_id,), errors = index_files(indexing_pipeline(), [file_path], reindex=True)
+
+    assert errors == [None]
+    assert new_file_id == file_id
+    new_ids = get_chunk_ids(file_index, file_id)
+    assert old_ids & new_ids and old_ids - new_ids and new_ids - old_ids
+    assert new_ids == get_chunk_ids(file_index, file_id, "vector")
+    assert get_docstore_ids(file_index) == new_ids
+
+
+def test_delete_shared_file(file_index, indexing_pipeline, tmp_path):
+    first, second = write_files(
+        tmp_path,
+        {"first.txt": "same content " * 500, "second.txt": "same content " * 500},
+    )
+    (first_id,), _ = index_files(indexing_pipeline(), [first])
+    (second_id,), _ = index_files(indexing_pipeline(), [second])
+    chunk_ids = get_chunk_ids(file_index, first_id)
+
+    indexing_pipeline().route(first).delete_file(first_id)
+
+    assert get_chunk_ids(file_index, second_id) == chunk_ids
+    assert get_docstore_ids(file_index) == chunk_ids
+
+    indexing_pipeline().route(second).delete_file(second_id)
+
+    assert not get_chunk_ids(file_index, second_id)
+    assert not get_docstore_ids(file_index)
+
+
+def test_cache_shared_file_ids(file_index, indexing_pipeline, tmp_path):
+    from ktem.db.engine import engine
+    from ktem.index.file.chunk_ids import chunk_id_cache
+    from sqlalchemy import event
+
+    first, second = write_files(
+        tmp_path,
+        {"first.txt": "same content " * 500, "second.txt": "same content " * 500},
+    )
+    (first_id,), _ = index_files(indexing_pipeline(), [first])
+    (second_id,), _ = index_files(indexing_pipeline(), [second])
+    Source = file_index._resources["Source"]
+    file_ids = chunk_id_cache.get_file_ids(Source, [first_id, second_id])
+    assert file_ids == [first_id, second_id, first_id]
+
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        file_ids = chunk_id_cache.get_file_ids(Source, [first_id, second_id])
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert file_ids == [first_id, second_id, first_id]
+    assert not statements
+
+    indexing_pipeline().route(second).delete_file(second_id)
+
+    assert chunk_id_cache.get_file_ids(Source, [second_id]) == [second_id]
+
+
+def test_failed_reindex_keeps_indexed_chunks(
+    file_index, indexing_pipeline, tmp_path, monkeypatch
+):
+    from kotaemon.base import Document
+    from kotaemon.loaders import TxtReader
+
+    (file_path,) = write_files(tmp_path, {"file.txt": "indexed content " * 500})
+    (file_id,), _ = index_files(
+        indexing_pipeline(run_embedding_in_thread=True), [file_path]
+    )
+    indexed_ids = get_chunk_ids(file_index, file_id)
+    docstore_ids = get_docstore_ids(file_index)
+
+    def lazy_load_data(self, file_path, extra_info=None, **kwargs):
+        # enough documents for several windows before the failure
+        for idx in range(100):
+            yield Document(text=f"new content {idx}", metadata=dict(extra_info))
+        raise ValueError("cannot read the file")
+
+    monkeypatch.setattr(TxtReader, "lazy_load_data", lazy_load_data)
+    file_path.write_text("new content")
+    _, errors = index_files(indexing_pipeline(), [file_path], reindex=True)
+
+    assert errors == ["cannot read the file"]
+    assert get_chunk_ids(file_index, file_id) == indexed_ids
+    assert get_docstore_ids(file_index) == docstore_ids
+    # the embedding of the indexed chunks, cancelled by the re-index, is queued again
+    cancelled, requeued = get_jobs(file_index, file_id)
+    assert cancelled.status == "cancelled"
+    assert requeued.status == "pending"
+    assert set(requeued.chunk_ids) == indexed_ids
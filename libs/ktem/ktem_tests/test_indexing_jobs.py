@@ -0,0 +1,201 @@
+import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import update
+from sqlmodel import Session
+
+from .test_file_index import get_chunk_ids, get_jobs, index_files
+
+
+class JobIndex:
+    """The index of the jobs, whose pipelines embed `batch_size` chunks at once"""
+
+    def __init__(self, file_index, indexing_pipeline, batch_size: int):
+        self.id = file_index.id
+        self.get_pipeline = indexing_pipeline
+        self.batch_size = batch_size
+        self.embedded: list[str] = []
+
+    def route(self, file_path: Path):
+        pipeline = self.get_pipeline().route(file_path)
+
+        def embed(chunks, file_id):
+            pipeline.handle_chunks_vectorstore(chunks, file_id)
+            self.embedded.extend(chunk.doc_id for chunk in chunks)
+
+        return SimpleNamespace(
+            chunk_batch_size=self.batch_size,
+            Index=pipeline.Index,
+            DS=pipeline.DS,
+            handle_chunks_vectorstore=embed,
+        )
+
+    def get_indexing_pipeline(self, settings, user_id):
+        return SimpleNamespace(route=self.route)
+
+
+@pytest.fixture(scope="function")
+def job_queue():
+    from ktem.index.file.jobs import IndexingJobQueue
+
+    queue = IndexingJobQueue(
+        index_concurrency=1, batches_per_minute=0, max_attempts=3, stale_after=60
+    )
+    # the jobs are claimed and run by the tests, not by worker threads
+    queue.workers = 0
+    return queue
+
+
+@pytest.fixture(scope="function")
+def quick_file(file_index, indexing_pipeline, tmp_path):
+    """Index a file in the quick mode, return its path and id"""
+    file_path = tmp_path / "file.txt"
+    file_path.write_text(" ".join(f"word{idx}" for idx in range(3000)))
+    (file_id,), _ = index_files(
+        indexing_pipeline(run_embedding_in_thread=True), [file_path]
+    )
+    return file_path, file_id
+
+
+def set_job(job_id: int, **values):
+    from ktem.db.models import IndexingJob, engine
+
+    with Session(engine) as session:
+        session.execute(
+            update(IndexingJob).where(IndexingJob.id == job_id).values(**values)
+        )
+        session.commit()
+
+
+def test_claim_and_run_job(file_index, indexing_pipeline, job_queue, quick_file):
+    _, file_id = quick_file
+    (job,) = get_jobs(file_index, file_id)
+    assert job.status == "pending"
+    assert not get_chunk_ids(file_index, file_id, "vector")
+
+    index = JobIndex(file_index, indexing_pipeline, batch_size=200)
+    job_queue.register(index)
+    claimed = job_queue._claim()
+
+    assert claimed.id == job.id
+    assert get_jobs(file_index, file_id)[0].status == "running"
+    # a single running job per index
+    assert job_queue._claim() is None
+
+    job_queue._run(claimed)
+
+    (job,) = get_jobs(file_index, file_id)
+    assert job.status == "done"
+    assert job.n_done == len(job.chunk_ids)
+    assert get_chunk_ids(file_index, file_id, "vector") == set(job.chunk_ids)
+
+
+def test_resume_job_after_register(
+    file_index, indexing_pipeline, job_queue, quick_file
+):
+    _, file_id = quick_file
+    index = JobIndex(file_index, indexing_pipeline, batch_size=2)
+    job_queue.register(index)
+    job = job_queue._claim()
+    assert len(job.chunk_ids) > 4
+
+    # interrupt the job after its 2nd batch
+    route = index.route
+
+    def interrupted_route(file_path):
+        pipeline = route(file_path)
+        embed = pipeline.handle_chunks_vectorstore
+
+        def embed_twice(chunks, file_id):
+            if len(index.embedded) >= 4:
+                raise KeyboardInterrupt
+            embed(chunks, file_id)
+
+        pipeline.handle_chunks_vectorstore = embed_twice
+        return pipeline
+
+    index.route = interrupted_route
+    with pytest.raises(KeyboardInterrupt):
+        job_queue._run(job)
+    index.route = route
+    assert get_jobs(file_index, file_id)[0].n_done == 4
+
+    # the running job may be run by another process until it is stale
+    restarted_queue = type(job_queue)(index_concurrency=1, stale_after=60)
+    restarted_queue.workers = 0
+    restarted_queue.register(index)
+    assert get_jobs(file_index, file_id)[0].status == "running"
+
+    set_job(
+        job.id,
+        date_updated=datetime.datetime.utcnow() - datetime.timedelta(seconds=120),
+    )
+    restarted_queue.register(index)
+    resumed = restarted_queue._claim()
+
+    assert resumed.id == job.id
+    assert resumed.n_done == 4
+    restarted_queue._run(resumed)
+
+    (job,) = get_jobs(file_index, file_id)
+    assert job.status == "done"
+    assert sorted(index.embedded) == sorted(job.chunk_ids)
+    assert get_chunk_ids(file_index, file_id, "vector") == set(job.chunk_ids)
+
+
+def test_cancel_job_on_reindex(file_index, indexing_pipeline, quick_file):
+    file_path, file_id = quick_file
+
+    file_path.write_text(" ".join(f"other{idx}" for idx in range(3000)))
+    index_files(
+        indexing_pipeline(run_embedding_in_thread=True), [file_path], reindex=True
+    )
+
+    first, second = get_jobs(file_index, file_id)
+    assert first.status == "cancelled"
+    assert second.status == "pending"
+    assert set(second.chunk_ids) == get_chunk_ids(file_index, file_id)
+
+    # indexing again without the quick mode embeds the chunks right away
+    file_path.write_text(" ".join(f"third{idx}" for idx in range(3000)))
+    index_files(indexing_pipeline(), [file_path], reindex=True)
+
+    assert [job.status for job in get_jobs(file_index, file_id)] == [
+        "cancelled",
+        "cancelled",
+    ]
+    assert get_chunk_ids(file_index, file_id, "vector") == get_chunk_ids(
+        file_index, file_id
+    )
+
+
+def test_retry_job_with_backoff(file_index, indexing_pipeline, job_queue, quick_file):
+    _, file_id = quick_file
+    job_queue.register(JobIndex(file_index, indexing_pipeline, batch_size=200))
+
+    backoffs = []
+    for attempt in range(1, job_queue.max_attempts):
+        job = job_queue._claim()
+        job_queue._fail(job, RuntimeError("embedding failed"))
+        job_queue._running[job.index_id] -= 1
+
+        (job,) = get_jobs(file_index, file_id)
+        assert job.status == "pending"
+        assert job.attempts == attempt
+        assert job.error == "embedding failed"
+        backoffs.append(job.not_before - datetime.datetime.utcnow())
+        # not retried before the end of the backoff
+        assert job_queue._claim() is None
+        set_job(job.id, not_before=datetime.datetime.utcnow())
+
+    assert backoffs[1] > backoffs[0] > datetime.timedelta(seconds=20)
+
+    job = job_queue._claim()
+    job_queue._fail(job, RuntimeError("embedding failed"))
+
+    (job,) = get_jobs(file_index, file_id)
+    assert job.status == "failed"
+    assert job.attempts == job_queue.max_attempts
+    assert job_queue._claim() is None
@@ -0,0 +1,58 @@
+import random
+from difflib import SequenceMatcher
+
+import pytest
+from ktem.utils.span_index import SubstringIndex
+
+
+def find_longest_match(query: str, text: str) -> tuple[int, int, int]:
+    match = SequenceMatcher(None, query, text, autojunk=False).find_longest_match()
+    return match.a, match.b, match.size
+
+
+@pytest.mark.parametrize(
+    "query, text",
+    [
+        ("", ""),
+        ("abc", ""),
+        ("", "abc"),
+        ("xyz", "abc"),
+        ("abc", "abc"),
+        ("b", "abcabc"),
+        ("ab cd", "cd ab"),
+        ("the cat sat", "a cat sat on the mat"),
+        ("aaaa", "aaaaaaa"),
+        ("abab", "babababa"),
+        ("line 1\nline 2", "line 2 and line 1"),
+    ],
+)
+def test_longest_match_cases(query, text):
+    assert SubstringIndex(text).longest_match(query) == find_longest_match(query, text)
+
+
+def test_longest_match_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        alphabet = "ab " if rng.random() < 0.5 else "abcdef \n"
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 60)))
+        index = SubstringIndex(text)
+        for _ in range(5):
+            query = "".join(rng.choices(alphabet, k=rng.randint(0, 20)))
+            assert index.longest_match(query) == find_longest_match(query, text)
+
+
+def test_longest_match_quotes():
+    rng = random.Random(1)
+    words = ["alpha", "beta", "gamma", "delta", "the", "a", "of", "\n"]
+    for _ in range(500):
+        text = " ".join(rng.choices(words, k=rng.randint(1, 80)))
+        start = rng.randint(0, len(text))
+        quote = list(text[start : start + rng.randint(0, 40)])
+        # the errors made when quoting the text
+        for _ in range(rng.randint(0, 3)):
+            if quote:
+                quote[rng.randrange(len(quote))] = rng.choice("xyz ")
+        query = "".join(quote)
+        assert SubstringIndex(text).longest_match(query) == find_longest_match(
+            query, text
+        )